@@ -77,9 +77,12 @@ let cellProvisioningSystemStack = new CellProvisioningSystem(app, 'CellProvision
     description: "Cell provisioning system, used for deployment of cells and tenants.",
     orchestrationBus: bridgeStack.orchestrationEventBus,
     cellManagementTable: cellManagementSystemStack.cellManagementTable,
+    tenantDirectoryTable: cellManagementSystemStack.tenantDirectoryTable,
     s3LoggingBucketArn: bridgeStack.s3LogBucketArn,
     s3CellSourceBucketArn: bridgeStack.cellSourceBucketArn,
     aggregateHttp5xxAlarmName: commonObservabilityStack.aggregateHttp5xxAlarmName,
+    cellToTenantKvsArn: cellRouterStack.cellToTenantKvsArn,
+    crossRegionReferences: true,
     env: {
         account: process.env.CDK_DEFAULT_ACCOUNT,
         region: process.env.CDK_DEFAULT_REGION
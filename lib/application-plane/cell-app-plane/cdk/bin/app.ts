@@ -16,20 +16,25 @@ const env = { account: awsAccountId, region: awsRegion };
 
 const cellId = app.node.tryGetContext('cellId');
 const cellSize = app.node.tryGetContext('cellSize');
+const cellReadReplica = app.node.tryGetContext('cellReadReplica') === 'true';
+const cellConnectionBroker = app.node.tryGetContext('cellConnectionBroker') === 'true';
 
 // Create a new cell
-new CellStack(app, `Cell-${cellId}`, { cellId, cellSize });
+new CellStack(app, `Cell-${cellId}`, { cellId, cellSize, readReplica: cellReadReplica, connectionBroker: cellConnectionBroker });
 
 // Read tenantId, email and priorityBase from context
 const tenantId = app.node.tryGetContext('tenantId');
 const tenantEmail = app.node.tryGetContext('tenantEmail');
 const priorityBase = app.node.tryGetContext('tenantListenerPriorityBase');
 const productImageVersion = app.node.tryGetContext('productImageVersion');
+const productWriteMode = app.node.tryGetContext('productWriteMode');
+const tenantTier = app.node.tryGetContext('tenantTier');
+const tenantSecretName = app.node.tryGetContext('tenantSecretName');
 
 // Check if tenantId is provided in context and instantiate TenantStack if it is
 if (tenantId) {
   const stackName = `Cell-${cellId}-Tenant-${tenantId}`;
-    new CellTenantStack(app, stackName, { cellId, cellSize, tenantId, tenantEmail, priorityBase, productImageVersion, env });
+    new CellTenantStack(app, stackName, { cellId, cellSize, tenantId, tenantEmail, priorityBase, productImageVersion, productWriteMode, tenantTier, tenantSecretName, env });
 }
 
 
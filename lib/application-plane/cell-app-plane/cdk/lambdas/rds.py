@@ -1,53 +1,147 @@
 import boto3
 import os
+import time
+import json
+import re
+import hashlib
+import gzip
+import tempfile
+import urllib.request
 import psycopg
+from psycopg_pool import ConnectionPool
+from concurrent.futures import ThreadPoolExecutor
 
 secrets_manager = boto3.client('secretsmanager')
+ecs = boto3.client('ecs')
+
+# Tenants in these tiers get their products table created as a hash-partitioned table
+PARTITIONED_TENANT_TIERS = [tier.strip().lower() for tier in os.getenv('PARTITIONED_TENANT_TIERS', 'premium').split(',') if tier.strip()]
+PRODUCT_TABLE_PARTITIONS = int(os.getenv('PRODUCT_TABLE_PARTITIONS', '16'))
+PARTITIONING_BATCH_SIZE = int(os.getenv('PARTITIONING_BATCH_SIZE', '5000'))
+PARTITIONING_LOCK_TIMEOUT = os.getenv('PARTITIONING_LOCK_TIMEOUT', '5s')
+# Stop copying when the Lambda has less than this left, so the swap never gets cut off
+PARTITIONING_TIME_RESERVE_MS = 15000
+
+# Tenants in these tiers share one database per cell, each in its own schema owned by the admin role.
+# The tenant role can only use its own schema, and row-level security on tenant_id = current_user
+# guards the tables on top of that. Every other tier gets a database of its own.
+POOLED_TENANT_TIERS = [tier.strip().lower() for tier in os.getenv('POOLED_TENANT_TIERS', 'basic').split(',') if tier.strip()]
+POOLED_DATABASE_NAME = os.getenv('POOLED_DATABASE_NAME', 'tenants_pooled')
+# schema holding the tables of a tenant that has a database of its own, <schema> in the tenant SQL scripts
+DEDICATED_TENANT_SCHEMA = 'app'
+POOLED_DATABASE_LOCK_ID = 4242003
+# taken in the pooled database around the grants on it, which concurrent tenants would otherwise fail
+# with "tuple concurrently updated" as they all update its pg_database row
+POOLED_DATABASE_ACL_LOCK_ID = 4242005
+
+# Tenant databases are cloned from a template database that already holds the schema, so provisioning
+# is a CREATE DATABASE ... TEMPLATE plus the role and grants. Each template records the version (hash)
+# of the schema script it was built from and is rebuilt as soon as the script changes.
+USE_TENANT_TEMPLATE = os.getenv('USE_TENANT_TEMPLATE', 'true').lower() == 'true'
+# advisory lock held exclusively while a template is rebuilt and shared while tenants are cloned from it
+TENANT_TEMPLATE_LOCK_ID = 4242001
+
+# Tenants of a batch event are provisioned/de-provisioned in parallel, each on its own connection
+TENANT_BATCH_CONCURRENCY = int(os.getenv('TENANT_BATCH_CONCURRENCY', '8'))
+# BatchGetSecretValue accepts at most 20 secret ids per call
+SECRETS_BATCH_SIZE = 20
+# Ping a reused admin connection before use once it has been idle this long
+ADMIN_CONNECTION_MAX_IDLE_SECONDS = 60
+
+# The cell connection broker authenticates tenants against a userlist (its auth_file) kept in this secret,
+# one '"role" "password"' line per tenant. The broker tasks read it at start, so the broker service is
+# redeployed whenever the list changes. A secret holds up to 64 KB, about a thousand tenants.
+BROKER_USERS_SECRET_NAME = os.getenv('BROKER_USERS_SECRET_NAME')
+BROKER_CLUSTER = os.getenv('BROKER_CLUSTER')
+BROKER_SERVICE = os.getenv('BROKER_SERVICE')
+BROKER_USERS_LOCK_ID = 4242004
+USERLIST_LINE = re.compile(r'^"((?:[^"]|"")*)"\s+"((?:[^"]|"")*)"')
+
+# Ordered schema migrations for tenant databases, applied by the MIGRATE state and baked into the templates
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATION_CONCURRENCY = int(os.getenv('MIGRATION_CONCURRENCY', '4'))
+# DDL gives up quickly instead of queueing behind (and blocking) tenant traffic, and is retried
+MIGRATION_LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '3s')
+MIGRATION_STATEMENT_TIMEOUT = os.getenv('MIGRATION_STATEMENT_TIMEOUT', '15min')
+MIGRATION_LOCK_RETRIES = 5
+# Stop starting tenant migrations when the Lambda has less than this left
+MIGRATION_TIME_RESERVE_MS = 60000
+TENANT_MIGRATION_LOCK_ID = 4242002
+
+# Moving a tenant to another cell: the products table is exported and imported through presigned S3 URLs
+# from the control plane, first as a snapshot and then as the rows changed since, which a trigger records.
+# Each export covers at most the chunkRows the control plane asks for, so it fits one invocation.
+MOVE_COLUMNS = 'product_id, product_name, product_description, product_price, tenant_id'
+MOVE_FREEZE_LOCK_TIMEOUT = '10s'
+MOVE_TRANSFER_TIMEOUT_SECONDS = 60
+MOVE_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Admin credentials and connection are kept across warm invocations
+admin_credentials = None
+admin_connection = None
+admin_connection_used_at = 0
+migrations = None
 
 def handler(event, context):
+    """Handles a single tenant ({tenantId, tenantTier, tenantSecretName, tenantState}) or, for
+    PROVISION and DE-PROVISION, a batch ({tenantState, tenants: [{tenantId, tenantTier, tenantSecretName}]})
+    with a result per tenant"""
     try:
-        creds_secret_name = os.getenv('DB_CRED_SECRET_NAME')                
         tenant_state = event.get('tenantState')
         tenant_id = event.get('tenantId') 
+        tenant_tier = event.get('tenantTier')
         tenant_secret_name = event.get('tenantSecretName')
         print(tenant_secret_name)
-        
-        password, username, host, port = get_secret_value(creds_secret_name)
 
-        tenant_password, tenant_username, tenant_host, tenant_port = get_secret_value(tenant_secret_name)
-        print(tenant_password, tenant_username, tenant_host, tenant_port)
+        if 'tenants' in event and tenant_state in ('PROVISION', 'DE-PROVISION'):
+            return handle_tenant_batch(tenant_state, event['tenants'])
         
-        connection = psycopg.connect(dbname='postgres',
-                             host=host,
-                             port=port,
-                             user=username,
-                             password=password,
-                             autocommit=True)
+        if tenant_secret_name:
+            tenant_password, tenant_username, tenant_host, tenant_port = get_secret_value(tenant_secret_name)
+        
+        connection = get_admin_connection()
         
         if tenant_state == 'PROVISION':
-            query(connection, "CREATE DATABASE {0};".format(tenant_id))
-            connection.close()
-
-            connection = psycopg.connect(dbname=tenant_id,
-                             host=host,
-                             port=port,
-                             user=username,
-                             password=password,
-                             autocommit=True)
-       
-
-            with open(os.path.join(os.path.dirname(__file__), 'tenant-provisioning.sql'), 'r') as f:
-                sql_script = f.read()
-
-            sql_script = sql_script.replace("<tenant_id>",tenant_id).replace("<tenant_pwd>", tenant_password)
-            print(sql_script)
-
-            query(connection, sql_script)
-            connection.close()
+            prepare_tier(connection, tenant_tier)
+            provision_tenant(connection, tenant_id, tenant_tier, tenant_password)
+            if is_pooled_tier(tenant_tier):
+                set_tenant_placement(tenant_secret_name, POOLED_DATABASE_NAME, tenant_id)
+            update_broker_users(connection, added={tenant_id: tenant_password})
         elif tenant_state == 'DE-PROVISION':
-            query(connection, "DROP DATABASE {0};".format(tenant_id))
-            query(connection, "DROP user {0};".format(tenant_id))
+            deprovision_tenant(connection, tenant_id)
+            update_broker_users(connection, removed=[tenant_id])
+        elif tenant_state == 'MIGRATE':
+            return migrate_tenants(connection, event.get('tenants'), event.get('targetVersion'), context)
+        elif tenant_state == 'BUILD-TEMPLATE':
+            rebuilt = []
+            # the heap template, plus the partitioned one if any tier uses it
+            for tier in [None] + PARTITIONED_TENANT_TIERS[:1]:
+                template_name, schema_script = get_schema_script(tier)
+                if ensure_tenant_template(connection, template_name, schema_script):
+                    rebuilt.append(template_name)
+            return {
+                'status': 'OK',
+                'results': "templates rebuilt: {0}".format(rebuilt)
+            }
+        elif tenant_state == 'SYNC-BROKER-USERS':
+            return sync_broker_users(connection)
+        elif tenant_state == 'EXPORT-TENANT':
+            return export_tenant(connection, tenant_id, event['phase'], event['uploadUrl'], int(event['chunkRows']),
+                                 event.get('afterProductId'), event.get('freeze', False))
+        elif tenant_state == 'IMPORT-TENANT':
+            return import_tenant(connection, tenant_id, event['phase'], event['downloadUrl'], event.get('truncate', False))
+        elif tenant_state == 'END-MOVE':
+            return end_tenant_move(connection, tenant_id, event.get('unfreeze', False))
+        elif tenant_state == 'PARTITION-PRODUCTS':
+            connection = connect_database(tenant_id)
+
+            partitions = int(event.get('partitions', PRODUCT_TABLE_PARTITIONS))
+            result = partition_products_table(connection, tenant_id, partitions, context)
             connection.close()
+            return {
+                'status': 'OK',
+                'results': result
+            }
         else:
             return {
                 'status': 'ERROR',
@@ -65,20 +159,725 @@ def handler(event, context):
             'message': str(err)
         }
 
+def handle_tenant_batch(tenant_state, tenants):
+    started = time.monotonic()
+    connection = get_admin_connection()
+
+    if tenant_state == 'PROVISION':
+        secrets = get_secret_values([tenant['tenantSecretName'] for tenant in tenants])
+        # templates (and the pooled database) are prepared once up front, the tenants are then only cloned from them
+        for tier in set(tenant.get('tenantTier') for tenant in tenants):
+            prepare_tier(connection, tier)
+
+    def run(tenant):
+        tenant_id = tenant['tenantId']
+        tenant_started = time.monotonic()
+        try:
+            with admin_pool.connection() as worker_connection:
+                if tenant_state == 'PROVISION':
+                    tenant_password = secrets[tenant['tenantSecretName']][0]
+                    provision_tenant(worker_connection, tenant_id, tenant.get('tenantTier'), tenant_password)
+                    if is_pooled_tier(tenant.get('tenantTier')):
+                        set_tenant_placement(tenant['tenantSecretName'], POOLED_DATABASE_NAME, tenant_id)
+                else:
+                    deprovision_tenant(worker_connection, tenant_id)
+            result = {'tenantId': tenant_id, 'status': 'OK'}
+        except Exception as err:
+            result = {'tenantId': tenant_id, 'status': 'ERROR', 'message': str(err)}
+        result['durationMs'] = round((time.monotonic() - tenant_started) * 1000)
+        return result
+
+    # a connection of its own for every worker, a psycopg connection runs one statement at a time
+    workers = max(1, min(TENANT_BATCH_CONCURRENCY, len(tenants)))
+    with open_admin_pool(workers) as admin_pool:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run, tenants))
+
+    # one userlist update (and broker redeployment) for the whole batch
+    succeeded = [tenant for tenant, result in zip(tenants, results) if result['status'] == 'OK']
+    if tenant_state == 'PROVISION':
+        update_broker_users(connection, added={tenant['tenantId']: secrets[tenant['tenantSecretName']][0] for tenant in succeeded})
+    else:
+        update_broker_users(connection, removed=[tenant['tenantId'] for tenant in succeeded])
+
+    failed = sum(1 for result in results if result['status'] != 'OK')
+    print("{0} {1} tenants in {2:.0f} ms, {3} failed".format(tenant_state, len(tenants), (time.monotonic() - started) * 1000, failed))
+    return {
+        'status': 'OK' if failed == 0 else 'ERROR',
+        'results': results
+    }
+
+def is_pooled_tier(tenant_tier):
+    return bool(tenant_tier) and tenant_tier.lower() in POOLED_TENANT_TIERS
+
+def prepare_tier(connection, tenant_tier):
+    """Makes sure the pooled database (for pooled tiers) or the tier's template is in place"""
+    if is_pooled_tier(tenant_tier):
+        ensure_pooled_database(connection)
+    else:
+        ensure_tenant_template(connection, *get_schema_script(tenant_tier))
+
+def provision_tenant(connection, tenant_id, tenant_tier, tenant_password):
+    """Creates the tenant database and role. The template for the tenant's tier must be current,
+    see ensure_tenant_template. The (shared) admin connection is only used for CREATE DATABASE, the
+    schema and grants run on a connection to the tenant database."""
+    if is_pooled_tier(tenant_tier):
+        return provision_pooled_tenant(tenant_id, tenant_password)
+
+    started = time.monotonic()
+    template_name, schema_script = get_schema_script(tenant_tier)
+
+    if USE_TENANT_TEMPLATE:
+        create_database_from_template(connection, tenant_id, template_name)
+        sql_script = get_role_script(tenant_id, tenant_password)
+    else:
+        query(connection, "CREATE DATABASE {0};".format(tenant_id))
+        sql_script = schema_script + get_role_script(tenant_id, tenant_password)
+
+    tenant_connection = connect_database(tenant_id)
+    try:
+        query(tenant_connection, sql_script)
+        if not USE_TENANT_TEMPLATE:
+            migrate_tenant_database(tenant_connection, tenant_id)
+    finally:
+        tenant_connection.close()
+    print("Provisioned {0} in {1:.0f} ms".format(tenant_id, (time.monotonic() - started) * 1000))
+
+def provision_pooled_tenant(tenant_id, tenant_password):
+    """Creates the tenant's schema and role in the pooled database, see ensure_pooled_database"""
+    started = time.monotonic()
+    pooled_connection = connect_database(POOLED_DATABASE_NAME)
+    try:
+        query(pooled_connection, get_pooled_tenant_script(tenant_id, tenant_password))
+        migrate_tenant_database(pooled_connection, tenant_id, schema=tenant_id)
+    finally:
+        pooled_connection.close()
+    print("Provisioned {0} in {1} in {2:.0f} ms".format(tenant_id, POOLED_DATABASE_NAME, (time.monotonic() - started) * 1000))
+
+def deprovision_tenant(connection, tenant_id):
+    placement = get_tenant_placement(connection, tenant_id)
+    if placement and placement[0] == POOLED_DATABASE_NAME:
+        pooled_connection = connect_database(POOLED_DATABASE_NAME)
+        try:
+            query(pooled_connection, "SELECT pg_advisory_xact_lock({2}); "
+                                     "DROP SCHEMA {0} CASCADE; "
+                                     "DELETE FROM migrations.schema_migrations WHERE tenant_schema = '{0}'; "
+                                     "REVOKE ALL ON DATABASE {1} FROM {0};".format(tenant_id, POOLED_DATABASE_NAME, POOLED_DATABASE_ACL_LOCK_ID))
+        finally:
+            pooled_connection.close()
+    else:
+        query(connection, "DROP DATABASE {0};".format(tenant_id))
+    query(connection, "DROP user {0};".format(tenant_id))
+
+def ensure_pooled_database(connection):
+    """Creates the database the pooled tiers share, if the cell does not have it yet"""
+    if connection.execute("SELECT 1 FROM pg_database WHERE datname = %s", (POOLED_DATABASE_NAME,)).fetchone():
+        return False
+
+    connection.execute("SELECT pg_advisory_lock(%s)", (POOLED_DATABASE_LOCK_ID,))
+    try:
+        if connection.execute("SELECT 1 FROM pg_database WHERE datname = %s", (POOLED_DATABASE_NAME,)).fetchone():
+            return False
+        query(connection, "CREATE DATABASE {0};".format(POOLED_DATABASE_NAME))
+        with open(os.path.join(os.path.dirname(__file__), 'tenant-pooled-database.sql'), 'r') as f:
+            sql_script = f.read()
+        pooled_connection = connect_database(POOLED_DATABASE_NAME)
+        try:
+            query(pooled_connection, sql_script.replace("<pooled_db>", POOLED_DATABASE_NAME))
+            # created up front, as the pooled tenants are migrated concurrently in this one database
+            ensure_migrations_table(pooled_connection)
+        finally:
+            pooled_connection.close()
+        return True
+    finally:
+        connection.execute("SELECT pg_advisory_unlock(%s)", (POOLED_DATABASE_LOCK_ID,))
+
+def get_tenant_placement(connection, tenant_id):
+    """Returns the (database, schema) holding the tenant's tables, or None if the tenant has neither"""
+    if connection.execute("SELECT 1 FROM pg_database WHERE datname = %s", (tenant_id,)).fetchone():
+        return tenant_id, DEDICATED_TENANT_SCHEMA
+    if tenant_id in list_pooled_tenants():
+        return POOLED_DATABASE_NAME, tenant_id
+    return None
+
+def list_pooled_tenants():
+    """Tenant schemas of the pooled database, which are the schemas named after a role"""
+    try:
+        pooled_connection = connect_database(POOLED_DATABASE_NAME)
+    except psycopg.OperationalError:
+        # the cell has no pooled tenants yet
+        return []
+    try:
+        cur = pooled_connection.execute("SELECT nspname FROM pg_namespace JOIN pg_roles ON rolname = nspname ORDER BY nspname")
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        pooled_connection.close()
+
+def set_tenant_placement(secret_id, dbname, schema):
+    """Records where the tenant's tables are in its secret, which is where ProductService reads it from.
+    Tenants without the dbname and schema keys have a database of their own."""
+    secret_value = json.loads(secrets_manager.get_secret_value(SecretId=secret_id)['SecretString'])
+    if secret_value.get('dbname') == dbname and secret_value.get('schema') == schema:
+        return
+    secret_value['dbname'] = dbname
+    secret_value['schema'] = schema
+    secrets_manager.put_secret_value(SecretId=secret_id, SecretString=json.dumps(secret_value))
+
+def get_admin_credentials(refresh=False):
+    global admin_credentials
+    if admin_credentials is None or refresh:
+        admin_credentials = get_secret_value(os.getenv('DB_CRED_SECRET_NAME'))
+    return admin_credentials
+
+def connect_database(dbname, refresh_credentials=False):
+    password, username, host, port = get_admin_credentials(refresh_credentials)
+    return psycopg.connect(dbname=dbname,
+                             host=host,
+                             port=port,
+                             user=username,
+                             password=password,
+                             autocommit=True)
+
+def open_admin_pool(size):
+    """Opens a pool of size connections to the postgres database, with the admin credentials the
+    (just checked) admin connection uses"""
+    password, username, host, port = get_admin_credentials()
+    return ConnectionPool(kwargs={'dbname': 'postgres', 'host': host, 'port': port, 'user': username,
+                                  'password': password, 'autocommit': True},
+                          min_size=size, max_size=size, open=True)
+
+def get_admin_connection():
+    """Returns the connection to the postgres database, reused across warm invocations. A connection
+    that has been idle for a while is pinged first, and a failed connect re-reads the admin secret
+    in case the password was rotated."""
+    global admin_connection, admin_connection_used_at
+    if admin_connection is not None and not admin_connection.closed and not admin_connection.broken:
+        if time.monotonic() - admin_connection_used_at < ADMIN_CONNECTION_MAX_IDLE_SECONDS:
+            admin_connection_used_at = time.monotonic()
+            return admin_connection
+        try:
+            admin_connection.execute("SELECT 1")
+            admin_connection_used_at = time.monotonic()
+            return admin_connection
+        except psycopg.Error:
+            admin_connection.close()
+
+    try:
+        admin_connection = connect_database('postgres')
+    except psycopg.OperationalError:
+        admin_connection = connect_database('postgres', refresh_credentials=True)
+    admin_connection_used_at = time.monotonic()
+    return admin_connection
+
 def query(connection, sql):
     connection.execute(sql)    
 
+def get_schema_script(tenant_tier):
+    """Returns the template database name and schema script for the tenant's tier. Tiers listed in
+    PARTITIONED_TENANT_TIERS get a hash-partitioned products table, every other tier gets the plain heap table."""
+    if tenant_tier and tenant_tier.lower() in PARTITIONED_TENANT_TIERS:
+        template_name, script_name = 'tenant_template_partitioned', 'tenant-schema-partitioned.sql'
+    else:
+        template_name, script_name = 'tenant_template', 'tenant-schema.sql'
+
+    with open(os.path.join(os.path.dirname(__file__), script_name), 'r') as f:
+        sql_script = f.read()
+
+    return template_name, (sql_script.replace("<schema>", DEDICATED_TENANT_SCHEMA)
+                                      .replace("<partition_count>", str(PRODUCT_TABLE_PARTITIONS)))
+
+def get_role_script(tenant_id, tenant_password):
+    with open(os.path.join(os.path.dirname(__file__), 'tenant-role.sql'), 'r') as f:
+        sql_script = f.read()
+
+    return (sql_script.replace("<tenant_id>",tenant_id).replace("<tenant_pwd>", tenant_password)
+                      .replace("<schema>", DEDICATED_TENANT_SCHEMA))
+
+def get_pooled_tenant_script(tenant_id, tenant_password):
+    sql_script = ''
+    for script_name in ('tenant-schema-pooled.sql', 'tenant-role-pooled.sql'):
+        with open(os.path.join(os.path.dirname(__file__), script_name), 'r') as f:
+            sql_script += f.read() + '\n'
+
+    sql_script = "SELECT pg_advisory_xact_lock({0});\n".format(POOLED_DATABASE_ACL_LOCK_ID) + sql_script
+    return sql_script.replace("<tenant_id>", tenant_id).replace("<tenant_pwd>", tenant_password).replace("<pooled_db>", POOLED_DATABASE_NAME)
+
+def get_schema_version(schema_script):
+    """Hash of the schema script and every migration, which is what a template is built from"""
+    digest = hashlib.sha256(schema_script.encode('utf-8'))
+    for version, name, sql, transactional in get_migrations():
+        digest.update(name.encode('utf-8'))
+        digest.update(sql.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def get_template_version(connection, template_name):
+    cur = connection.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s", (template_name,))
+    row = cur.fetchone()
+    if row is None or not row[0] or not row[0].startswith('schema_version='):
+        return None
+    return row[0][len('schema_version='):]
+
+def ensure_tenant_template(connection, template_name, schema_script):
+    """Builds the template database if it is missing or was built from a different schema version.
+    The new template is migrated under a build name and renamed into place, so tenants are never
+    cloned from a half-built template. Returns True if the template was (re)built."""
+    if not USE_TENANT_TEMPLATE:
+        return False
+    version = get_schema_version(schema_script)
+    if get_template_version(connection, template_name) == version:
+        return False
+
+    connection.execute("SELECT pg_advisory_lock(%s)", (TENANT_TEMPLATE_LOCK_ID,))
+    try:
+        # another invocation may have rebuilt it while we waited for the lock
+        if get_template_version(connection, template_name) == version:
+            return False
+
+        print("Building {0} for schema version {1}".format(template_name, version))
+        build_name = template_name + '_build'
+        query(connection, "DROP DATABASE IF EXISTS {0};".format(build_name))
+        query(connection, "CREATE DATABASE {0};".format(build_name))
+
+        build_connection = connect_database(build_name)
+        query(build_connection, schema_script)
+        migrate_tenant_database(build_connection)
+        build_connection.close()
+
+        cur = connection.execute("SELECT 1 FROM pg_database WHERE datname = %s", (template_name,))
+        if cur.fetchone() is not None:
+            query(connection, "ALTER DATABASE {0} IS_TEMPLATE false;".format(template_name))
+            query(connection, "DROP DATABASE {0};".format(template_name))
+        query(connection, "ALTER DATABASE {0} RENAME TO {1};".format(build_name, template_name))
+        # no one connects to the template, which CREATE DATABASE ... TEMPLATE requires
+        query(connection, "ALTER DATABASE {0} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false;".format(template_name))
+        query(connection, "COMMENT ON DATABASE {0} IS 'schema_version={1}';".format(template_name, version))
+        return True
+    finally:
+        connection.execute("SELECT pg_advisory_unlock(%s)", (TENANT_TEMPLATE_LOCK_ID,))
+
+def create_database_from_template(connection, tenant_id, template_name):
+    connection.execute("SELECT pg_advisory_lock_shared(%s)", (TENANT_TEMPLATE_LOCK_ID,))
+    try:
+        query(connection, "CREATE DATABASE {0} TEMPLATE {1};".format(tenant_id, template_name))
+    finally:
+        connection.execute("SELECT pg_advisory_unlock_shared(%s)", (TENANT_TEMPLATE_LOCK_ID,))
+
+def get_migrations():
+    """Returns the migrations as (version, name, sql, transactional) tuples ordered by version.
+    Files are named NNNN_description.sql and are written against tenant-schema.sql (and must work for
+    the partitioned and pooled layouts too) with unqualified table names: they run with the search_path
+    set to the tenant's schema, which is app for a dedicated database and the tenant id when pooled. A file whose first line is '-- no-transaction' runs statement by
+    statement outside a transaction, for DDL like CREATE INDEX CONCURRENTLY; such migrations must be
+    idempotent (IF NOT EXISTS ...) because a failure can leave them partly applied."""
+    global migrations
+    if migrations is None:
+        loaded = []
+        for file_name in sorted(os.listdir(MIGRATIONS_DIR)) if os.path.isdir(MIGRATIONS_DIR) else []:
+            match = re.match(r'^(\d+)_.+\.sql$', file_name)
+            if not match:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, file_name), 'r') as f:
+                sql = f.read()
+            transactional = not sql.lstrip().startswith('-- no-transaction')
+            loaded.append((int(match.group(1)), file_name, sql, transactional))
+        migrations = sorted(loaded)
+    return migrations
+
+def list_tenant_databases(connection):
+    cur = connection.execute("SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate "
+                             "AND datname NOT IN ('postgres', 'rdsadmin', %s) AND datname NOT LIKE 'tenant\\_template%%' ORDER BY datname",
+                             (POOLED_DATABASE_NAME,))
+    return [row[0] for row in cur.fetchall()]
+
+def list_tenant_placements(connection):
+    """Returns {tenantId: (database, schema)} for every tenant of the cell, dedicated and pooled"""
+    placements = {tenant_id: (tenant_id, DEDICATED_TENANT_SCHEMA) for tenant_id in list_tenant_databases(connection)}
+    placements.update({tenant_id: (POOLED_DATABASE_NAME, tenant_id) for tenant_id in list_pooled_tenants()})
+    return placements
+
+def migrate_tenants(connection, tenants, target_version, context):
+    """Brings every tenant database of the cell (or the given tenants, e.g. one deployment wave) up to
+    the latest (or target) migration, MIGRATION_CONCURRENCY tenants at a time. Each tenant records its
+    own progress in migrations.schema_migrations, so a run that fails or runs out of time can simply be
+    invoked again: it returns IN_PROGRESS while tenants are still pending and only applies what is missing."""
+    started = time.monotonic()
+    # tenants provisioned from now on are cloned from templates that already include the migrations
+    for tier in [None] + PARTITIONED_TENANT_TIERS[:1]:
+        ensure_tenant_template(connection, *get_schema_script(tier))
+
+    placements = list_tenant_placements(connection)
+    tenant_ids = tenants if tenants is not None else list(placements)
+
+    def run(tenant_id):
+        if context and context.get_remaining_time_in_millis() < MIGRATION_TIME_RESERVE_MS:
+            return {'tenantId': tenant_id, 'status': 'PENDING'}
+        if tenant_id not in placements:
+            return {'tenantId': tenant_id, 'status': 'ERROR', 'message': 'tenant database not found'}
+        dbname, schema = placements[tenant_id]
+        tenant_started = time.monotonic()
+        try:
+            tenant_connection = connect_database(dbname)
+            try:
+                result = migrate_tenant_database(tenant_connection, tenant_id, target_version, schema)
+            finally:
+                tenant_connection.close()
+        except Exception as err:
+            result = {'status': 'ERROR', 'message': str(err)}
+        result['tenantId'] = tenant_id
+        result['durationMs'] = round((time.monotonic() - tenant_started) * 1000)
+        print(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=MIGRATION_CONCURRENCY) as executor:
+        results = list(executor.map(run, tenant_ids))
+
+    statuses = set(result['status'] for result in results)
+    if statuses - {'OK', 'PENDING'}:
+        status = 'ERROR'
+    elif 'PENDING' in statuses:
+        status = 'IN_PROGRESS'
+    else:
+        status = 'OK'
+    print("Migrated {0} tenant databases in {1:.0f} ms: {2}".format(len(results), (time.monotonic() - started) * 1000, status))
+    return {
+        'status': status,
+        'latestVersion': get_migrations()[-1][0] if get_migrations() else 0,
+        'results': results
+    }
+
+def migrate_tenant_database(connection, tenant_id=None, target_version=None, schema=DEDICATED_TENANT_SCHEMA):
+    """Applies the pending migrations to one tenant schema. tenant_id is None for a template being built;
+    for tenants the tenant role is granted access to anything the migrations created."""
+    query(connection, "SET lock_timeout = '{0}';".format(MIGRATION_LOCK_TIMEOUT))
+    query(connection, "SET statement_timeout = '{0}';".format(MIGRATION_STATEMENT_TIMEOUT))
+    query(connection, "SET search_path = {0};".format(schema))
+    ensure_migrations_table(connection)
+
+    # a second runner (e.g. an overlapping wave) skips this tenant instead of waiting
+    if not connection.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (TENANT_MIGRATION_LOCK_ID, schema)).fetchone()[0]:
+        return {'status': 'LOCKED', 'message': 'another migration run holds this tenant'}
+    try:
+        applied = set(row[0] for row in connection.execute("SELECT version FROM migrations.schema_migrations WHERE tenant_schema = %s",
+                                                           (schema,)).fetchall())
+        from_version = max(applied, default=0)
+        version = from_version
+        for migration in get_migrations():
+            if migration[0] in applied or (target_version is not None and migration[0] > int(target_version)):
+                continue
+            apply_migration(connection, schema, *migration)
+            version = max(version, migration[0])
+
+        if tenant_id and version != from_version:
+            query(connection, "GRANT USAGE ON SCHEMA {1} TO {0}; "
+                              "GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA {1} TO {0}; "
+                              "GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA {1} TO {0};".format(tenant_id, schema))
+        return {'status': 'OK', 'fromVersion': from_version, 'version': version}
+    finally:
+        connection.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (TENANT_MIGRATION_LOCK_ID, schema))
+
+def ensure_migrations_table(connection):
+    query(connection, "CREATE SCHEMA IF NOT EXISTS migrations; "
+                      "CREATE TABLE IF NOT EXISTS migrations.schema_migrations (tenant_schema TEXT NOT NULL DEFAULT '{0}', "
+                      "version INTEGER NOT NULL, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+                      "duration_ms INTEGER NOT NULL, PRIMARY KEY (tenant_schema, version));".format(DEDICATED_TENANT_SCHEMA))
+
+def apply_migration(connection, schema, version, name, sql, transactional):
+    for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+        started = time.monotonic()
+        try:
+            if transactional:
+                with connection.transaction():
+                    query(connection, sql)
+                    record_migration(connection, schema, version, name, started)
+            else:
+                for statement in [statement.strip() for statement in sql.split(';\n')]:
+                    if statement and not all(line.startswith('--') for line in statement.splitlines()):
+                        query(connection, statement)
+                record_migration(connection, schema, version, name, started)
+            return
+        except psycopg.errors.LockNotAvailable:
+            if attempt == MIGRATION_LOCK_RETRIES:
+                raise
+            print("Lock timeout applying {0}, retrying ({1}/{2})".format(name, attempt, MIGRATION_LOCK_RETRIES))
+            time.sleep(attempt)
+
+def record_migration(connection, schema, version, name, started):
+    connection.execute("INSERT INTO migrations.schema_migrations (tenant_schema, version, name, duration_ms) VALUES (%s, %s, %s, %s)",
+                       (schema, version, name, round((time.monotonic() - started) * 1000)))
+
+def update_broker_users(connection, added=None, removed=(), replace=False):
+    """Adds ({tenantId: password}) and removes tenants in the connection broker's userlist, or with replace
+    sets it to exactly the added tenants, then redeploys the broker so its tasks load the new list.
+    Does nothing in a cell without a broker. A failed update does not fail the provisioning: tenants
+    missing from the list connect directly (see ProductService) until SYNC-BROKER-USERS rebuilds it."""
+    if not BROKER_USERS_SECRET_NAME:
+        return False
+    try:
+        return write_broker_users(connection, added or {}, removed, replace)
+    except Exception as err:
+        print("Unable to update the connection broker userlist: {0}".format(err))
+        return False
+
+def write_broker_users(connection, added, removed, replace):
+    # serializes the read-modify-write of the secret across concurrent invocations
+    connection.execute("SELECT pg_advisory_lock(%s)", (BROKER_USERS_LOCK_ID,))
+    try:
+        secret_value = json.loads(secrets_manager.get_secret_value(SecretId=BROKER_USERS_SECRET_NAME)['SecretString'])
+        users = parse_userlist(secret_value.get('userlist', ''))
+        updated = {} if replace else {user: password for user, password in users.items() if user not in removed}
+        updated.update(added)
+        if updated == users:
+            return False
+        secret_value['userlist'] = format_userlist(updated)
+        secrets_manager.put_secret_value(SecretId=BROKER_USERS_SECRET_NAME, SecretString=json.dumps(secret_value))
+    finally:
+        connection.execute("SELECT pg_advisory_unlock(%s)", (BROKER_USERS_LOCK_ID,))
+
+    ecs.update_service(cluster=BROKER_CLUSTER, service=BROKER_SERVICE, forceNewDeployment=True)
+    print("Connection broker userlist updated: {0} tenants, redeploying {1}".format(len(updated), BROKER_SERVICE))
+    return True
+
+def sync_broker_users(connection):
+    """Rebuilds the connection broker's userlist from the credentials of every tenant of the cell, e.g. when
+    the broker is added to a cell that already has tenants. Tenants whose secret cannot be read are left out."""
+    secret_ids = {tenant_id: "{0}Credentials".format(tenant_id) for tenant_id in list_tenant_placements(connection)}
+    secrets, missing = get_secret_values(list(secret_ids.values()), missing_ok=True)
+    users = {tenant_id: secrets[secret_id][0] for tenant_id, secret_id in secret_ids.items() if secret_id in secrets}
+    if BROKER_USERS_SECRET_NAME:
+        write_broker_users(connection, users, (), True)
+    return {
+        'status': 'OK',
+        'results': "{0} tenants in the connection broker userlist, no secret for {1}".format(len(users), missing)
+    }
+
+def parse_userlist(userlist):
+    users = {}
+    for line in userlist.splitlines():
+        match = USERLIST_LINE.match(line.strip())
+        if match:
+            users[match.group(1).replace('""', '"')] = match.group(2).replace('""', '"')
+    return users
+
+def format_userlist(users):
+    return ''.join('"{0}" "{1}"\n'.format(user.replace('"', '""'), password.replace('"', '""'))
+                   for user, password in sorted(users.items()))
+
+def is_products_partitioned(connection, schema=DEDICATED_TENANT_SCHEMA):
+    cur = connection.execute("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+                             "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = %s AND c.relname = 'products'",
+                             (schema,))
+    return cur.fetchone() is not None
+
+def get_move_placement(connection, tenant_id):
+    placement = get_tenant_placement(connection, tenant_id)
+    if placement is None:
+        raise Exception("Tenant {0} has no database in this cell".format(tenant_id))
+    return placement
+
+def export_tenant(connection, tenant_id, phase, upload_url, chunk_rows, after_product_id=None, freeze=False):
+    """Source side of a tenant move, one chunk of at most chunk_rows products per call. The 'snapshot' phase
+    exports the products after after_product_id in product_id order, the first chunk installing the change
+    capture trigger, and returns the last product id exported for the next chunk. 'changes' and 'final'
+    export the current state of up to chunk_rows of the products changed since the last export, with a
+    deleted flag; freeze takes the tenant's writes away first, for the first chunk of 'final'. Changed
+    product ids are taken off the log in the exporting transaction, so a failed export leaves them for the
+    next one. A chunk of fewer than chunk_rows rows is the phase's last."""
+    started = time.monotonic()
+    last_product_id = None
+    dbname, schema = get_move_placement(connection, tenant_id)
+    tenant_connection = connect_database(dbname)
+    try:
+        if phase == 'snapshot':
+            if after_product_id is None:
+                with open(os.path.join(os.path.dirname(__file__), 'tenant-move-capture.sql'), 'r') as f:
+                    query(tenant_connection, f.read().replace("<schema>", schema))
+            chunk_sql = "SELECT {0} FROM {1}.products {2} ORDER BY product_id LIMIT {3}".format(
+                MOVE_COLUMNS, schema, "" if after_product_id is None else "WHERE product_id > {0}".format(int(after_product_id)), chunk_rows)
+            copy_sql = "COPY ({0}) TO STDOUT".format(chunk_sql)
+        else:
+            if freeze:
+                freeze_tenant_writes(tenant_connection, tenant_id, schema)
+            copy_sql = ("COPY (SELECT c.product_id, p.product_name, p.product_description, p.product_price, p.tenant_id, "
+                        "p.product_id IS NULL FROM move_changed c LEFT JOIN {0}.products p USING (product_id)) TO STDOUT").format(schema)
+
+        with tenant_connection.transaction():
+            query(tenant_connection, "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            if phase == 'snapshot':
+                # the same snapshot as the COPY, so the chunk ends at the last product it exports
+                last_product_id = tenant_connection.execute("SELECT max(product_id) FROM ({0}) chunk".format(chunk_sql)).fetchone()[0]
+            else:
+                query(tenant_connection, "CREATE TEMP TABLE move_changed ON COMMIT DROP AS WITH changed AS "
+                                         "(DELETE FROM {0}.products_move_log WHERE product_id IN (SELECT DISTINCT product_id "
+                                         "FROM {0}.products_move_log ORDER BY product_id LIMIT {1}) RETURNING product_id) "
+                                         "SELECT DISTINCT product_id FROM changed;".format(schema, chunk_rows))
+            rows, size = copy_to_url(tenant_connection, copy_sql, upload_url)
+    finally:
+        tenant_connection.close()
+
+    duration_ms = round((time.monotonic() - started) * 1000)
+    print("Exported {0} ({1}) of {2}: {3} rows, {4} bytes in {5} ms".format(phase, schema, tenant_id, rows, size, duration_ms))
+    return {'status': 'OK', 'phase': phase, 'rows': rows, 'bytes': size, 'lastProductId': last_product_id, 'durationMs': duration_ms}
+
+def import_tenant(connection, tenant_id, phase, download_url, truncate=False):
+    """Target side of a tenant move, applies a chunk export_tenant produced in a single transaction. The
+    first snapshot chunk truncates the products table, clearing what an earlier attempt left behind."""
+    started = time.monotonic()
+    dbname, schema = get_move_placement(connection, tenant_id)
+    tenant_connection = connect_database(dbname)
+    try:
+        with tenant_connection.transaction():
+            if phase == 'snapshot':
+                if truncate:
+                    query(tenant_connection, "TRUNCATE {0}.products;".format(schema))
+                rows = copy_from_url(tenant_connection, "COPY {0}.products ({1}) FROM STDIN".format(schema, MOVE_COLUMNS), download_url)
+            else:
+                query(tenant_connection, "CREATE TEMP TABLE move_changes (product_id INTEGER, product_name TEXT, product_description TEXT, "
+                                         "product_price NUMERIC, tenant_id TEXT, deleted BOOLEAN) ON COMMIT DROP;")
+                rows = copy_from_url(tenant_connection, "COPY move_changes FROM STDIN", download_url)
+                query(tenant_connection, "DELETE FROM {0}.products p USING move_changes c WHERE p.product_id = c.product_id AND c.deleted; "
+                                         "INSERT INTO {0}.products ({1}) SELECT {1} FROM move_changes WHERE NOT deleted "
+                                         "ON CONFLICT (product_id) DO UPDATE SET product_name = EXCLUDED.product_name, "
+                                         "product_description = EXCLUDED.product_description, product_price = EXCLUDED.product_price, "
+                                         "tenant_id = EXCLUDED.tenant_id;".format(schema, MOVE_COLUMNS))
+    finally:
+        tenant_connection.close()
+
+    duration_ms = round((time.monotonic() - started) * 1000)
+    print("Imported {0} ({1}) of {2}: {3} rows in {4} ms".format(phase, schema, tenant_id, rows, duration_ms))
+    return {'status': 'OK', 'phase': phase, 'rows': rows, 'durationMs': duration_ms}
+
+def freeze_tenant_writes(connection, tenant_id, schema):
+    """Takes the write privileges away from the tenant role, then waits for the writes already in flight"""
+    query(connection, "REVOKE INSERT, UPDATE, DELETE, TRUNCATE ON ALL TABLES IN SCHEMA {1} FROM {0};".format(tenant_id, schema))
+    with connection.transaction():
+        query(connection, "SET LOCAL lock_timeout = '{0}';".format(MOVE_FREEZE_LOCK_TIMEOUT))
+        query(connection, "LOCK TABLE {0}.products IN SHARE MODE;".format(schema))
+
+def end_tenant_move(connection, tenant_id, unfreeze):
+    """Removes the change capture from the source; an aborted move also gives the tenant its writes back"""
+    dbname, schema = get_move_placement(connection, tenant_id)
+    tenant_connection = connect_database(dbname)
+    try:
+        query(tenant_connection, "DROP TRIGGER IF EXISTS products_move_capture ON {0}.products; "
+                                 "DROP FUNCTION IF EXISTS {0}.products_move_capture(); "
+                                 "DROP TABLE IF EXISTS {0}.products_move_log;".format(schema))
+        if unfreeze:
+            query(tenant_connection, "GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA {1} TO {0};".format(tenant_id, schema))
+    finally:
+        tenant_connection.close()
+    return {'status': 'OK', 'unfrozen': bool(unfreeze)}
+
+def copy_to_url(connection, copy_sql, url):
+    """Runs a COPY ... TO STDOUT into a gzipped temporary file and PUTs it to the presigned URL"""
+    with tempfile.TemporaryFile() as f:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            with connection.cursor() as cur:
+                with cur.copy(copy_sql) as copy:
+                    for data in copy:
+                        gz.write(data)
+                rows = cur.rowcount
+        size = f.tell()
+        f.seek(0)
+        request = urllib.request.Request(url, data=f, method='PUT', headers={'Content-Length': str(size)})
+        urllib.request.urlopen(request, timeout=MOVE_TRANSFER_TIMEOUT_SECONDS).close()
+    return rows, size
+
+def copy_from_url(connection, copy_sql, url):
+    """Streams a gzipped COPY file from the presigned URL into COPY ... FROM STDIN"""
+    with urllib.request.urlopen(url, timeout=MOVE_TRANSFER_TIMEOUT_SECONDS) as response:
+        with gzip.GzipFile(fileobj=response) as gz:
+            with connection.cursor() as cur:
+                with cur.copy(copy_sql) as copy:
+                    while True:
+                        chunk = gz.read(MOVE_COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        copy.write(chunk)
+                return cur.rowcount
+
+def partition_products_table(connection, tenant_id, partitions, context, schema=DEDICATED_TENANT_SCHEMA):
+    """Converts an existing tenant's products heap into a hash-partitioned table without taking the
+    table offline. A trigger mirrors live writes into the partitioned copy while existing rows are copied
+    over in keyset batches, then the two tables are swapped under a short lock. Progress is kept in the
+    tenant database, so an invocation that runs out of time returns IN_PROGRESS and the next one resumes."""
+    if is_products_partitioned(connection, schema):
+        return {'state': 'COMPLETE', 'message': 'products table is already partitioned'}
+
+    with open(os.path.join(os.path.dirname(__file__), 'tenant-products-partitioning.sql'), 'r') as f:
+        sql_script = f.read()
+    query(connection, sql_script.replace("<schema>", schema).replace("<partition_count>", str(partitions)))
+
+    while True:
+        if context and context.get_remaining_time_in_millis() < PARTITIONING_TIME_RESERVE_MS:
+            cur = connection.execute("SELECT rows_copied FROM {0}.products_partitioning_progress".format(schema))
+            return {'state': 'IN_PROGRESS', 'rowsCopied': cur.fetchone()[0]}
+        if copy_products_batch(connection, schema) == 0:
+            break
+
+    swap_partitioned_products_table(connection, tenant_id, schema)
+    return {'state': 'COMPLETE', 'message': 'products table partitioned into {0} partitions'.format(partitions)}
+
+def copy_products_batch(connection, schema):
+    # FOR SHARE keeps concurrent updates/deletes of the batch's rows waiting until the copy commits,
+    # after which the mirror trigger applies them to the partitioned table
+    with connection.transaction():
+        cur = connection.execute("""
+            WITH progress AS (
+                SELECT last_product_id FROM {0}.products_partitioning_progress FOR UPDATE
+            ), batch AS (
+                SELECT p.* FROM {0}.products p, progress
+                WHERE progress.last_product_id IS NULL OR p.product_id > progress.last_product_id
+                ORDER BY p.product_id LIMIT %s FOR SHARE OF p
+            ), copied AS (
+                INSERT INTO {0}.products_partitioned SELECT * FROM batch ON CONFLICT (product_id) DO NOTHING
+            )
+            SELECT count(*), max(product_id) FROM batch""".format(schema), (PARTITIONING_BATCH_SIZE,))
+        batch_rows, last_product_id = cur.fetchone()
+        if batch_rows:
+            connection.execute("UPDATE {0}.products_partitioning_progress SET last_product_id = %s, rows_copied = rows_copied + %s".format(schema),
+                               (last_product_id, batch_rows))
+    return batch_rows
+
+def swap_partitioned_products_table(connection, tenant_id, schema):
+    with connection.transaction():
+        query(connection, "SET LOCAL lock_timeout = '{0}';".format(PARTITIONING_LOCK_TIMEOUT))
+        query(connection, "LOCK TABLE {0}.products IN ACCESS EXCLUSIVE MODE;".format(schema))
+        query(connection, "DROP TRIGGER products_mirror ON {0}.products;".format(schema))
+        query(connection, "ALTER TABLE {0}.products RENAME TO products_heap;".format(schema))
+        query(connection, "ALTER TABLE {0}.products_partitioned RENAME TO products;".format(schema))
+        query(connection, "GRANT ALL PRIVILEGES ON table {0}.products TO {1};".format(schema, tenant_id))
+
+    query(connection, "DROP TABLE {0}.products_heap;".format(schema))
+    query(connection, "DROP TABLE {0}.products_partitioning_progress;".format(schema))
+    query(connection, "DROP FUNCTION {0}.products_mirror();".format(schema))
+    query(connection, "ALTER INDEX {0}.products_partitioned_pkey RENAME TO products_pkey;".format(schema))
+
 def get_secret_value(secret_id):
     response = secrets_manager.get_secret_value(SecretId=secret_id)
-    secret_value = response['SecretString']
+    return parse_secret(response['SecretString'])
+
+def get_secret_values(secret_ids, missing_ok=False):
+    """Fetches many secrets with as few BatchGetSecretValue calls as possible, returns them by name.
+    With missing_ok, secrets that cannot be read are skipped and returned as a second list of ids."""
+    secrets = {}
+    missing = []
+    for i in range(0, len(secret_ids), SECRETS_BATCH_SIZE):
+        response = secrets_manager.batch_get_secret_value(SecretIdList=secret_ids[i:i + SECRETS_BATCH_SIZE])
+        for error in response.get('Errors', []):
+            if not missing_ok:
+                raise Exception("Unable to read secret {0}: {1}".format(error['SecretId'], error.get('Message')))
+            missing.append(error['SecretId'])
+        for secret in response['SecretValues']:
+            secrets[secret['Name']] = secrets[secret['ARN']] = parse_secret(secret['SecretString'])
+    return (secrets, missing) if missing_ok else secrets
 
-    #convert string to json
-    secret_value = eval(secret_value)
+def parse_secret(secret_string):
+    secret_value = json.loads(secret_string)
     
     password = secret_value["password"]
     username = secret_value["username"]
-    host = secret_value["host"]
-    port = secret_value["port"]
+    host = secret_value.get("host")
+    port = secret_value.get("port")
     
     return password, username, host, port
 
@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS <schema>.products_move_log (
+  seq BIGSERIAL PRIMARY KEY,
+  product_id INTEGER NOT NULL
+);
+CREATE OR REPLACE FUNCTION <schema>.products_move_capture() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    INSERT INTO <schema>.products_move_log (product_id) VALUES (OLD.product_id);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO <schema>.products_move_log (product_id) VALUES (NEW.product_id);
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS products_move_capture ON <schema>.products;
+CREATE TRIGGER products_move_capture AFTER INSERT OR UPDATE OR DELETE ON <schema>.products
+  FOR EACH ROW EXECUTE FUNCTION <schema>.products_move_capture();
@@ -0,0 +1,2 @@
+REVOKE ALL ON DATABASE <pooled_db> FROM PUBLIC;
+REVOKE ALL ON SCHEMA public FROM PUBLIC;
@@ -0,0 +1,38 @@
+CREATE TABLE IF NOT EXISTS <schema>.products_partitioned (
+  product_id INTEGER PRIMARY KEY,
+  product_name TEXT NOT NULL,
+  product_description text NOT NULL,
+  product_price NUMERIC NOT NULL,
+  tenant_id TEXT NOT NULL    
+) PARTITION BY HASH (product_id);
+DO $$
+BEGIN
+  FOR i IN 0..<partition_count> - 1 LOOP
+    EXECUTE format('CREATE TABLE IF NOT EXISTS <schema>.products_p%s PARTITION OF <schema>.products_partitioned FOR VALUES WITH (MODULUS %s, REMAINDER %s)', i, <partition_count>, i);
+  END LOOP;
+END $$;
+CREATE TABLE IF NOT EXISTS <schema>.products_partitioning_progress (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  last_product_id INTEGER,
+  rows_copied BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO <schema>.products_partitioning_progress (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+CREATE OR REPLACE FUNCTION <schema>.products_mirror() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = <schema>, pg_temp AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM <schema>.products_partitioned WHERE product_id = OLD.product_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO <schema>.products_partitioned VALUES (NEW.*)
+    ON CONFLICT (product_id) DO UPDATE SET product_name = EXCLUDED.product_name,
+      product_description = EXCLUDED.product_description,
+      product_price = EXCLUDED.product_price,
+      tenant_id = EXCLUDED.tenant_id;
+    RETURN NEW;
+  END IF;
+  RETURN OLD;
+END $$;
+DROP TRIGGER IF EXISTS products_mirror ON <schema>.products;
+CREATE TRIGGER products_mirror AFTER INSERT OR UPDATE OR DELETE ON <schema>.products
+  FOR EACH ROW EXECUTE FUNCTION <schema>.products_mirror();
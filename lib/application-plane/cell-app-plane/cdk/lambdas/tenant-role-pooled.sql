@@ -0,0 +1,6 @@
+CREATE USER <tenant_id> WITH PASSWORD '<tenant_pwd>';  
+GRANT CONNECT ON DATABASE <pooled_db> TO <tenant_id>;
+GRANT USAGE ON SCHEMA <tenant_id> TO <tenant_id>;
+GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA <tenant_id> TO <tenant_id>;
+GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA <tenant_id> TO <tenant_id>;
+ALTER ROLE <tenant_id> IN DATABASE <pooled_db> SET search_path = <tenant_id>;
@@ -0,0 +1,5 @@
+CREATE USER <tenant_id> WITH PASSWORD '<tenant_pwd>';  
+GRANT CONNECT ON DATABASE <tenant_id> TO <tenant_id>;
+GRANT USAGE ON SCHEMA <schema> TO <tenant_id>;
+GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA <schema> TO <tenant_id>;
+GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA <schema> TO <tenant_id>;
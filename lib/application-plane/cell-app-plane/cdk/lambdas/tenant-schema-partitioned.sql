@@ -0,0 +1,14 @@
+CREATE SCHEMA <schema>;
+CREATE TABLE <schema>.products (
+  product_id INTEGER PRIMARY KEY,
+  product_name TEXT NOT NULL,
+  product_description text NOT NULL,
+  product_price NUMERIC NOT NULL,
+  tenant_id TEXT NOT NULL    
+) PARTITION BY HASH (product_id);
+DO $$
+BEGIN
+  FOR i IN 0..<partition_count> - 1 LOOP
+    EXECUTE format('CREATE TABLE <schema>.products_p%s PARTITION OF <schema>.products FOR VALUES WITH (MODULUS %s, REMAINDER %s)', i, <partition_count>, i);
+  END LOOP;
+END $$;
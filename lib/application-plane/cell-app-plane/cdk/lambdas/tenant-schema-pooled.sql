@@ -0,0 +1,11 @@
+CREATE SCHEMA <tenant_id>;
+CREATE TABLE <tenant_id>.products (
+  product_id INTEGER PRIMARY KEY,
+  product_name TEXT NOT NULL,
+  product_description text NOT NULL,
+  product_price NUMERIC NOT NULL,
+  tenant_id TEXT NOT NULL    
+);
+ALTER TABLE <tenant_id>.products ENABLE ROW LEVEL SECURITY;
+CREATE POLICY tenant_isolation ON <tenant_id>.products
+  USING (tenant_id = current_user) WITH CHECK (tenant_id = current_user);
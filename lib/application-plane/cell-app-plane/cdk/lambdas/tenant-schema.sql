@@ -0,0 +1,8 @@
+CREATE SCHEMA <schema>;
+CREATE TABLE <schema>.products (
+  product_id INTEGER PRIMARY KEY,
+  product_name TEXT NOT NULL,
+  product_description text NOT NULL,
+  product_price NUMERIC NOT NULL,
+  tenant_id TEXT NOT NULL    
+);
@@ -0,0 +1,225 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""API Gateway policy building shared by the cell and control plane authorizers. Deployed as
+a Lambda layer so both authorizers import the same module."""
+
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+POLICY_CACHE_SIZE = int(os.getenv('POLICY_CACHE_SIZE', '1024'))
+
+class LruCache(object):
+    """A small least-recently-used cache bounded by entry count, kept at module scope so it
+    survives across invocations of the same execution environment"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+class HttpVerb:
+    GET = "GET"
+    POST = "POST"
+    PUT = "PUT"
+    PATCH = "PATCH"
+    HEAD = "HEAD"
+    DELETE = "DELETE"
+    OPTIONS = "OPTIONS"
+    ALL = "*"
+
+class AuthPolicy(object):
+    awsAccountId = ""
+    """The AWS account id the policy will be generated for. This is used to create the method ARNs."""
+    principalId = ""
+    """The principal used for the policy, this should be a unique identifier for the end user."""
+    version = "2012-10-17"
+    """The policy version used for the evaluation. This should always be '2012-10-17'"""
+    pathRegex = "^[/.a-zA-Z0-9-\*]+$"
+    """The regular expression used to validate resource paths for the policy"""
+    pathPattern = re.compile(pathRegex)
+    """pathRegex compiled once for all policies"""
+
+    """these are the internal lists of allowed and denied methods. These are lists
+    of objects and each object has 2 properties: A resource ARN and a nullable
+    conditions statement.
+    the build method processes these lists and generates the approriate
+    statements for the final policy"""
+    allowMethods = []
+    denyMethods = []
+
+    restApiId = "*"
+    """The API Gateway API id. By default this is set to '*'"""
+    region = "*"
+    """The region where the API is deployed. By default this is set to '*'"""
+    stage = "*"
+    """The name of the stage used in the policy. By default this is set to '*'"""
+
+    def __init__(self, principal, awsAccountId):
+        self.awsAccountId = awsAccountId
+        self.principalId = principal
+        self.allowMethods = []
+        self.denyMethods = []
+
+    def _addMethod(self, effect, verb, resource, conditions):
+        """Adds a method to the internal lists of allowed or denied methods. Each object in
+        the internal list contains a resource ARN and a condition statement. The condition
+        statement can be null."""
+        if verb != "*" and not hasattr(HttpVerb, verb):
+            raise NameError("Invalid HTTP verb " + verb +
+                            ". Allowed verbs in HttpVerb class")
+        if not self.pathPattern.match(resource):
+            raise NameError("Invalid resource path: " + resource +
+                            ". Path should match " + self.pathRegex)
+
+        if resource[:1] == "/":
+            resource = resource[1:]
+
+        resourceArn = getArnPrefix(self.region, self.awsAccountId, self.restApiId, self.stage) + verb + "/" + resource
+
+        if effect.lower() == "allow":
+            self.allowMethods.append({
+                'resourceArn': resourceArn,
+                'conditions': conditions
+            })
+        elif effect.lower() == "deny":
+            self.denyMethods.append({
+                'resourceArn': resourceArn,
+                'conditions': conditions
+            })
+
+    def _getEmptyStatement(self, effect):
+        """Returns an empty statement object prepopulated with the correct action and the
+        desired effect."""
+        statement = {
+            'Action': 'execute-api:Invoke',
+            'Effect': effect[:1].upper() + effect[1:].lower(),
+            'Resource': []
+        }
+
+        return statement
+
+    def _getStatementForEffect(self, effect, methods):
+        """This function loops over an array of objects containing a resourceArn and
+        conditions statement and generates the array of statements for the policy."""
+        statements = []
+
+        if len(methods) > 0:
+            statement = self._getEmptyStatement(effect)
+
+            for curMethod in methods:
+                if curMethod['conditions'] is None or len(curMethod['conditions']) == 0:
+                    statement['Resource'].append(curMethod['resourceArn'])
+                else:
+                    conditionalStatement = self._getEmptyStatement(effect)
+                    conditionalStatement['Resource'].append(
+                        curMethod['resourceArn'])
+                    conditionalStatement['Condition'] = curMethod['conditions']
+                    statements.append(conditionalStatement)
+
+            statements.append(statement)
+
+        return statements
+
+    def allowAllMethods(self):
+        """Adds a '*' allow to the policy to authorize access to all methods of an API"""
+        self._addMethod("Allow", HttpVerb.ALL, "*", [])
+
+    def denyAllMethods(self):
+        """Adds a '*' allow to the policy to deny access to all methods of an API"""
+        self._addMethod("Deny", HttpVerb.ALL, "*", [])
+
+    def allowMethod(self, verb, resource):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
+        methods for the policy"""
+        self._addMethod("Allow", verb, resource, [])
+
+    def denyMethod(self, verb, resource):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
+        methods for the policy"""
+        self._addMethod("Deny", verb, resource, [])
+
+    def allowMethodWithConditions(self, verb, resource, conditions):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
+        methods and includes a condition for the policy statement. More on AWS policy
+        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
+        self._addMethod("Allow", verb, resource, conditions)
+
+    def denyMethodWithConditions(self, verb, resource, conditions):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
+        methods and includes a condition for the policy statement. More on AWS policy
+        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
+        self._addMethod("Deny", verb, resource, conditions)
+
+    def build(self):
+        """Generates the policy document based on the internal lists of allowed and denied
+        conditions. This will generate a policy with two main statements for the effect:
+        one statement for Allow and one statement for Deny.
+        Methods that includes conditions will have their own statement in the policy."""
+        if ((self.allowMethods is None or len(self.allowMethods) == 0) and
+                (self.denyMethods is None or len(self.denyMethods) == 0)):
+            raise NameError("No statements defined for the policy")
+
+        policy = {
+            'principalId': self.principalId,
+            'policyDocument': {
+                'Version': self.version,
+                'Statement': []
+            }
+        }
+
+        policy['policyDocument']['Statement'].extend(
+            self._getStatementForEffect("Allow", self.allowMethods))
+        policy['policyDocument']['Statement'].extend(
+            self._getStatementForEffect("Deny", self.denyMethods))
+
+        return policy
+
+@lru_cache(maxsize=256)
+def getArnPrefix(region, awsAccountId, restApiId, stage):
+    """Returns the execute-api ARN prefix of an API stage, built once per API/stage"""
+    return "arn:aws:execute-api:" + region + ":" + awsAccountId + ":" + restApiId + "/" + stage + "/"
+
+@lru_cache(maxsize=256)
+def parseMethodArn(methodArn):
+    """Splits a method ARN (arn:aws:execute-api:region:account:apiId/stage/verb/resource) into
+    region, account id, API id and stage"""
+    tmp = methodArn.split(':')
+    api_gateway_arn_tmp = tmp[5].split('/')
+    return tmp[3], tmp[4], api_gateway_arn_tmp[0], api_gateway_arn_tmp[1]
+
+policies = LruCache(POLICY_CACHE_SIZE)
+
+def getPolicy(principalId, methodArn, role, addStatements):
+    """Returns the finished policy document for the principal on the API and stage of methodArn.
+    addStatements(policy, role) adds the allow/deny methods and is only called the first time a
+    (principal, restApiId, stage, role) combination is seen; afterwards the cached document is
+    returned. Callers must copy the document before adding a per-request context to it."""
+    region, awsAccountId, restApiId, stage = parseMethodArn(methodArn)
+    key = (principalId, restApiId, stage, role)
+    policyDocument = policies.get(key)
+    if policyDocument is None:
+        policy = AuthPolicy(principalId, awsAccountId)
+        policy.restApiId = restApiId
+        policy.region = region
+        policy.stage = stage
+        addStatements(policy, role)
+        policyDocument = policy.build()
+        policies.put(key, policyDocument)
+    return policyDocument
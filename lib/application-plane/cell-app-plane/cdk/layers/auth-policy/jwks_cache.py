@@ -0,0 +1,110 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Cognito JWKS caching shared by the cell and control plane authorizers, deployed in the same
+layer as auth_policy. python-jose comes with the authorizers' own requirements."""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from jose import jwk
+
+logger = logging.getLogger()
+
+# The JWKS is cached for the lifetime of the execution environment and only re-fetched when it
+# is older than the TTL or a token arrives signed with a kid we have not seen yet
+JWKS_CACHE_TTL_SECONDS = int(os.getenv('JWKS_CACHE_TTL_SECONDS', '3600'))
+JWKS_REFRESH_MIN_INTERVAL_SECONDS = int(os.getenv('JWKS_REFRESH_MIN_INTERVAL_SECONDS', '30'))
+JWKS_FETCH_TIMEOUT_SECONDS = 3
+
+class JwksCache(object):
+    """The key set of one user pool's jwks.json, kept at module scope so it survives across
+    invocations of the same execution environment"""
+
+    def __init__(self, ttl_seconds=JWKS_CACHE_TTL_SECONDS, refresh_min_interval_seconds=JWKS_REFRESH_MIN_INTERVAL_SECONDS,
+                 fetch_timeout_seconds=JWKS_FETCH_TIMEOUT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_min_interval_seconds = refresh_min_interval_seconds
+        self.fetch_timeout_seconds = fetch_timeout_seconds
+        self.keys_url = None
+        self.keys = {}
+        self.public_keys = {}
+        self.fetched_at = None
+        self.last_refresh_attempt = None
+        self.fetch_count = 0
+        self.lock = threading.Lock()
+
+    def get_public_key(self, keys_url, kid):
+        """Returns the constructed public key for the kid from the cached JWKS. The key set is fetched
+        when missing or older than the TTL, and re-fetched early when the kid is unknown (e.g. right
+        after the user pool rotated its signing key). Refreshes while keys are cached are limited to
+        one per refresh interval, so neither tokens with bogus kids nor an unreachable jwks.json can
+        turn every call into a fetch."""
+        if self.keys_url != keys_url or self.is_expired():
+            self.refresh(keys_url, self.fetched_at, force=False)
+        elif kid not in self.keys:
+            self.refresh(keys_url, self.fetched_at, force=True)
+
+        key = self.keys.get(kid)
+        if key is None:
+            return None
+
+        public_key = self.public_keys.get(kid)
+        if public_key is None:
+            public_key = jwk.construct(key)
+            self.public_keys[kid] = public_key
+        return public_key
+
+    def is_expired(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl_seconds
+
+    def refresh(self, keys_url, seen_fetched_at, force):
+        with self.lock:
+            # another thread refreshed the key set while we were waiting for the lock
+            if self.keys_url == keys_url and self.fetched_at != seen_fetched_at:
+                return
+
+            now = time.monotonic()
+            last_attempt = self.last_refresh_attempt
+            # an expired key set whose refresh just failed keeps being served, and retried at the same rate
+            has_keys = self.keys_url == keys_url and self.fetched_at is not None
+            if (force or has_keys) and last_attempt is not None and now - last_attempt < self.refresh_min_interval_seconds:
+                logger.info('Skipping JWKS refresh, last refresh was {:.1f}s ago'.format(now - last_attempt))
+                return
+            self.last_refresh_attempt = now
+
+            try:
+                with urllib.request.urlopen(keys_url, timeout=self.fetch_timeout_seconds) as f:
+                    response = f.read()
+                keys = json.loads(response.decode('utf-8'))['keys']
+            except Exception as e:
+                # keep serving the keys we already have rather than failing every request
+                logger.error('Unable to fetch {}: {}'.format(keys_url, e))
+                if not has_keys:
+                    raise
+                return
+
+            keys_by_kid = {key['kid']: key for key in keys}
+            # keep the constructed keys whose key material has not changed
+            public_keys = {kid: public_key for kid, public_key in self.public_keys.items()
+                           if self.keys_url == keys_url and self.keys.get(kid) == keys_by_kid.get(kid)}
+
+            self.keys_url = keys_url
+            self.keys = keys_by_kid
+            self.public_keys = public_keys
+            self.fetched_at = time.monotonic()
+            self.fetch_count += 1
+            logger.info('Fetched {} keys from jwks.json (fetch #{})'.format(len(keys_by_kid), self.fetch_count))
+
+    def stats(self):
+        """Returns how many times this execution environment has fetched jwks.json and how old the
+        cached key set is"""
+        return {
+            'fetchCount': self.fetch_count,
+            'cacheAgeSeconds': None if self.fetched_at is None else round(time.monotonic() - self.fetched_at, 1),
+            'keyCount': len(self.keys)
+        }
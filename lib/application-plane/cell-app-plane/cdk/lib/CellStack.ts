@@ -16,17 +16,23 @@ import * as iam from 'aws-cdk-lib/aws-iam';
 import * as autoscaling from 'aws-cdk-lib/aws-autoscaling';
 import * as elbv2 from 'aws-cdk-lib/aws-elasticloadbalancingv2';
 import * as targets from 'aws-cdk-lib/aws-elasticloadbalancingv2-targets';
+import { AwsCustomResource, AwsCustomResourcePolicy, PhysicalResourceId } from 'aws-cdk-lib/custom-resources';
 import { LogGroup, RetentionDays, MetricFilter, FilterPattern } from 'aws-cdk-lib/aws-logs';
 import { Unit } from 'aws-cdk-lib/aws-cloudwatch';
+import { Runtime } from 'aws-cdk-lib/aws-lambda';
+import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
 import { IdentityProvider } from './IdentityProviderConstruct';
 import { LambdaFunction } from './LambdaFunctionConstruct';
 import { AuroraPostgres } from './RdsPostgresConstruct';
+import { ConnectionBroker } from './ConnectionBrokerConstruct';
 import { CdkNagUtils } from '../utils/cdk-nag-utils'
 import path = require('path');
 
 interface CellStackProps extends StackProps {
   cellId: string;
   cellSize: string;
+  readReplica?: boolean;
+  connectionBroker?: boolean;
 }
 
 export class CellStack extends Stack {
@@ -240,13 +246,71 @@ export class CellStack extends Stack {
       dbName: `CellDB-${props.cellId}`,
       auroraClusterUsername: "saasadmin",
       ingressSources: [asgSecurityGroup],
-      instanceType: rdsInstanceType
+      instanceType: rdsInstanceType,
+      readReplica: props.readReplica
     });
 
+    // Optional transaction-pooling connection broker shared by every tenant in the cell
+    let brokerHost = rdsPostgres.clusterHost;
+    let brokerPort = rdsPostgres.clusterPort;
+    if (props.connectionBroker) {
+      const connectionBroker = new ConnectionBroker(this, `ConnectionBroker-${props.cellId}`, {
+        cellId: props.cellId,
+        vpc: vpc,
+        cluster: cluster,
+        dbHost: rdsPostgres.clusterHost,
+        dbPort: rdsPostgres.clusterPort
+      });
+      connectionBroker.node.addDependency(capacityProvider);
+      asgSecurityGroup.addIngressRule(ec2.Peer.ipv4(vpc.vpcCidrBlock), ec2.Port.tcpRange(32768, 65535), 'allow connection broker traffic from NLB');
+
+      // The initializer keeps the broker's userlist in step with the tenants it provisions and redeploys the broker
+      const initializerFunction = rdsPostgres.tenantRDSInitializer.function;
+      initializerFunction.addEnvironment('BROKER_USERS_SECRET_NAME', connectionBroker.usersSecret.secretName);
+      initializerFunction.addEnvironment('BROKER_CLUSTER', cluster.clusterName);
+      initializerFunction.addEnvironment('BROKER_SERVICE', connectionBroker.service.serviceName);
+      connectionBroker.usersSecret.grantRead(initializerFunction);
+      connectionBroker.usersSecret.grantWrite(initializerFunction);
+      initializerFunction.addToRolePolicy(new iam.PolicyStatement({
+        actions: ['ecs:UpdateService'],
+        resources: [connectionBroker.service.serviceArn]
+      }));
+
+      // Fill the userlist with the tenants the cell already has
+      const brokerSetup = new AwsCustomResource(this, `ConnectionBrokerSetup-${props.cellId}`, {
+        onUpdate: {
+          service: 'Lambda',
+          action: 'invoke',
+          parameters: {
+            FunctionName: initializerFunction.functionName,
+            Payload: JSON.stringify({ tenantState: 'SYNC-BROKER-USERS' })
+          },
+          physicalResourceId: PhysicalResourceId.of(`ConnectionBrokerSetup-${props.cellId}`)
+        },
+        policy: AwsCustomResourcePolicy.fromStatements([
+          new iam.PolicyStatement({
+            resources: [initializerFunction.functionArn],
+            actions: ['lambda:InvokeFunction']
+          })
+        ])
+      });
+      brokerSetup.node.addDependency(rdsPostgres);
+      brokerSetup.node.addDependency(connectionBroker);
+
+      brokerHost = connectionBroker.host;
+      brokerPort = connectionBroker.port;
+    }
+
     //Cognito Setup
     const identityProvider = new IdentityProvider(this, `IdentityProvider-${props.cellId}`);
     const idpDetails = identityProvider.identityDetails;
 
+    //AuthPolicy and JWKS cache modules shared with the control plane authorizer
+    const authPolicyLayer = new lambda_python.PythonLayerVersion(this, `AuthPolicyLayer-${props.cellId}`, {
+      entry: path.join(__dirname, '../layers/auth-policy'),
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
     //Authorizer lambda function that uses Cognito
     const authorizerLambda = new LambdaFunction(this, `TenantAuthorizerLambda-${props.cellId}`, {
       friendlyFunctionName: `TenantAuthorizerFunction-${props.cellId}`,
@@ -254,6 +318,7 @@ export class CellStack extends Stack {
       entry: path.join(__dirname, '../lambdas'),
       handler: 'handler',
       environmentVariables: {'IDP_DETAILS': JSON.stringify(idpDetails)},
+      layers: [authPolicyLayer],
     })
 
     /**
@@ -379,6 +444,15 @@ export class CellStack extends Stack {
       value: identityProvider.identityDetails.details['appClientId'],
       exportName: `CellAppClientId-${props.cellId}`
     });
+    // The cluster endpoint itself when the cell has no connection broker
+    new CfnOutput(this, `CellConnectionBrokerHost`, {
+      value: brokerHost,
+      exportName: `CellConnectionBrokerHost-${props.cellId}`
+    });
+    new CfnOutput(this, `CellConnectionBrokerPort`, {
+      value: brokerPort,
+      exportName: `CellConnectionBrokerPort-${props.cellId}`
+    });
     new CfnOutput(this, `CellTotalTenantsSupported`, {
       value: tenantsSupported.toString(),
       exportName: `CellTotalTenantsSupported-${props.cellId}`
@@ -20,6 +20,10 @@ interface CellTenantStackProps extends cdk.StackProps {
     tenantEmail: string;
     priorityBase: string;
     productImageVersion: string;
+    productWriteMode?: string;
+    tenantTier?: string;
+    // set for a tenant moved in from another cell, whose secret there still exists during the move
+    tenantSecretName?: string;
 }
 
 export class CellTenantStack extends cdk.Stack {
@@ -56,6 +60,7 @@ export class CellTenantStack extends cdk.Stack {
         }
 
         const tenantPriorityBase = Number(props.priorityBase);
+        const tenantSecretName = props.tenantSecretName || props.tenantId + 'Credentials';
 
         // Retrieve Account ID and Region from the environment context
         const accountId = cdk.Stack.of(this).account;
@@ -78,6 +83,9 @@ export class CellTenantStack extends cdk.Stack {
         const securityGroupId = cdk.Fn.importValue(`CellALBSecurityGroupId-${props.cellId}`);
         const rdsHost = cdk.Fn.importValue(`RDSClusterHost-${props.cellId}`);
         const rdsPort = cdk.Fn.importValue(`RDSClusterPort-${props.cellId}`);
+        const rdsReaderHost = cdk.Fn.importValue(`RDSClusterReaderHost-${props.cellId}`);
+        const brokerHost = cdk.Fn.importValue(`CellConnectionBrokerHost-${props.cellId}`);
+        const brokerPort = cdk.Fn.importValue(`CellConnectionBrokerPort-${props.cellId}`);
         const userPoolId = cdk.Fn.importValue(`CellUserPoolId-${props.cellId}`);
         const appClientId = cdk.Fn.importValue(`CellAppClientId-${props.cellId}`);
 
@@ -135,7 +143,16 @@ export class CellTenantStack extends cdk.Stack {
             memoryLimitMiB: memoryLimit,
             environment: {
                 AWS_ACCOUNT_ID: accountId,
-                AWS_REGION: region
+                AWS_REGION: region,
+                // 'direct' commits every insert on its own, 'write-behind' group-commits queued inserts
+                PRODUCT_WRITE_MODE: props.productWriteMode ?? 'direct',
+                // same as the writer host when the cell has no read replica, in which case every query goes to the writer
+                DB_READER_HOST: rdsReaderHost,
+                DB_READER_PORT: rdsPort,
+                // the cell's connection broker, or the writer itself when the cell has none
+                DB_BROKER_HOST: brokerHost,
+                DB_BROKER_PORT: brokerPort,
+                TENANT_SECRET_NAME: tenantSecretName
             },
             logging: ecs.LogDriver.awsLogs({ 
                 streamPrefix: 'product', 
@@ -197,8 +214,8 @@ export class CellTenantStack extends cdk.Stack {
             this,
             props.tenantId + 'Credentials',
             {
-                secretName: props.tenantId + 'Credentials',
-                description: props.tenantId + 'Credentials',
+                secretName: tenantSecretName,
+                description: tenantSecretName,
                 generateSecretString: {
                 excludeCharacters: "\"@/\\ '",
                 generateStringKey: 'password',
@@ -216,7 +233,8 @@ export class CellTenantStack extends cdk.Stack {
         // Custom resource for tenant provisioning - create new database and tables
         const provisionPayload: string = JSON.stringify({
             tenantId: props.tenantId,
-            tenantSecretName: props.tenantId + 'Credentials',
+            tenantTier: props.tenantTier,
+            tenantSecretName: tenantSecretName,
             tenantState: 'PROVISION'
         })
         const provisionPayloadHashPrefix = createHash('md5').update(provisionPayload).digest('hex').substring(0, 6)
@@ -253,7 +271,7 @@ export class CellTenantStack extends cdk.Stack {
         // Custom resource for tenant de-provisioning - drop database and users
         const deprovisionPayload: string = JSON.stringify({
             tenantId: props.tenantId,
-            tenantSecretName: props.tenantId + 'Credentials',
+            tenantSecretName: tenantSecretName,
             tenantState: 'DE-PROVISION'
         })
         const deprovisionPayloadHashPrefix = createHash('md5').update(deprovisionPayload).digest('hex').substring(0, 6)
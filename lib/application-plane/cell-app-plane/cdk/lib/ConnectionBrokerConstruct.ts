@@ -0,0 +1,134 @@
+import { Duration, SecretValue } from 'aws-cdk-lib';
+import * as ec2 from 'aws-cdk-lib/aws-ec2';
+import * as ecr from 'aws-cdk-lib/aws-ecr';
+import * as ecs from 'aws-cdk-lib/aws-ecs';
+import * as elbv2 from 'aws-cdk-lib/aws-elasticloadbalancingv2';
+import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
+import { Construct } from 'constructs';
+
+export interface ConnectionBrokerProps {
+  cellId: string;
+  vpc: ec2.IVpc;
+  cluster: ecs.ICluster;
+  dbHost: string;
+  dbPort: string;
+  imageTag?: string;
+  desiredCount?: number;
+  maxClientConnections?: number;
+  defaultPoolSize?: number;
+  maxDbConnections?: number;
+}
+
+// PgBouncer image the CellProvisioningSystem build mirrors into the account, see build-broker-image.sh
+export const CONNECTION_BROKER_REPOSITORY = 'connection-broker';
+export const CONNECTION_BROKER_IMAGE_TAG = 'pgbouncer-alpine3.21';
+
+/**
+ * PgBouncer in transaction pooling mode in front of the cell's Aurora cluster. Clients keep
+ * connecting to their own tenant database with their own tenant role; the broker authenticates
+ * them against the userlist in usersSecret (which the TenantRDSInitializer keeps in sync with the
+ * tenant secrets) and keeps one small server pool per tenant database/role pair, so every tenant
+ * stays isolated while server connections are shared across all ProductService tasks of the tenant.
+ */
+export class ConnectionBroker extends Construct {
+  public readonly host: string;
+  public readonly port: string;
+  public readonly service: ecs.Ec2Service;
+  public readonly usersSecret: secretsmanager.Secret;
+
+  constructor(scope: Construct, id: string, props: ConnectionBrokerProps) {
+    super(scope, id);
+
+    const brokerPort = 6432;
+
+    const pgbouncerConfig = [
+      '[databases]',
+      '* = host=$DB_HOST port=$DB_PORT',
+      '[pgbouncer]',
+      'listen_addr = 0.0.0.0',
+      `listen_port = ${brokerPort}`,
+      'auth_type = scram-sha-256',
+      'auth_file = /tmp/userlist.txt',
+      'pool_mode = transaction',
+      'max_client_conn = $MAX_CLIENT_CONN',
+      'default_pool_size = $DEFAULT_POOL_SIZE',
+      'max_db_connections = $MAX_DB_CONNECTIONS',
+      'server_tls_sslmode = require',
+      'ignore_startup_parameters = extra_float_digits',
+    ].join('\n');
+
+    // '"role" "password"' per tenant, loaded when a broker task starts
+    this.usersSecret = new secretsmanager.Secret(this, 'Users', {
+      secretName: `ConnectionBrokerUsers-${props.cellId}`,
+      secretObjectValue: {
+        userlist: SecretValue.unsafePlainText('')
+      }
+    });
+
+    const repository = ecr.Repository.fromRepositoryName(this, 'Repository', CONNECTION_BROKER_REPOSITORY);
+
+    const taskDefinition = new ecs.Ec2TaskDefinition(this, 'TaskDef');
+    const container = taskDefinition.addContainer('pgbouncer', {
+      image: ecs.ContainerImage.fromEcrRepository(repository, props.imageTag ?? CONNECTION_BROKER_IMAGE_TAG),
+      cpu: 256,
+      memoryLimitMiB: 256,
+      entryPoint: ['/bin/sh', '-c'],
+      command: [
+        `cat > /tmp/pgbouncer.ini <<EOF\n${pgbouncerConfig}\nEOF\n` +
+        'printf "%s\\n" "$USERLIST" > /tmp/userlist.txt\n' +
+        'exec pgbouncer /tmp/pgbouncer.ini'
+      ],
+      environment: {
+        DB_HOST: props.dbHost,
+        DB_PORT: props.dbPort,
+        MAX_CLIENT_CONN: String(props.maxClientConnections ?? 2000),
+        DEFAULT_POOL_SIZE: String(props.defaultPoolSize ?? 2),
+        MAX_DB_CONNECTIONS: String(props.maxDbConnections ?? 5),
+      },
+      secrets: {
+        USERLIST: ecs.Secret.fromSecretsManager(this.usersSecret, 'userlist'),
+      },
+      logging: ecs.LogDriver.awsLogs({
+        streamPrefix: 'pgbouncer',
+        logRetention: 7
+      })
+    });
+    container.addPortMappings({
+      containerPort: brokerPort,
+      hostPort: 0,
+      protocol: ecs.Protocol.TCP
+    });
+
+    const service = this.service = new ecs.Ec2Service(this, 'Service', {
+      cluster: props.cluster,
+      taskDefinition: taskDefinition,
+      desiredCount: props.desiredCount ?? 2,
+      circuitBreaker: { enable: true, rollback: true }
+    });
+
+    const nlb = new elbv2.NetworkLoadBalancer(this, `BrokerNLB-${props.cellId}`, {
+      vpc: props.vpc,
+      internetFacing: false,
+      crossZoneEnabled: true,
+      vpcSubnets: {
+        subnetType: ec2.SubnetType.PRIVATE_WITH_EGRESS
+      }
+    });
+
+    const listener = nlb.addListener(`BrokerListener-${props.cellId}`, {
+      port: brokerPort
+    });
+
+    listener.addTargets(`BrokerTargets-${props.cellId}`, {
+      port: brokerPort,
+      targets: [service],
+      deregistrationDelay: Duration.seconds(30),
+      healthCheck: {
+        protocol: elbv2.Protocol.TCP
+      }
+    });
+
+    this.host = nlb.loadBalancerDnsName;
+    this.port = brokerPort.toString();
+  }
+}
@@ -1,5 +1,5 @@
 import { RemovalPolicy } from 'aws-cdk-lib';
-import { Function, Runtime, Code }  from 'aws-cdk-lib/aws-lambda';
+import { Function, ILayerVersion, Runtime, Code }  from 'aws-cdk-lib/aws-lambda';
 import { Construct } from 'constructs';
 import { LogGroup, RetentionDays } from "aws-cdk-lib/aws-logs";
 import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
@@ -10,6 +10,7 @@ export interface LambdaFunctionProps {
   entry: string 
   handler: string    
   environmentVariables?: {[key: string]: string}
+  layers?: ILayerVersion[]
 }
 
 export class LambdaFunction extends Construct {
@@ -30,6 +31,7 @@ export class LambdaFunction extends Construct {
       handler: props.handler,
       index: props.index,
       logGroup: logGroup,
+      layers: props.layers,
       environment: {
         ...props.environmentVariables
       }
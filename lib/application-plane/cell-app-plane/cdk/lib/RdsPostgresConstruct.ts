@@ -29,10 +29,16 @@ import {
     preferredMaintenanceWindow?: string;
     ingressSources?: any[];
     description?:string;
+    readReplica?: boolean;
+    readerInstanceType?: any;
   
   }
     
   export class AuroraPostgres extends Construct {
+    public readonly clusterHost: string;
+    public readonly clusterPort: string;
+    public readonly tenantRDSInitializer: TenantRDSInitializer;
+
     constructor(scope: Construct, id: string, props:AuroraProps) {
       super(scope, id);
   
@@ -134,7 +140,7 @@ import {
             cellId: props.cellId,
             vpc: vpc,
             dbCredSecretName: auroraClusterSecret.secretName,
-            secretArn: auroraClusterSecret.secretArn            
+            secretArn: auroraClusterSecret.secretArn
         });
 
         dbsg.addIngressRule(tenantRDSInitializer.fnSg, connectionPort, connectionName);            
@@ -158,6 +164,11 @@ import {
         instanceIdentifierBase: props.dbName,
         writer: rds.ClusterInstance.provisioned('writer',
             { instanceType: instanceType }),
+        // optional replica that serves the ProductService GET routes through the reader endpoint
+        readers: props.readReplica ? [
+            rds.ClusterInstance.provisioned('reader',
+            { instanceType: props.readerInstanceType ?? instanceType })
+        ] : undefined,
         vpc: vpc,    
         vpcSubnets: {
             subnets : isolated_subnets
@@ -168,6 +179,10 @@ import {
 
         aurora_cluster.applyRemovalPolicy(RemovalPolicy.DESTROY);
 
+        this.clusterHost = aurora_cluster.clusterEndpoint.hostname;
+        this.clusterPort = aurora_cluster.clusterEndpoint.port.toString();
+        this.tenantRDSInitializer = tenantRDSInitializer;
+
         Tags.of(aurora_cluster).add('Name', props.dbName!, {
             priority: 300,
         });
@@ -339,6 +354,11 @@ import {
             value: aurora_cluster.clusterEndpoint.port.toString(),
         });
 
+        new CfnOutput(this, `RDSClusterReaderHost-${props.cellId}`, {
+            exportName: `RDSClusterReaderHost-${props.cellId}`,
+            value: props.readReplica ? aurora_cluster.clusterReadEndpoint.hostname : aurora_cluster.clusterEndpoint.hostname,
+        });
+
         
 
     }
@@ -1,7 +1,7 @@
 
 import * as ec2 from 'aws-cdk-lib/aws-ec2'
 import * as lambda from 'aws-cdk-lib/aws-lambda'
-import { RemovalPolicy, Duration, CfnOutput } from 'aws-cdk-lib'
+import { RemovalPolicy, Duration, CfnOutput, Stack } from 'aws-cdk-lib'
 import { Construct } from 'constructs'
 import { AwsCustomResource, AwsCustomResourcePolicy, AwsSdkCall, PhysicalResourceId } from 'aws-cdk-lib/custom-resources'
 import { LogGroup, RetentionDays } from "aws-cdk-lib/aws-logs";
@@ -46,9 +46,14 @@ export class TenantRDSInitializer extends Construct {
     lambdaRole.addManagedPolicy(iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole'));
     lambdaRole.addManagedPolicy(iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaVPCAccessExecutionRole'));
     lambdaRole.addToPolicy(new iam.PolicyStatement({
-      actions: ['secretsmanager:GetSecretValue'],
+      actions: ['secretsmanager:GetSecretValue', 'secretsmanager:BatchGetSecretValue'],
       resources: ['*'],
     }));    
+    // pooled tenants get the database and schema holding their tables recorded in their secret
+    lambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['secretsmanager:PutSecretValue'],
+      resources: [`arn:aws:secretsmanager:${Stack.of(this).region}:${Stack.of(this).account}:secret:*Credentials-*`],
+    }));
 
     const lambdaFunction = new lambda_python.PythonFunction(this, `TenantRDSInitializer${id}`, {
       entry: path.join(__dirname, '../lambdas'), 
@@ -62,10 +67,22 @@ export class TenantRDSInitializer extends Construct {
       }),
       securityGroups: [fnSg],
       environment: {
-        DB_CRED_SECRET_NAME: props.dbCredSecretName
+        DB_CRED_SECRET_NAME: props.dbCredSecretName,
+        // Tenants in these tiers are provisioned with a hash-partitioned products table
+        PARTITIONED_TENANT_TIERS: 'premium',
+        PRODUCT_TABLE_PARTITIONS: '16',
+        // Tenants in these tiers get a schema in the cell's shared pooled database instead of a database of their own
+        POOLED_TENANT_TIERS: 'basic',
+        POOLED_DATABASE_NAME: 'tenants_pooled',
+        // Tenant databases are cloned from a per-cell template database holding the current schema
+        USE_TENANT_TEMPLATE: 'true',
+        // tenants of a batch event provisioned in parallel
+        TENANT_BATCH_CONCURRENCY: '8',
+        MIGRATION_CONCURRENCY: '4'
       },
       role: lambdaRole,
-      timeout: Duration.seconds(60)
+      // batch events provision many tenants per invocation
+      timeout: Duration.minutes(5)
     });
     
     this.function = lambdaFunction
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the authorizer policy building. Compares the AuthPolicy the cell authorizer
+built on every invocation at a baseline git revision with the shared auth_policy layer, both
+building a fresh policy and returning the cached document.
+Usage: ./benchmark-auth-policy.py [--baseline-ref REF] [--principals N] [--iterations N]"""
+
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+CDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cdk')
+AUTHORIZER_PATH = 'lambdas/authorizer.py'
+METHOD_ARN = 'arn:aws:execute-api:us-east-1:123456789012:abcdef1234/prod/GET/product'
+
+sys.path.insert(0, os.path.join(CDK_DIR, 'layers', 'auth-policy'))
+import auth_policy
+
+
+def load_baseline_policy(ref):
+    """Returns the AuthPolicy class of the cell authorizer at the given git revision, or None if
+    the revision can't be read (e.g. when running from the packaged zip)"""
+    try:
+        source = subprocess.check_output(['git', 'show', '{}:./{}'.format(ref, AUTHORIZER_PATH)],
+                                         cwd=CDK_DIR, text=True, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    tree = ast.parse(source)
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and node.name in ('HttpVerb', 'AuthPolicy')]
+    namespace = {'re': re}
+    exec(compile(ast.Module(body=classes, type_ignores=[]), 'baseline-authorizer', 'exec'), namespace)
+    return namespace.get('AuthPolicy')
+
+
+def first_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=CDK_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).split()[0]
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def build_per_call(policy_class, principals):
+    # what the authorizer handler did for every invocation
+    state = {'i': 0}
+
+    def run():
+        principal = principals[state['i'] % len(principals)]
+        state['i'] += 1
+        tmp = METHOD_ARN.split(':')
+        api_gateway_arn_tmp = tmp[5].split('/')
+        policy = policy_class(principal, tmp[4])
+        policy.restApiId = api_gateway_arn_tmp[0]
+        policy.region = tmp[3]
+        policy.stage = api_gateway_arn_tmp[1]
+        policy.allowAllMethods()
+        return policy.build()
+    return run
+
+
+def cached(principals):
+    state = {'i': 0}
+
+    def add_statements(policy, role):
+        policy.allowAllMethods()
+
+    def run():
+        principal = principals[state['i'] % len(principals)]
+        state['i'] += 1
+        return auth_policy.getPolicy(principal, METHOD_ARN, 'TenantUser', add_statements)
+    return run
+
+
+def report(name, fn, iterations):
+    elapsed = min(timeit.repeat(fn, number=iterations, repeat=5))
+    print('{:<32} {:>12,.0f} invocations/s  {:>8.2f} us/invocation'.format(name, iterations / elapsed, elapsed / iterations * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline-ref', default=None,
+                        help='git revision to take the baseline AuthPolicy from (default: first commit)')
+    parser.add_argument('--principals', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    principals = ['principal-{}'.format(i) for i in range(args.principals)]
+    baseline_ref = args.baseline_ref or first_commit()
+    baseline_policy = load_baseline_policy(baseline_ref) if baseline_ref else None
+    if baseline_policy is not None:
+        report('before ({})'.format(baseline_ref[:10]), build_per_call(baseline_policy, principals), args.iterations)
+    else:
+        print('before: baseline {} not available, skipping'.format(AUTHORIZER_PATH))
+    report('after, built per call', build_per_call(auth_policy.AuthPolicy, principals), args.iterations)
+    report('after, cached document', cached(principals), args.iterations)
+
+
+if __name__ == '__main__':
+    main()
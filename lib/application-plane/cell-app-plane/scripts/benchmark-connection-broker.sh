@@ -0,0 +1,102 @@
+#!/bin/bash -e
+
+# Measures how many tenants a cell database can serve with and without the connection broker.
+# Every tenant gets its own database and role (as in tenant-schema.sql and tenant-role.sql) and runs CLIENTS
+# concurrent connections, the way several ProductService tasks would. The tenant count is raised
+# in STEP increments until a tenant fails to connect.
+# Usage: ./benchmark-connection-broker.sh [max_connections] [clients_per_tenant] [step] [max_tenants]
+
+MAX_CONNECTIONS=${1:-100}
+CLIENTS=${2:-4}
+STEP=${3:-10}
+MAX_TENANTS=${4:-500}
+DURATION=10
+NETWORK=connection-broker-benchmark
+PGPASSWORD=benchmark
+
+cleanup() {
+  docker rm -f bench-postgres bench-pgbouncer > /dev/null 2>&1 || true
+  docker network rm $NETWORK > /dev/null 2>&1 || true
+}
+cleanup
+trap cleanup EXIT
+
+docker network create $NETWORK > /dev/null
+docker run -d --name bench-postgres --network $NETWORK -e POSTGRES_PASSWORD=$PGPASSWORD \
+  public.ecr.aws/docker/library/postgres:15 -c max_connections=$MAX_CONNECTIONS > /dev/null
+until docker exec bench-postgres pg_isready -U postgres > /dev/null 2>&1; do sleep 1; done
+
+run_sql() {
+  docker exec -i bench-postgres psql -q -U postgres -d $1 -v ON_ERROR_STOP=1
+}
+
+# the broker image the cells run, see build-broker-image.sh
+docker build -q -t bench-pgbouncer-image ../connection-broker > /dev/null
+
+docker run -d --name bench-pgbouncer --network $NETWORK --entrypoint /bin/sh bench-pgbouncer-image -c "
+cat > /tmp/pgbouncer.ini <<EOF
+[databases]
+* = host=bench-postgres port=5432
+[pgbouncer]
+listen_addr = 0.0.0.0
+listen_port = 6432
+auth_type = scram-sha-256
+auth_file = /tmp/userlist.txt
+pool_mode = transaction
+max_client_conn = 10000
+default_pool_size = 2
+max_db_connections = 5
+EOF
+touch /tmp/userlist.txt
+exec pgbouncer /tmp/pgbouncer.ini" > /dev/null
+
+docker exec -i bench-postgres sh -c "cat > /tmp/workload.sql" <<EOF
+\set id random(1, 1000)
+SELECT product_id, product_name, product_description, product_price, tenant_id FROM app.products WHERE product_id = :id;
+EOF
+
+PROVISIONED=0
+provision_tenants() {
+  while [ $PROVISIONED -lt $1 ]; do
+    PROVISIONED=$((PROVISIONED + 1))
+    echo "CREATE DATABASE tenant$PROVISIONED;" | run_sql postgres
+    cat ../cdk/lambdas/tenant-schema.sql ../cdk/lambdas/tenant-role.sql | sed -e "s/<tenant_id>/tenant$PROVISIONED/g" -e "s/<tenant_pwd>/$PGPASSWORD/g" -e "s/<schema>/app/g" | run_sql tenant$PROVISIONED
+    # the userlist entry the TenantRDSInitializer adds for every tenant it provisions
+    docker exec bench-pgbouncer sh -c "echo '\"tenant$PROVISIONED\" \"$PGPASSWORD\"' >> /tmp/userlist.txt"
+  done
+  # pgbouncer re-reads its auth_file on reload
+  docker kill -s HUP bench-pgbouncer > /dev/null
+}
+
+# Runs every tenant's workload at once and prints the number of tenants that failed
+run_tenants() {
+  local target_host=$1
+  local target_port=$2
+  local tenants=$3
+  docker exec -e PGPASSWORD=$PGPASSWORD bench-postgres sh -c "
+    failed=0
+    for i in \$(seq 1 $tenants); do
+      pgbench -h $target_host -p $target_port -U tenant\$i -n -c $CLIENTS -T $DURATION -f /tmp/workload.sql tenant\$i > /tmp/tenant\$i.log 2>&1 &
+    done
+    for job in \$(jobs -p); do wait \$job || failed=\$((failed + 1)); done
+    echo \$failed"
+}
+
+for MODE in direct broker; do
+  if [ "$MODE" == "direct" ]; then
+    HOST=bench-postgres; PORT=5432
+  else
+    HOST=bench-pgbouncer; PORT=6432
+  fi
+  SUPPORTED=0
+  for TENANTS in $(seq $STEP $STEP $MAX_TENANTS); do
+    provision_tenants $TENANTS
+    FAILED=$(run_tenants $HOST $PORT $TENANTS)
+    echo "$MODE: $TENANTS tenants x $CLIENTS clients -> $FAILED tenants failed"
+    if [ "$FAILED" -gt 0 ]; then
+      break
+    fi
+    SUPPORTED=$TENANTS
+  done
+  echo "== $MODE: $SUPPORTED tenants served with max_connections=$MAX_CONNECTIONS =="
+done
@@ -0,0 +1,49 @@
+#!/bin/bash -e
+
+# Compares insert and lookup throughput of the heap and hash-partitioned app.products layouts
+# against a local Postgres container. Usage: ./benchmark-products-table.sh [rows] [partitions] [duration]
+
+ROWS=${1:-10000000}
+PARTITIONS=${2:-16}
+DURATION=${3:-60}
+CONTAINER=products-table-benchmark
+PGPASSWORD=benchmark
+
+echo "Starting Postgres container $CONTAINER"
+docker rm -f $CONTAINER > /dev/null 2>&1 || true
+docker run -d --name $CONTAINER -e POSTGRES_PASSWORD=$PGPASSWORD public.ecr.aws/docker/library/postgres:15 > /dev/null
+until docker exec $CONTAINER pg_isready -U postgres > /dev/null 2>&1; do sleep 1; done
+
+run_sql() {
+  docker exec -i $CONTAINER psql -q -U postgres -d $1 -v ON_ERROR_STOP=1
+}
+
+for LAYOUT in heap partitioned; do
+  echo "Preparing $LAYOUT layout with $ROWS products"
+  echo "CREATE DATABASE bench_$LAYOUT;" | run_sql postgres
+  if [ "$LAYOUT" == "heap" ]; then
+    SCRIPT=../cdk/lambdas/tenant-schema.sql
+  else
+    SCRIPT=../cdk/lambdas/tenant-schema-partitioned.sql
+  fi
+  cat $SCRIPT ../cdk/lambdas/tenant-role.sql | sed -e "s/<tenant_id>/bench_$LAYOUT/g" -e "s/<tenant_pwd>/$PGPASSWORD/g" -e "s/<schema>/app/g" -e "s/<partition_count>/$PARTITIONS/g" | run_sql bench_$LAYOUT
+  echo "INSERT INTO app.products SELECT g, 'p' || g, 'p' || g || 'desc', 10, 'bench' FROM generate_series(1, $ROWS) g; VACUUM ANALYZE app.products;" | run_sql bench_$LAYOUT
+
+  docker exec -i $CONTAINER sh -c "cat > /tmp/insert.sql" <<EOF
+\set id random($((ROWS + 1)), 2000000000)
+INSERT INTO app.products VALUES (:id, 'p', 'pdesc', 10, 'bench') ON CONFLICT DO NOTHING;
+EOF
+  docker exec -i $CONTAINER sh -c "cat > /tmp/lookup.sql" <<EOF
+\set id random(1, $ROWS)
+SELECT product_id, product_name, product_description, product_price, tenant_id FROM app.products WHERE product_id = :id;
+EOF
+
+  echo "== $LAYOUT: insert =="
+  docker exec $CONTAINER pgbench -U postgres -n -c 8 -j 4 -T $DURATION -f /tmp/insert.sql bench_$LAYOUT | grep -E "tps|latency average"
+  echo "== $LAYOUT: lookup by product_id =="
+  docker exec $CONTAINER pgbench -U postgres -n -c 8 -j 4 -T $DURATION -f /tmp/lookup.sql bench_$LAYOUT | grep -E "tps|latency average"
+  echo "== $LAYOUT: VACUUM =="
+  docker exec $CONTAINER sh -c "time psql -q -U postgres -d bench_$LAYOUT -c 'VACUUM app.products;'"
+done
+
+docker rm -f $CONTAINER > /dev/null
@@ -0,0 +1,80 @@
+#!/bin/bash -e
+
+# Compares the dedicated (database per tenant) and pooled (schema per tenant in a shared database)
+# tenancy modes against a local Postgres container. Each mode provisions TENANTS tenants with the
+# Lambda's SQL scripts, then holds one session per tenant open after it has read its products table,
+# the way an idle ProductService connection does. Reports provisioning time, disk and server memory
+# per tenant, and how many tenants fit in a GiB of each.
+# Usage: ./benchmark-tenancy-modes.sh [tenants] [products_per_tenant]
+
+TENANTS=${1:-200}
+PRODUCTS=${2:-100}
+CONTAINER=tenancy-modes-benchmark
+POOLED_DB=tenants_pooled
+PGPASSWORD=benchmark
+LAMBDAS=../cdk/lambdas
+
+run_sql() {
+  docker exec -i $CONTAINER psql -q -U postgres -d $1 -v ON_ERROR_STOP=1
+}
+
+scalar() {
+  docker exec -i $CONTAINER psql -qtA -U postgres -d ${2:-postgres} -c "$1"
+}
+
+container_memory_kb() {
+  # memory of the Postgres processes without the page cache, in kB
+  docker exec $CONTAINER sh -c "ps -o rss= -C postgres | awk '{ sum += \$1 } END { print sum }'"
+}
+
+cleanup() {
+  docker rm -f $CONTAINER > /dev/null 2>&1 || true
+}
+trap cleanup EXIT
+
+for MODE in dedicated pooled; do
+  cleanup
+  docker run -d --name $CONTAINER -e POSTGRES_PASSWORD=$PGPASSWORD public.ecr.aws/docker/library/postgres:15 \
+    -c max_connections=$((TENANTS + 20)) > /dev/null
+  until docker exec $CONTAINER pg_isready -U postgres > /dev/null 2>&1; do sleep 1; done
+  sleep 2
+
+  if [ "$MODE" == "pooled" ]; then
+    echo "CREATE DATABASE $POOLED_DB;" | run_sql postgres
+    sed -e "s/<pooled_db>/$POOLED_DB/g" $LAMBDAS/tenant-pooled-database.sql | run_sql $POOLED_DB
+  fi
+  DISK_BEFORE=$(scalar "SELECT sum(pg_database_size(datname)) FROM pg_database")
+
+  START=$(date +%s.%N)
+  for i in $(seq 1 $TENANTS); do
+    if [ "$MODE" == "dedicated" ]; then
+      echo "CREATE DATABASE tenant$i;" | run_sql postgres
+      cat $LAMBDAS/tenant-schema.sql $LAMBDAS/tenant-role.sql | sed -e "s/<tenant_id>/tenant$i/g" -e "s/<tenant_pwd>/$PGPASSWORD/g" -e "s/<schema>/app/g" | run_sql tenant$i
+      echo "INSERT INTO app.products SELECT g, 'p' || g, 'p' || g || 'desc', 10, 'tenant$i' FROM generate_series(1, $PRODUCTS) g;" | run_sql tenant$i
+    else
+      cat $LAMBDAS/tenant-schema-pooled.sql $LAMBDAS/tenant-role-pooled.sql | sed -e "s/<tenant_id>/tenant$i/g" -e "s/<tenant_pwd>/$PGPASSWORD/g" -e "s/<pooled_db>/$POOLED_DB/g" | run_sql $POOLED_DB
+      echo "INSERT INTO tenant$i.products SELECT g, 'p' || g, 'p' || g || 'desc', 10, 'tenant$i' FROM generate_series(1, $PRODUCTS) g;" | run_sql $POOLED_DB
+    fi
+  done
+  END=$(date +%s.%N)
+  DISK_AFTER=$(scalar "SELECT sum(pg_database_size(datname)) FROM pg_database")
+
+  # one idle session per tenant, connected as the tenant role after reading its products
+  MEMORY_BEFORE=$(container_memory_kb)
+  docker exec -e PGPASSWORD=$PGPASSWORD $CONTAINER sh -c "
+    for i in \$(seq 1 $TENANTS); do
+      if [ $MODE = dedicated ]; then DB=tenant\$i; TABLE=app.products; else DB=$POOLED_DB; TABLE=products; fi
+      psql -q -h localhost -U tenant\$i -d \$DB -c \"SELECT count(*) FROM \$TABLE\" -c 'SELECT pg_sleep(30)' > /dev/null &
+    done
+    sleep 15"
+  SESSIONS=$(scalar "SELECT count(*) FROM pg_stat_activity WHERE usename LIKE 'tenant%'")
+  MEMORY_AFTER=$(container_memory_kb)
+
+  DISK_PER_TENANT_KB=$(( (DISK_AFTER - DISK_BEFORE) / TENANTS / 1024 ))
+  MEMORY_PER_TENANT_KB=$(( (MEMORY_AFTER - MEMORY_BEFORE) / TENANTS ))
+  echo "== $MODE: $TENANTS tenants with $PRODUCTS products each, $SESSIONS sessions open =="
+  echo "  provisioning:       $(echo "($END - $START) * 1000 / $TENANTS" | bc) ms per tenant"
+  echo "  disk:               $DISK_PER_TENANT_KB kB per tenant, $(( 1024 * 1024 / (DISK_PER_TENANT_KB > 0 ? DISK_PER_TENANT_KB : 1) )) tenants per GiB"
+  echo "  server memory:      $MEMORY_PER_TENANT_KB kB per tenant session, $(( 1024 * 1024 / (MEMORY_PER_TENANT_KB > 0 ? MEMORY_PER_TENANT_KB : 1) )) tenants per GiB"
+  echo "  catalog relations:  $(scalar "SELECT count(*) FROM pg_class" $( [ "$MODE" == "pooled" ] && echo $POOLED_DB || echo tenant1 )) in $( [ "$MODE" == "pooled" ] && echo $POOLED_DB || echo 'each tenant database' )"
+done
@@ -0,0 +1,25 @@
+#!/bin/bash -e
+
+# Mirrors the connection broker (PgBouncer) image into the connection-broker ECR repo. A tag is only
+# ever built once, so every cell runs the same image until CONNECTION_BROKER_IMAGE_TAG is changed.
+# Usage: ./build-broker-image.sh <region> <account_id> [tag]
+
+AWS_REGION=$1
+ACCOUNT_ID=$2
+IMAGE_TAG=${3:-pgbouncer-alpine3.21}
+REPOSITORY=$ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com/connection-broker
+
+if aws ecr describe-images --region $AWS_REGION --repository-name connection-broker --image-ids imageTag=$IMAGE_TAG > /dev/null 2>&1; then
+  echo "connection-broker:$IMAGE_TAG already mirrored"
+  exit 0
+fi
+
+cd ../connection-broker
+
+docker build --platform linux/amd64 -f dockerfile -t connection-broker:$IMAGE_TAG .
+echo "build completed"
+
+aws ecr get-login-password --region $AWS_REGION | docker login --username AWS --password-stdin $ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com
+docker tag connection-broker:$IMAGE_TAG $REPOSITORY:$IMAGE_TAG
+docker push $REPOSITORY:$IMAGE_TAG
+echo "pushed"
@@ -12,6 +12,10 @@ fi
 
 CELL_NAME=$1
 CELL_SIZE=$2
+# Optional third param, 'true' adds an Aurora read replica that serves product reads
+CELL_READ_REPLICA=${3:-false}
+# Optional fourth param, 'true' adds a transaction-pooling connection broker (PgBouncer) to the cell
+CELL_CONNECTION_BROKER=${4:-false}
 echo "Deploying Cell $CELL_NAME with Size $CELL_SIZE"
 
 cd ../cdk
@@ -34,6 +38,8 @@ echo Starting the deployment of CDK Stack
 npx cdk deploy "Cell-$CELL_NAME" --app "npx ts-node bin/app.ts" \
   --context cellId="$CELL_NAME" \
   --context cellSize="$CELL_SIZE" \
+  --context cellReadReplica="$CELL_READ_REPLICA" \
+  --context cellConnectionBroker="$CELL_CONNECTION_BROKER" \
   --require-approval never \
   --concurrency 10 \
   --asset-parallelism true \
@@ -56,4 +62,6 @@ if [ -s stack_outputs.json ]; then
 else
   echo CDK deploy ended without outputs file being created at all, so exiting with an error code
   exit 1
-fi
\ No newline at end of file
+fi
+echo Migrating the tenant databases of Cell $CELL_NAME
+../scripts/migrate-tenants.sh "$CELL_NAME"
@@ -1,9 +1,12 @@
 #!/bin/bash
 
-if [ $# -eq 6 ]; then
-  echo "Deploying stack: $0 $CELL_ID $CELL_SIZE $TENANT_ID $TENANT_EMAIL $TENANT_LISTENER_PRIORITY $PRODUCT_IMAGE_VERSION"  
+if [ $# -ge 6 ] && [ $# -le 9 ]; then
+  echo "Deploying stack: $0 $*"
 else
-  echo "Need all six params: $0 <cellId> <cell_size> <tenantId> <tenant Email> <tenant listener priority> <product_image_Version>"
+  echo "Need six to nine params: $0 <cellId> <cell_size> <tenantId> <tenant Email> <tenant listener priority> <product_image_Version> [product_write_mode] [tenant_tier] [tenant_secret_name]"
+  echo "  product_write_mode  direct (default) or write-behind"
+  echo "  tenant_tier         basic, advanced or premium; picks the pooled, dedicated or partitioned database layout"
+  echo "  tenant_secret_name  name of the tenant's database secret, <tenantId>Credentials by default"
   exit 1
 fi
 
@@ -13,6 +16,9 @@ TENANT_ID=$3
 TENANT_EMAIL=$4
 TENANT_LISTENER_PRIORITY=$5
 PRODUCT_IMAGE_VERSION=$6
+PRODUCT_WRITE_MODE=${7:-direct}
+TENANT_TIER=$8
+TENANT_SECRET_NAME=$9
 
 cd ../cdk
 echo ${PWD}
@@ -37,6 +43,9 @@ npx cdk deploy "Cell-$CELL_ID-Tenant-$TENANT_ID" --app "npx ts-node bin/app.ts"
   --context tenantEmail="$TENANT_EMAIL" \
   --context tenantListenerPriorityBase="$TENANT_LISTENER_PRIORITY" \
   --context productImageVersion="$PRODUCT_IMAGE_VERSION" \
+  --context productWriteMode="$PRODUCT_WRITE_MODE" \
+  --context tenantTier="$TENANT_TIER" \
+  --context tenantSecretName="$TENANT_SECRET_NAME" \
   --no-staging \
   --require-approval never \
   --concurrency 10 \
@@ -0,0 +1,49 @@
+#!/bin/bash -e
+
+# Applies the pending schema migrations (cdk/lambdas/migrations) to every tenant database of a cell
+# through the cell's TenantRDSInitializer Lambda. The Lambda migrates as many tenants as fit in one
+# invocation and reports IN_PROGRESS while some are still pending, so it is invoked until it reports OK.
+# deploy-cell.sh runs this after every cell deployment, so each wave of the staggered deployment
+# migrates the tenants of the cells it has just updated.
+# Usage: ./migrate-tenants.sh <cellName> [targetVersion]
+
+if [ -z "$1" ]; then
+  echo "Usage: $0 <cellName> [targetVersion]"
+  exit 1
+fi
+
+CELL_NAME=$1
+TARGET_VERSION=$2
+STACK_OUTPUTS=$(dirname "$0")/../cdk/stack_outputs.json
+MAX_INVOCATIONS=20
+
+FUNCTION_NAME=$(jq -r --arg stack "Cell-$CELL_NAME" \
+  '.[$stack] | to_entries[] | select(.key | contains("TenantRDSInitializerLambdaName")) | .value' "$STACK_OUTPUTS")
+if [ -z "$FUNCTION_NAME" ]; then
+  echo "TenantRDSInitializerLambdaName not found in $STACK_OUTPUTS"
+  exit 1
+fi
+
+if [ -n "$TARGET_VERSION" ]; then
+  PAYLOAD=$(jq -nc --arg version "$TARGET_VERSION" '{tenantState: "MIGRATE", targetVersion: $version}')
+else
+  PAYLOAD='{"tenantState": "MIGRATE"}'
+fi
+
+for INVOCATION in $(seq 1 $MAX_INVOCATIONS); do
+  aws lambda invoke --function-name "$FUNCTION_NAME" --cli-binary-format raw-in-base64-out \
+    --cli-read-timeout 0 --payload "$PAYLOAD" /tmp/migrate-tenants.json > /dev/null
+  STATUS=$(jq -r '.status' /tmp/migrate-tenants.json)
+  jq -r '.results[]? | "\(.tenantId): \(.status) \(.fromVersion // "-") -> \(.version // "-") \(.message // "")"' /tmp/migrate-tenants.json
+  echo "Migration run $INVOCATION of cell $CELL_NAME: $STATUS"
+
+  if [ "$STATUS" == "OK" ]; then
+    exit 0
+  elif [ "$STATUS" != "IN_PROGRESS" ]; then
+    cat /tmp/migrate-tenants.json
+    exit 1
+  fi
+done
+
+echo "Tenant migrations of cell $CELL_NAME did not finish after $MAX_INVOCATIONS invocations"
+exit 1
@@ -4,8 +4,14 @@ from botocore.exceptions import NoCredentialsError, PartialCredentialsError, Cli
 import os
 import psycopg
 from models.product_models import Product
+from write_behind import WriteBehindWriter, QueueFullError, INSERT_PRODUCT_SQL
 import json
 import logging
+import atexit
+import signal
+import sys
+import threading
+import time
 from jose import jwk, jwt
 from jose.utils import base64url_decode
 import string
@@ -24,6 +30,43 @@ secrets_manager = boto3.client('secretsmanager', region_name=os.environ['AWS_REG
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 
+# Opt-in write-behind mode. Each tenant runs its own ProductService, so the mode is set per tenant
+# through the task definition environment (see CellTenantStack).
+WRITE_BEHIND_ENABLED = os.environ.get('PRODUCT_WRITE_MODE', 'direct') == 'write-behind'
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', '1000'))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '100'))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL_MS', '20'))
+WRITE_BEHIND_ENQUEUE_TIMEOUT_MS = int(os.environ.get('WRITE_BEHIND_ENQUEUE_TIMEOUT_MS', '500'))
+WRITE_BEHIND_COMMIT_TIMEOUT_MS = int(os.environ.get('WRITE_BEHIND_COMMIT_TIMEOUT_MS', '10000'))
+
+write_behind_writers = {}
+write_behind_lock = threading.Lock()
+
+# Read replica routing. GET requests use the reader endpoint from the tenant secret when there is one,
+# unless the tenant wrote recently (read-your-writes) or the replica is lagging too far behind.
+# Writes are remembered by the task that served them, and returned to the client as a write marker, the
+# wall clock time of the write in WRITE_MARKER_HEADER; a read that sends the marker back goes to the
+# primary within the window whichever task serves it.
+WRITE_MARKER_HEADER = 'X-Tenant-Write-At'
+READ_YOUR_WRITES_WINDOW_SECONDS = float(os.environ.get('READ_YOUR_WRITES_WINDOW_SECONDS', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '1'))
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL_SECONDS', '1'))
+# Aurora reports replica lag through aurora_replica_status(), community Postgres through the replay position
+AURORA_REPLICA_LAG_SQL = "SELECT COALESCE(max(replica_lag_in_msec), 0) / 1000.0 FROM aurora_replica_status() WHERE server_id = aurora_db_instance_identifier()"
+POSTGRES_REPLICA_LAG_SQL = ("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+last_tenant_writes = {}
+replica_lag_cache = {}
+
+# Where each tenant's tables are, as recorded in its secret: tenants of pooled tiers have a schema named
+# after them in the cell's shared database, every other tenant has a database of its own with an app schema.
+tenant_schemas = {}
+
+# Cell connection broker (PgBouncer in transaction pooling mode). Equal to the writer endpoint when the cell has none.
+DB_BROKER_HOST = os.environ.get('DB_BROKER_HOST')
+DB_BROKER_PORT = os.environ.get('DB_BROKER_PORT')
+
 def get_tenant_id(request):
     bearer_token = request.headers.get('Authorization')
     if not bearer_token:
@@ -34,7 +77,8 @@ def get_tenant_id(request):
     return tenant_id
 
 def get_tenant_secret(tenant_id):
-    response = secrets_manager.get_secret_value(SecretId=tenant_id+'Credentials')
+    # a tenant moved in from another cell has a secret name of its own
+    response = secrets_manager.get_secret_value(SecretId=os.environ.get('TENANT_SECRET_NAME', tenant_id+'Credentials'))
     
     secret_value = response['SecretString']
     #convert string to json
@@ -44,13 +88,99 @@ def get_tenant_secret(tenant_id):
     host = secret_value["host"]
     port = secret_value["port"]
     username = secret_value["username"]
+    # The reader endpoint is optional; tenants provisioned before it existed get it from the task environment
+    reader_host = secret_value.get("readerHost", os.environ.get('DB_READER_HOST'))
+    reader_port = secret_value.get("readerPort", os.environ.get('DB_READER_PORT', port))
+    dbname = secret_value.get("dbname", tenant_id)
+    tenant_schemas[tenant_id] = secret_value.get("schema", "app")
     print(password, host, port)
-    return password, host, port, username
+    return password, host, port, username, reader_host, reader_port, dbname
+
+def products_table(tenant_id):
+    """Schema-qualified name of the tenant's products table"""
+    if tenant_id not in tenant_schemas:
+        get_tenant_secret(tenant_id)
+    return tenant_schemas[tenant_id] + ".products"
 
-def tenant_connection(tenant_id):
-    password, host, port, username = get_tenant_secret(tenant_id)
+def record_tenant_write(tenant_id):
+    """Remembers the tenant's write and returns the write marker header for the response"""
+    written_at = time.time()
+    last_tenant_writes[tenant_id] = written_at
+    return {WRITE_MARKER_HEADER: '{:.3f}'.format(written_at)}
+
+def client_write_marker():
+    try:
+        return float(request.headers.get(WRITE_MARKER_HEADER, ''))
+    except ValueError:
+        return None
+
+def in_read_your_writes_window(tenant_id):
+    now = time.time()
+    return any(written_at is not None and now - written_at < READ_YOUR_WRITES_WINDOW_SECONDS
+               for written_at in (last_tenant_writes.get(tenant_id), client_write_marker()))
+
+def get_replica_lag(connection, reader_host):
+    """Returns the replication lag of the reader in seconds, re-checking it at most once per
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS for each reader host"""
+    cached = replica_lag_cache.get(reader_host)
+    if cached and time.monotonic() - cached['checked_at'] < REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+        return cached['lag']
+
+    is_aurora = connection.execute("SELECT to_regproc('aurora_replica_status') IS NOT NULL").fetchone()[0]
+    lag = float(connection.execute(AURORA_REPLICA_LAG_SQL if is_aurora else POSTGRES_REPLICA_LAG_SQL).fetchone()[0])
+    replica_lag_cache[reader_host] = {'lag': lag, 'checked_at': time.monotonic()}
+    return lag
+
+def replica_lagging(reader_host):
+    cached = replica_lag_cache.get(reader_host)
+    return (cached is not None and cached['lag'] > REPLICA_MAX_LAG_SECONDS
+            and time.monotonic() - cached['checked_at'] < REPLICA_LAG_CHECK_INTERVAL_SECONDS)
+
+def tenant_read_connection(tenant_id, dbname, password, host, username, reader_host, reader_port):
+    """Opens a connection to the reader endpoint, or returns None when the read has to go to the primary"""
+    if not reader_host or reader_host == host or in_read_your_writes_window(tenant_id) or replica_lagging(reader_host):
+        return None
+    connection = None
+    try:
+        connection = psycopg.connect(dbname=dbname,
+                                 host=reader_host,
+                                 port=reader_port,
+                                 user=username,
+                                 password=password,
+                                 autocommit=True)
+        lag = get_replica_lag(connection, reader_host)
+        if lag <= REPLICA_MAX_LAG_SECONDS:
+            return connection
+        app.logger.info(f"Replica lag of {lag}s is over {REPLICA_MAX_LAG_SECONDS}s, reading from primary")
+    except psycopg.Error as e:
+        app.logger.warning(f"Reader endpoint unavailable, reading from primary: {e}")
+    if connection:
+        connection.close()
+    return None
+
+def tenant_connection(tenant_id, read_only=False):
+    password, host, port, username, reader_host, reader_port, dbname = get_tenant_secret(tenant_id)
+
+    if read_only:
+        connection = tenant_read_connection(tenant_id, dbname, password, host, username, reader_host, reader_port)
+        if connection:
+            return connection
+
+    if DB_BROKER_HOST and DB_BROKER_HOST != host:
+        try:
+            # Server-side prepared statements don't survive transaction pooling, so psycopg must not create them
+            return psycopg.connect(dbname=dbname,
+                                 host=DB_BROKER_HOST,
+                                 port=DB_BROKER_PORT,
+                                 user=username,
+                                 password=password,
+                                 autocommit=True,
+                                 prepare_threshold=None)
+        except psycopg.OperationalError as e:
+            # e.g. a tenant the broker's userlist does not have yet, or a broker redeployment
+            app.logger.warning(f"Connection broker unavailable, connecting directly: {e}")
                                  
-    connection = psycopg.connect(dbname=tenant_id,
+    connection = psycopg.connect(dbname=dbname,
                              host=host,
                              port=port,
                              user=username,
@@ -58,6 +188,58 @@ def tenant_connection(tenant_id):
                              autocommit=True)                                 
     return connection
 
+def get_write_behind_writer(tenant_id):
+    writer = write_behind_writers.get(tenant_id)
+    if writer is not None:
+        return writer
+    # resolved before taking the lock, it may call Secrets Manager and must not hold up other tenants' writes
+    table = products_table(tenant_id)
+    with write_behind_lock:
+        writer = write_behind_writers.get(tenant_id)
+        if writer is None:
+            writer = WriteBehindWriter(tenant_id, tenant_connection,
+                                       products_table=table,
+                                       max_queue_size=WRITE_BEHIND_QUEUE_SIZE,
+                                       batch_size=WRITE_BEHIND_BATCH_SIZE,
+                                       flush_interval_ms=WRITE_BEHIND_FLUSH_INTERVAL_MS)
+            write_behind_writers[tenant_id] = writer
+        return writer
+
+def flush_write_behind_writers():
+    with write_behind_lock:
+        writers = list(write_behind_writers.values())
+        write_behind_writers.clear()
+    for writer in writers:
+        writer.close()
+        app.logger.info(f"Flushed write-behind queue for {writer.tenant_id}: {writer.committed} products in {writer.flushes} commits")
+
+def handle_sigterm(signum, frame):
+    flush_write_behind_writers()
+    sys.exit(0)
+
+if WRITE_BEHIND_ENABLED:
+    atexit.register(flush_write_behind_writers)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+def create_product_write_behind(tenant_id, product):
+    # Clients choose between an acknowledgement once the product is queued and one once it is committed
+    ack_mode = request.headers.get('X-Write-Ack', 'commit').lower()
+    writer = get_write_behind_writer(tenant_id)
+    try:
+        pending = writer.submit(product, timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT_MS / 1000.0)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    write_marker = record_tenant_write(tenant_id)
+
+    if ack_mode == 'enqueue':
+        return jsonify({"message": "product accepted"}), 202, write_marker
+
+    if not pending.wait(WRITE_BEHIND_COMMIT_TIMEOUT_MS / 1000.0):
+        return jsonify({"error": "timed out waiting for product commit"}), 504
+    if pending.error:
+        return jsonify({"error": str(pending.error)}), 500
+    return jsonify({"message": "product created"}), 200, write_marker
+
 @app.route('/')
 def home():
     return "Welcome to ProductService!!"
@@ -74,6 +256,7 @@ def health_check():
 @app.route('/product', methods=['POST'])
 def create_product():
     connection = None
+    write_marker = {}
     try:
         # Generate and log 1MB entry
         large_log = generate_large_log_entry()
@@ -87,10 +270,14 @@ def create_product():
         if not tenant_id:
             return jsonify({"error": "tenantId header is required"}), 400
         
-        connection = tenant_connection(tenant_id)    
         product_info = request.get_json()
         product = Product(**product_info, tenantId=tenant_id)        
-        connection.execute("INSERT INTO app.products (product_id, product_name, product_description, product_price, tenant_id) VALUES (%s, %s, %s, %s, %s)", (product.productId, product.productName, product.productDescription, product.productPrice, product.tenantId))
+        if WRITE_BEHIND_ENABLED:
+            return create_product_write_behind(tenant_id, product)
+
+        connection = tenant_connection(tenant_id)    
+        connection.execute(INSERT_PRODUCT_SQL.format(products_table(tenant_id)), (product.productId, product.productName, product.productDescription, product.productPrice, product.tenantId))
+        write_marker = record_tenant_write(tenant_id)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -99,7 +286,7 @@ def create_product():
             connection.close()
         
 
-    return jsonify({"message": "product created"}), 200
+    return jsonify({"message": "product created"}), 200, write_marker
 
 
 @app.route('/product', methods=['GET'])
@@ -114,8 +301,8 @@ def get_products():
         if not tenant_id:
             return jsonify({"error": "tenantId header is required"}), 400
         
-        connection = tenant_connection(tenant_id)                
-        cur = connection.execute("SELECT product_id, product_name, product_description, product_price, tenant_id FROM app.products WHERE tenant_id = '{0}'".format(tenant_id))
+        connection = tenant_connection(tenant_id, read_only=True)                
+        cur = connection.execute("SELECT product_id, product_name, product_description, product_price, tenant_id FROM {1} WHERE tenant_id = '{0}'".format(tenant_id, products_table(tenant_id)))
         results = cur.fetchall()
         app.logger.info(results)
         products=[]
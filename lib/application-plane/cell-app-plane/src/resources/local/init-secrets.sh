@@ -0,0 +1,4 @@
+#!/bin/bash
+# Creates the tenant secret ProductService reads, pointing writes at the primary and reads at the replica
+awslocal secretsmanager create-secret --name tenant1Credentials \
+  --secret-string '{"username":"tenant1","password":"tenant1pwd","host":"postgres-primary","port":"5432","readerHost":"postgres-replica","readerPort":"5432"}'
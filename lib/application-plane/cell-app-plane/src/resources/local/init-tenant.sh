@@ -0,0 +1,7 @@
+#!/bin/bash
+# Provisions the local tenant database the same way the TenantRDSInitializer Lambda does
+set -e
+
+export PGPASSWORD=$POSTGRESQL_PASSWORD
+psql -v ON_ERROR_STOP=1 -U postgres -d postgres -c "CREATE DATABASE tenant1;"
+cat /tenant-schema.sql /tenant-role.sql | sed -e "s/<tenant_id>/tenant1/g" -e "s/<tenant_pwd>/tenant1pwd/g" -e "s/<schema>/app/g" | psql -v ON_ERROR_STOP=1 -U postgres -d tenant1
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# formatted with the schema-qualified products table of the tenant
+INSERT_PRODUCT_SQL = "INSERT INTO {0} (product_id, product_name, product_description, product_price, tenant_id) VALUES (%s, %s, %s, %s, %s)"
+
+class QueueFullError(Exception):
+    """Raised when the write-behind queue stays full for longer than the enqueue timeout"""
+    pass
+
+class PendingWrite:
+    """A product accepted into the write-behind queue. Callers that want to wait for the
+    commit block on `wait()`; the flusher marks it done once the group it belongs to has
+    been committed (or failed)."""
+    def __init__(self, product):
+        self.product = product
+        self.error = None
+        self._done = threading.Event()
+
+    def complete(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+class WriteBehindWriter:
+    """Buffers product inserts for a single tenant in a bounded in-memory queue and commits
+    them in groups. A group is flushed as soon as it reaches `batch_size` rows or when
+    `flush_interval_ms` has passed since its first row was taken off the queue, so each
+    commit (and its fsync) is shared by every row in the group."""
+    def __init__(self, tenant_id, connection_factory, products_table='app.products', max_queue_size=1000, batch_size=100, flush_interval_ms=20):
+        self.tenant_id = tenant_id
+        self.connection_factory = connection_factory
+        self.insert_sql = INSERT_PRODUCT_SQL.format(products_table)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.connection = None
+        self.committed = 0
+        self.flushes = 0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{tenant_id}", daemon=True)
+        self._thread.start()
+
+    def submit(self, product, timeout=0.5):
+        """Queues a product for the next group commit. Blocks for up to `timeout` seconds
+        while the queue is full and raises QueueFullError if no slot frees up, which is how
+        backpressure is pushed back onto the client."""
+        if self._stopping.is_set():
+            raise QueueFullError(f"write-behind writer for {self.tenant_id} is shutting down")
+        pending = PendingWrite(product)
+        try:
+            self.queue.put(pending, timeout=timeout)
+        except queue.Full:
+            raise QueueFullError(f"write-behind queue for {self.tenant_id} is full")
+        return pending
+
+    def close(self, timeout=10):
+        """Stops accepting new writes, flushes everything still queued and closes the connection"""
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stopping.is_set():
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        try:
+            self._commit([pending.product for pending in batch])
+            for pending in batch:
+                pending.complete()
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} products failed for {self.tenant_id}: {e}")
+            self._reset_connection()
+            # Retry row by row so that one bad product (e.g. a duplicate id) only fails itself
+            for pending in batch:
+                try:
+                    self._commit([pending.product])
+                    pending.complete()
+                except Exception as row_error:
+                    self._reset_connection()
+                    pending.complete(row_error)
+        self.flushes += 1
+
+    def _commit(self, products):
+        if self.connection is None:
+            self.connection = self.connection_factory(self.tenant_id)
+        with self.connection.transaction():
+            with self.connection.cursor() as cur:
+                cur.executemany(self.insert_sql, [(p.productId, p.productName, p.productDescription, p.productPrice, p.tenantId) for p in products])
+        self.committed += len(products)
+
+    def _reset_connection(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
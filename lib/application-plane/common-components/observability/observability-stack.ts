@@ -22,6 +22,42 @@ export class CommonObservability extends Stack {
 
     Tags.of(this).add('SaaSApplicationService', `Observability`);                
 
+    // Capacity alarms on the CellObserver's metrics, across all cells so cells created later are covered.
+    // They fire while a cell can still be relieved, before onboarding to it is refused
+    const cellTimeToFull = new MathExpression({
+        expression: 'SELECT MIN(CellTimeToFull) FROM SCHEMA(CellManagement, CellId, CellName)',
+        label: 'Shortest time to full',
+        period: Duration.minutes(5)
+    });
+
+    const cellUtilizationRatio = new MathExpression({
+        expression: 'SELECT MAX(CellUtilizationRatio) FROM SCHEMA(CellManagement, CellId, CellName)',
+        label: 'Highest utilization',
+        period: Duration.minutes(5)
+    });
+
+    const cellTimeToFullAlarm = new cloudwatch.Alarm(this, 'CellTimeToFullAlarm', {
+        alarmName: 'SaaS-Cell-Time-To-Full',
+        alarmDescription: 'A cell is forecast to reach its maximum number of tenants within 6 hours',
+        metric: cellTimeToFull,
+        threshold: Duration.hours(6).toSeconds(),
+        comparisonOperator: cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+        evaluationPeriods: 3,
+        datapointsToAlarm: 3,
+        // cells that aren't filling up publish no forecast
+        treatMissingData: cloudwatch.TreatMissingData.NOT_BREACHING
+    });
+
+    const cellUtilizationRatioAlarm = new cloudwatch.Alarm(this, 'CellUtilizationRatioAlarm', {
+        alarmName: 'SaaS-Cell-Utilization-Ratio',
+        alarmDescription: 'A cell holds 90% or more of its maximum number of tenants',
+        metric: cellUtilizationRatio,
+        threshold: 90,
+        comparisonOperator: cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+        evaluationPeriods: 1,
+        treatMissingData: cloudwatch.TreatMissingData.NOT_BREACHING
+    });
+
     //TODO: Paste the code for the aggregated alarms, below this line             
     
     const applicationPlaneHealthDashboard = new Dashboard(this, 'ApplicationPlaneHealthDashboard', {
@@ -188,7 +224,39 @@ export class CommonObservability extends Stack {
                 liveData: true,
                 view: GraphWidgetView.TIME_SERIES
             }),
-        )             
+        ),
+        new Row(
+            new cloudwatch.AlarmWidget({
+                title: 'Cell Time To Full',
+                alarm: cellTimeToFullAlarm,
+                width: 8,
+                height: 6
+            }),
+            new cloudwatch.AlarmWidget({
+                title: 'Cell Utilization Ratio',
+                alarm: cellUtilizationRatioAlarm,
+                width: 8,
+                height: 6
+            }),
+            new GraphWidget({
+                title: 'Tenant Onboardings Per Hour By Cell',
+                left: [
+                    new MathExpression({
+                        expression: 'SELECT AVG(CellOnboardingsPerHour) FROM SCHEMA(CellManagement, CellId, CellName) GROUP BY CellName',
+                        label: 'Onboardings',
+                    })
+                ],
+                leftYAxis: {
+                    label: 'Count',
+                    showUnits: false
+                },
+                period: Duration.minutes(15),
+                width: 8,
+                height: 6,
+                liveData: true,
+                view: GraphWidgetView.TIME_SERIES
+            })
+        )
     )
   }
 }
@@ -11,11 +11,16 @@ import {
   MethodLoggingLevel,
   LogGroupLogDestination
 } from 'aws-cdk-lib/aws-apigateway';
-import { Table, AttributeType, BillingMode, ProjectionType } from 'aws-cdk-lib/aws-dynamodb';
+import { Table, AttributeType, BillingMode, ProjectionType, StreamViewType } from 'aws-cdk-lib/aws-dynamodb';
 import { Rule, Schedule, EventBus } from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import { PolicyStatement } from 'aws-cdk-lib/aws-iam';
 import { StringParameter } from 'aws-cdk-lib/aws-ssm';
+import { Secret } from 'aws-cdk-lib/aws-secretsmanager';
+import { Runtime, StartingPosition } from 'aws-cdk-lib/aws-lambda';
+import { DynamoEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import { Trigger } from 'aws-cdk-lib/triggers';
+import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
 import { LogGroup, RetentionDays} from 'aws-cdk-lib/aws-logs';
 import { Construct } from 'constructs';
 import { IdentityProvider } from './identity-provider-construct';
@@ -32,6 +37,7 @@ export interface CellManagementSystemStackProps extends StackProps
 
 export class CellManagementSystem extends Stack {
   readonly cellManagementTable: Table;
+  readonly tenantDirectoryTable: Table;
 
   constructor(scope: Construct, id: string, props: CellManagementSystemStackProps) {
     super(scope, id, props);
@@ -47,19 +53,28 @@ export class CellManagementSystem extends Stack {
     const cellManagementBus = EventBus.fromEventBusArn(this, 'eventBus', props.eventBusArn);
     const cellToTenantKvs = KeyValueStore.fromKeyValueStoreArn(this, 'CellToTenantKvs', props.cellToTenantKvsArn);
     
+    // AuthPolicy and JWKS cache modules shared with the cell authorizer, which lives in the app plane package
+    const authPolicyLayer = new lambda_python.PythonLayerVersion(this, 'AuthPolicyLayer', {
+      entry: 'lib/application-plane/cell-app-plane/cdk/layers/auth-policy',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
     // Lambda function that processes requests from API Gateway to create a new Cell
     const authorizerLambda = new LambdaFunction(this, 'AuthorizerLambda', {
       friendlyFunctionName: 'AuthorizerFunction',
       index: 'controlPlaneAuthorizer.py',
       entry: 'lib/saas-management/cell-management-system/src/lambdas/Authorizer', 
       handler: 'handler',         
-      environmentVariables: {'IDP_DETAILS': JSON.stringify(idpDetails)}
+      environmentVariables: {'IDP_DETAILS': JSON.stringify(idpDetails)},
+      layers: [authPolicyLayer]
     });
 
     const tokenAuthorizer = new TokenAuthorizer(this, 'ControlPlaneAuthorizer', {
       handler: authorizerLambda.lambdaFunction,
       identitySource: IdentitySource.header('Authorization'),
-      resultsCacheTtl: Duration.seconds(30),
+      // the authorizer returns a policy covering every method the caller's role may use, so a
+      // cached result is valid for all control plane calls made with the same token
+      resultsCacheTtl: Duration.minutes(10),
     });
 
     // Create DynamoDB Table for Cell Management
@@ -68,6 +83,7 @@ export class CellManagementSystem extends Stack {
       billingMode: BillingMode.PAY_PER_REQUEST,
       removalPolicy: RemovalPolicy.DESTROY,
       pointInTimeRecovery: true,
+      stream: StreamViewType.NEW_AND_OLD_IMAGES,
     });
 
     // Add Global Secondary Index
@@ -88,6 +104,25 @@ export class CellManagementSystem extends Stack {
       nonKeyAttributes: ['tenant_name', 'current_status'],
     });
 
+    // Sparse index over the cell items only, they are the only items with an item_type, so listing
+    // cells reads cells and not every tenant of the table
+    cellManagementTable.addGlobalSecondaryIndex({
+      indexName: 'CellsByItemTypeIndex',
+      partitionKey: { name: 'item_type', type: AttributeType.STRING },
+      sortKey: { name: 'PK', type: AttributeType.STRING },
+      projectionType: ProjectionType.INCLUDE,
+      nonKeyAttributes: ['cell_name', 'current_status', 'cell_utilization', 'cell_max_capacity'],
+    });
+
+    // The cell of every tenant keyed on tenant_id, so a tenant is found with one GetItem without knowing
+    // its cell. Entries are written in the same transactions as the tenant items they point to
+    const tenantDirectoryTable = new Table(this, 'tenantDirectoryTable', {
+      partitionKey: { name: 'tenant_id', type: AttributeType.STRING },
+      billingMode: BillingMode.PAY_PER_REQUEST,
+      removalPolicy: RemovalPolicy.DESTROY,
+      pointInTimeRecovery: true,
+    });
+
     const restAPIAccessLogGroup = new LogGroup(this, 'APIGatewayAccessLogs', {
       removalPolicy: RemovalPolicy.DESTROY,
       retention: RetentionDays.ONE_WEEK,
@@ -184,15 +219,57 @@ export class CellManagementSystem extends Stack {
     );
     
 
+    // EMF output, the parallel table scan and the listener priority allocator, shared by the control plane functions
+    const emfBatchLayer = new lambda_python.PythonLayerVersion(this, 'EmfBatchLayer', {
+      entry: 'lib/saas-management/src/layers/emf-batch',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
+    const tableSweepLayer = new lambda_python.PythonLayerVersion(this, 'TableSweepLayer', {
+      entry: 'lib/saas-management/src/layers/table-sweep',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
+    const listenerPriorityLayer = new lambda_python.PythonLayerVersion(this, 'ListenerPriorityLayer', {
+      entry: 'lib/saas-management/src/layers/listener-priority',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
+    // The tenant directory lookup of the functions that accept a tenant without its CellId
+    const tenantDirectoryLayer = new lambda_python.PythonLayerVersion(this, 'TenantDirectoryLayer', {
+      entry: 'lib/saas-management/src/layers/tenant-directory',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
+    // Key that signs the NextToken of the list APIs, and the module that issues and checks the tokens
+    const paginationTokenSecret = new Secret(this, 'PaginationTokenSecret', {
+      description: 'Signing key for the NextToken of the control plane list APIs',
+      generateSecretString: {
+        excludePunctuation: true,
+        passwordLength: 64,
+      },
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
+
+    const paginationLayer = new lambda_python.PythonLayerVersion(this, 'PaginationLayer', {
+      entry: 'lib/saas-management/cell-management-system/src/layers/pagination',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
     // Lambda function that processes requests from API Gateway to List existing Cells
     const listCellsLambda = new LambdaFunction(this, 'ListCellsFunction', {
       friendlyFunctionName: 'ListCellsFunction',
       index: 'listCells.py',
       entry: 'lib/saas-management/cell-management-system/src/lambdas/ListCells', 
       handler: 'handler',
-      environmentVariables: {'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn}  
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn,
+        'PAGINATION_TOKEN_SECRET_ARN': paginationTokenSecret.secretArn
+      },
+      layers: [paginationLayer]
     });
     cellManagementTable.grantReadData(listCellsLambda.lambdaFunction);
+    paginationTokenSecret.grantRead(listCellsLambda.lambdaFunction);
     
     const listCellsResource = api.root.addResource("ListCells");
 
@@ -214,6 +291,10 @@ export class CellManagementSystem extends Stack {
       'GET',
       new LambdaIntegration(listCellsLambda.lambdaFunction),
       {
+        requestParameters: {
+          'method.request.querystring.Limit': false,
+          'method.request.querystring.NextToken': false,
+        },
         requestValidatorOptions: {
           validateRequestBody: false,
           validateRequestParameters: false,
@@ -295,8 +376,14 @@ export class CellManagementSystem extends Stack {
           TenantEmail: {
             type: JsonSchemaType.STRING,
           },
+          // how the tenant's ProductService writes products, kept on the tenant for every redeployment
+          ProductWriteMode: {
+            type: JsonSchemaType.STRING,
+            enum: ['direct', 'write-behind'],
+          },
         },
-        required: ['TenantName','CellId', 'TenantTier', 'TenantEmail'],
+        // without a CellId the tenant is placed in a cell chosen by the placement strategy
+        required: ['TenantName', 'TenantTier', 'TenantEmail'],
       },
     });
 
@@ -308,12 +395,19 @@ export class CellManagementSystem extends Stack {
       handler: 'handler', 
       environmentVariables: {
         CELL_MANAGEMENT_TABLE: cellManagementTable.tableArn,
+        CELL_MANAGEMENT_TABLE_NAME: cellManagementTable.tableName,
         CELL_MANAGEMENT_BUS: cellManagementBus.eventBusName,
-        IMAGE_VER_SSM_PARAM_NAME: props.versionSsmParameter.parameterName
+        IMAGE_VER_SSM_PARAM_NAME: props.versionSsmParameter.parameterName,
+        TENANT_DIRECTORY_TABLE_NAME: tenantDirectoryTable.tableName,
+        // least-loaded, best-fit or tier-affinity, compared by scripts/simulate-cell-placement.py
+        PLACEMENT_STRATEGY: 'least-loaded',
+        PLACEMENT_CACHE_TTL_SECONDS: '30'
       },        
+      layers: [listenerPriorityLayer]
     });
 
     cellManagementTable.grantReadWriteData(assignTenantToCellLambda.lambdaFunction);
+    tenantDirectoryTable.grantReadWriteData(assignTenantToCellLambda.lambdaFunction);
     cellManagementBus.grantPutEventsTo(assignTenantToCellLambda.lambdaFunction);
 
     const policyStatement = new PolicyStatement({
@@ -354,6 +448,176 @@ export class CellManagementSystem extends Stack {
       }
     );
 
+    /**
+     * Start of bulkAssignTenants method and associated resources
+     */
+    const bulkAssignTenantsRequestModel = api.addModel('BulkAssignTenantsRequestModel', {
+      contentType: 'application/json',
+      schema: {
+        schema: JsonSchemaVersion.DRAFT7,
+        title: 'Bulk Assign Tenants Request Data Model',
+        type: JsonSchemaType.OBJECT,
+        properties: {
+          Tenants: {
+            type: JsonSchemaType.ARRAY,
+            minItems: 1,
+            maxItems: 100,
+            // each tenant as in the AssignTenantToCell request, validated per tenant by the function
+            items: {
+              type: JsonSchemaType.OBJECT,
+              properties: {
+                TenantName: {
+                  type: JsonSchemaType.STRING,
+                },
+                CellId: {
+                  type: JsonSchemaType.STRING,
+                },
+                TenantTier: {
+                  type: JsonSchemaType.STRING,
+                },
+                TenantEmail: {
+                  type: JsonSchemaType.STRING,
+                },
+                ProductWriteMode: {
+                  type: JsonSchemaType.STRING,
+                  enum: ['direct', 'write-behind'],
+                },
+              },
+            },
+          },
+        },
+        required: ['Tenants'],
+      },
+    });
+
+    // Lambda function that onboards a batch of tenants in one request
+    const bulkAssignTenantsLambda = new LambdaFunction(this, 'BulkAssignTenantsFunction', {
+      friendlyFunctionName: 'BulkAssignTenants',
+      index: 'bulkAssignTenants.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/AssignTenantToCell',
+      handler: 'handler',
+      environmentVariables: {
+        CELL_MANAGEMENT_TABLE: cellManagementTable.tableArn,
+        CELL_MANAGEMENT_TABLE_NAME: cellManagementTable.tableName,
+        CELL_MANAGEMENT_BUS: cellManagementBus.eventBusName,
+        IMAGE_VER_SSM_PARAM_NAME: props.versionSsmParameter.parameterName,
+        TENANT_DIRECTORY_TABLE_NAME: tenantDirectoryTable.tableName,
+        PLACEMENT_STRATEGY: 'least-loaded',
+        PLACEMENT_CACHE_TTL_SECONDS: '30',
+        MAX_BULK_TENANTS: '100'
+      },
+      // the API Gateway integration times out after 29 seconds
+      timeout: Duration.seconds(29),
+      layers: [listenerPriorityLayer]
+    });
+
+    cellManagementTable.grantReadWriteData(bulkAssignTenantsLambda.lambdaFunction);
+    tenantDirectoryTable.grantReadWriteData(bulkAssignTenantsLambda.lambdaFunction);
+    cellManagementBus.grantPutEventsTo(bulkAssignTenantsLambda.lambdaFunction);
+    bulkAssignTenantsLambda.lambdaFunction.addToRolePolicy(policyStatement);
+
+    const bulkAssignTenantsResource = api.root.addResource('BulkAssignTenants');
+    bulkAssignTenantsResource.addCorsPreflight({
+      allowOrigins: ['*'],
+      allowMethods: ['POST', 'OPTIONS'],
+      allowHeaders: [
+        'Content-Type',
+        'X-Amz-Date',
+        'Authorization',
+        'X-Api-Key',
+        'X-Amz-Security-Token',
+        'X-Amz-User-Agent',
+      ],
+    })
+
+    bulkAssignTenantsResource.addMethod(
+      'POST',
+      new LambdaIntegration(bulkAssignTenantsLambda.lambdaFunction),
+      {
+        requestModels: {
+          'application/json': bulkAssignTenantsRequestModel,
+        },
+        requestValidatorOptions: {
+          validateRequestBody: true,
+          validateRequestParameters: false,
+        },
+        authorizationType: AuthorizationType.CUSTOM,
+        authorizer: tokenAuthorizer,
+      }
+    );
+
+    /**
+     * Start of moveTenant method and associated resources
+     */
+    const moveTenantRequestModel = api.addModel('MoveTenantRequestModel', {
+      contentType: 'application/json',
+      schema: {
+        schema: JsonSchemaVersion.DRAFT7,
+        title: 'Move Tenant Request Data Model',
+        type: JsonSchemaType.OBJECT,
+        properties: {
+          TenantId: {
+            type: JsonSchemaType.STRING,
+          },
+          SourceCellId: {
+            type: JsonSchemaType.STRING,
+          },
+          TargetCellId: {
+            type: JsonSchemaType.STRING,
+          },
+        },
+        required: ['TenantId', 'SourceCellId', 'TargetCellId'],
+      },
+    });
+
+    // Lambda function that processes requests from API Gateway to move a Tenant to another Cell
+    const moveTenantLambda = new LambdaFunction(this, 'MoveTenantFunction', {
+      friendlyFunctionName: 'MoveTenant',
+      index: 'moveTenant.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/MoveTenant',
+      handler: 'handler',
+      environmentVariables: {
+        CELL_MANAGEMENT_TABLE: cellManagementTable.tableArn,
+        CELL_MANAGEMENT_BUS: cellManagementBus.eventBusName
+      },
+      layers: [listenerPriorityLayer]
+    });
+
+    cellManagementTable.grantReadWriteData(moveTenantLambda.lambdaFunction);
+    cellManagementBus.grantPutEventsTo(moveTenantLambda.lambdaFunction);
+
+    // Create a resource
+    const moveTenantResource = api.root.addResource('MoveTenant');
+    moveTenantResource.addCorsPreflight({
+      allowOrigins: ['*'],
+        allowMethods: ['POST', 'OPTIONS'],
+        allowHeaders: [
+          'Content-Type',
+          'X-Amz-Date',
+          'Authorization',
+          'X-Api-Key',
+          'X-Amz-Security-Token',
+          'X-Amz-User-Agent',
+        ],
+    })
+
+    // Create a method and associate the request model
+    const moveTenantMethod = moveTenantResource.addMethod(
+      'POST',
+      new LambdaIntegration(moveTenantLambda.lambdaFunction),
+      {
+        requestModels: {
+          'application/json': moveTenantRequestModel,
+        },
+        requestValidatorOptions: {
+          validateRequestBody: true,
+          validateRequestParameters: false,
+        },
+        authorizationType: AuthorizationType.CUSTOM,
+        authorizer: tokenAuthorizer,
+      }
+    );
+
     /**
      * Start of describeTenant method and associated resources
      */    
@@ -364,10 +628,13 @@ export class CellManagementSystem extends Stack {
       entry: 'lib/saas-management/cell-management-system/src/lambdas/DescribeTenant', 
       handler: 'handler',      
       environmentVariables: {
-        'TENANT_MANAGEMENT_TABLE': cellManagementTable.tableArn
-      }
+        'TENANT_MANAGEMENT_TABLE': cellManagementTable.tableArn,
+        'TENANT_DIRECTORY_TABLE_NAME': tenantDirectoryTable.tableName
+      },
+      layers: [tenantDirectoryLayer]
     })
     cellManagementTable.grantReadData(describeTenantLambda.lambdaFunction); 
+    tenantDirectoryTable.grantReadData(describeTenantLambda.lambdaFunction);
 
     const describeTenantResource = api.root.addResource("DescribeTenant");
 
@@ -389,8 +656,9 @@ export class CellManagementSystem extends Stack {
       'GET',
       new LambdaIntegration(describeTenantLambda.lambdaFunction),
       {
+        // without a CellId the tenant's cell is looked up in the tenant directory
         requestParameters: {
-          'method.request.querystring.CellId': true,
+          'method.request.querystring.CellId': false,
           'method.request.querystring.TenantId': true,
         },
         requestValidatorOptions: {
@@ -413,10 +681,13 @@ export class CellManagementSystem extends Stack {
       entry: 'lib/saas-management/cell-management-system/src/lambdas/ListTenants', 
       handler: 'handler',      
       environmentVariables: {
-        'TENANT_MANAGEMENT_TABLE': cellManagementTable.tableArn
-      }
+        'TENANT_MANAGEMENT_TABLE': cellManagementTable.tableArn,
+        'PAGINATION_TOKEN_SECRET_ARN': paginationTokenSecret.secretArn
+      },
+      layers: [paginationLayer]
     })
     cellManagementTable.grantReadData(listTenantsLambda.lambdaFunction); 
+    paginationTokenSecret.grantRead(listTenantsLambda.lambdaFunction);
 
     const listTenantsResource = api.root.addResource("ListTenants");
 
@@ -440,6 +711,8 @@ export class CellManagementSystem extends Stack {
       {
         requestParameters: {
           'method.request.querystring.CellId': true,          
+          'method.request.querystring.Limit': false,
+          'method.request.querystring.NextToken': false,
         },
         requestValidatorOptions: {
           validateRequestBody: false,
@@ -476,10 +749,16 @@ export class CellManagementSystem extends Stack {
       entry: 'lib/saas-management/cell-management-system/src/lambdas/DeactivateTenant', 
       handler: 'handler', 
       environmentVariables: {
+        "CELL_MANAGEMENT_TABLE": cellManagementTable.tableArn,
         "CELL_ROUTER_KVS_ARN": cellToTenantKvs.keyValueStoreArn,
-      },        
+        "TENANT_DIRECTORY_TABLE_NAME": tenantDirectoryTable.tableName,
+      },
+      layers: [tenantDirectoryLayer]
     });
 
+    cellManagementTable.grantReadWriteData(deactivateTenantLambda.lambdaFunction);
+    tenantDirectoryTable.grantReadData(deactivateTenantLambda.lambdaFunction);
+
     deactivateTenantLambda.lambdaFunction.addToRolePolicy(new PolicyStatement({
       actions: ['cloudfront-keyvaluestore:DeleteKey','cloudfront-keyvaluestore:DescribeKeyValueStore'],
       resources: [cellToTenantKvs.keyValueStoreArn],
@@ -534,7 +813,8 @@ export class CellManagementSystem extends Stack {
             type: JsonSchemaType.STRING,
           }
         },
-        required: ['TenantId','CellId'],
+        // without a CellId the tenant's cell is looked up in the tenant directory
+        required: ['TenantId'],
       },
     });
 
@@ -546,8 +826,10 @@ export class CellManagementSystem extends Stack {
       handler: 'handler', 
       environmentVariables: {
         CELL_MANAGEMENT_TABLE: cellManagementTable.tableArn,
-        CELL_ROUTER_KVS_ARN: cellToTenantKvs.keyValueStoreArn
-      },        
+        CELL_ROUTER_KVS_ARN: cellToTenantKvs.keyValueStoreArn,
+        TENANT_DIRECTORY_TABLE_NAME: tenantDirectoryTable.tableName
+      },
+      layers: [tenantDirectoryLayer]
     });
 
     activateTenantLambda.lambdaFunction.addToRolePolicy(new PolicyStatement({
@@ -555,7 +837,8 @@ export class CellManagementSystem extends Stack {
       resources: [cellToTenantKvs.keyValueStoreArn],
     }));
 
-    cellManagementTable.grantReadData(activateTenantLambda.lambdaFunction);
+    cellManagementTable.grantReadWriteData(activateTenantLambda.lambdaFunction);
+    tenantDirectoryTable.grantReadData(activateTenantLambda.lambdaFunction);
 
     // Create a resource
     const activateTenantResource = api.root.addResource('ActivateTenant');
@@ -589,16 +872,32 @@ export class CellManagementSystem extends Stack {
       }
     );
 
+    // Per-cell tenant counts kept up to date from the cell management table's stream, with the
+    // sequence marker of every tenant that makes applying stream records idempotent, and the
+    // utilization samples the CapacityObserver forecasts from
+    const cellUtilizationTable = new Table(this, 'cellUtilizationTable', {
+      partitionKey: { name: 'PK', type: AttributeType.STRING },
+      billingMode: BillingMode.PAY_PER_REQUEST,
+      removalPolicy: RemovalPolicy.DESTROY,
+      pointInTimeRecovery: true,
+      timeToLiveAttribute: 'expires_at',
+    });
+
     // Lambda function that monitors Cell Capacity
     const capacityObserverLambda = new LambdaFunction(this, 'CellCapacityObserverFunction', {
       friendlyFunctionName: 'CellCapacityObserverFunction',
       index: 'capacityObserver.py',
       entry: 'lib/saas-management/cell-management-system/src/lambdas/CapacityObserver', 
       handler: 'handler',
-      environmentVariables: {'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn}
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn,
+        'CELL_UTILIZATION_TABLE': cellUtilizationTable.tableName
+      },
+      layers: [emfBatchLayer]
     });
     
     cellManagementTable.grantReadData(capacityObserverLambda.lambdaFunction);
+    cellUtilizationTable.grantReadWriteData(capacityObserverLambda.lambdaFunction);
 
     // Create an EventBridge rule that runs every minute
     const scheduledCapacityCheckRule = new Rule(this, 'ScheduleCapacityCheckRule', {
@@ -608,6 +907,138 @@ export class CellManagementSystem extends Stack {
 
     scheduledCapacityCheckRule.addTarget(new targets.LambdaFunction(capacityObserverLambda.lambdaFunction));
 
+    const utilizationAggregatorLambda = new LambdaFunction(this, 'UtilizationAggregatorFunction', {
+      friendlyFunctionName: 'UtilizationAggregatorFunction',
+      index: 'utilizationAggregator.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/UtilizationAggregator',
+      handler: 'handler',
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE_NAME': cellManagementTable.tableName,
+        'CELL_UTILIZATION_TABLE': cellUtilizationTable.tableName
+      },
+      layers: [emfBatchLayer, tableSweepLayer]
+    });
+
+    cellUtilizationTable.grantReadWriteData(utilizationAggregatorLambda.lambdaFunction);
+    utilizationAggregatorLambda.lambdaFunction.addEventSource(new DynamoEventSource(cellManagementTable, {
+      startingPosition: StartingPosition.TRIM_HORIZON,
+      batchSize: 100,
+      maxBatchingWindow: Duration.seconds(5),
+      bisectBatchOnError: true,
+      reportBatchItemFailures: true,
+      retryAttempts: 10,
+    }));
+
+    // Lambda function that recounts every cell's tenants and corrects counters that drifted
+    const utilizationReconcilerLambda = new LambdaFunction(this, 'UtilizationReconcilerFunction', {
+      friendlyFunctionName: 'UtilizationReconcilerFunction',
+      index: 'utilizationAggregator.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/UtilizationAggregator',
+      handler: 'reconcile_handler',
+      timeout: Duration.minutes(5),
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE_NAME': cellManagementTable.tableName,
+        'CELL_UTILIZATION_TABLE': cellUtilizationTable.tableName
+      },
+      layers: [emfBatchLayer, tableSweepLayer]
+    });
+
+    cellManagementTable.grantReadData(utilizationReconcilerLambda.lambdaFunction);
+    cellUtilizationTable.grantReadWriteData(utilizationReconcilerLambda.lambdaFunction);
+
+    const scheduledUtilizationReconcileRule = new Rule(this, 'ScheduleUtilizationReconcileRule', {
+      schedule: Schedule.expression('rate(1 hour)'),
+      enabled: true
+    });
+
+    scheduledUtilizationReconcileRule.addTarget(new targets.LambdaFunction(utilizationReconcilerLambda.lambdaFunction));
+
+    // Lambda function that rebuilds every cell's listener priority map from the priorities its tenants hold
+    const defragmentListenerPrioritiesLambda = new LambdaFunction(this, 'DefragmentListenerPrioritiesFunction', {
+      friendlyFunctionName: 'DefragmentListenerPrioritiesFunction',
+      index: 'defragmentListenerPriorities.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/DefragmentListenerPriorities',
+      handler: 'handler',
+      timeout: Duration.minutes(5),
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE_NAME': cellManagementTable.tableName
+      },
+      layers: [tableSweepLayer, listenerPriorityLayer]
+    });
+
+    cellManagementTable.grantReadWriteData(defragmentListenerPrioritiesLambda.lambdaFunction);
+
+    const scheduledListenerPriorityDefragmentRule = new Rule(this, 'ScheduleListenerPriorityDefragmentRule', {
+      schedule: Schedule.expression('rate(1 day)'),
+      enabled: true
+    });
+
+    scheduledListenerPriorityDefragmentRule.addTarget(new targets.LambdaFunction(defragmentListenerPrioritiesLambda.lambdaFunction));
+
+    // Lambda function that sets the item_type of cell items created before the CellsByItemTypeIndex existed,
+    // run once after the table is deployed
+    const backfillCellItemTypeLambda = new LambdaFunction(this, 'BackfillCellItemTypeFunction', {
+      friendlyFunctionName: 'BackfillCellItemTypeFunction',
+      index: 'backfillCellItemType.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/BackfillCellItemType',
+      handler: 'handler',
+      timeout: Duration.minutes(15),
+      environmentVariables: {'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn}
+    });
+
+    cellManagementTable.grantReadWriteData(backfillCellItemTypeLambda.lambdaFunction);
+
+    new Trigger(this, 'BackfillCellItemTypeTrigger', {
+      handler: backfillCellItemTypeLambda.lambdaFunction,
+      timeout: Duration.minutes(15),
+      executeAfter: [cellManagementTable],
+    });
+
+    // Lambda function that adds the tenants created before the tenant directory existed to it,
+    // run once after the table is deployed
+    const backfillTenantDirectoryLambda = new LambdaFunction(this, 'BackfillTenantDirectoryFunction', {
+      friendlyFunctionName: 'BackfillTenantDirectoryFunction',
+      index: 'backfillTenantDirectory.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/BackfillTenantDirectory',
+      handler: 'handler',
+      timeout: Duration.minutes(15),
+      environmentVariables: {
+        'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn,
+        'TENANT_DIRECTORY_TABLE_NAME': tenantDirectoryTable.tableName
+      }
+    });
+
+    cellManagementTable.grantReadData(backfillTenantDirectoryLambda.lambdaFunction);
+    tenantDirectoryTable.grantReadWriteData(backfillTenantDirectoryLambda.lambdaFunction);
+
+    new Trigger(this, 'BackfillTenantDirectoryTrigger', {
+      handler: backfillTenantDirectoryLambda.lambdaFunction,
+      timeout: Duration.minutes(15),
+      executeAfter: [cellManagementTable, tenantDirectoryTable],
+    });
+
+    // Lambda function that gives the control plane users created before custom:role was required the
+    // SystemAdmin role, run once after the user pool is deployed
+    const backfillAdminRolesLambda = new LambdaFunction(this, 'BackfillAdminRolesFunction', {
+      friendlyFunctionName: 'BackfillAdminRolesFunction',
+      index: 'backfillAdminRoles.py',
+      entry: 'lib/saas-management/cell-management-system/src/lambdas/BackfillAdminRoles',
+      handler: 'handler',
+      timeout: Duration.minutes(15),
+      environmentVariables: {'USER_POOL_ID': identityProvider.userPool.userPoolId}
+    });
+
+    backfillAdminRolesLambda.lambdaFunction.addToRolePolicy(new PolicyStatement({
+      actions: ['cognito-idp:ListUsers', 'cognito-idp:AdminUpdateUserAttributes'],
+      resources: [identityProvider.userPool.userPoolArn]
+    }));
+
+    new Trigger(this, 'BackfillAdminRolesTrigger', {
+      handler: backfillAdminRolesLambda.lambdaFunction,
+      timeout: Duration.minutes(15),
+      executeAfter: [identityProvider],
+    });
+
     // Lambda function that persist metadata for Cells from EventBridge
     const persistCellMetadataLambda = new LambdaFunction(this, 'PersistCellMetadataFunction', {
       friendlyFunctionName: 'PersistCellMetadataFunction',
@@ -640,7 +1071,8 @@ export class CellManagementSystem extends Stack {
       index: 'persistTenantMetadata.py',
       entry: 'lib/saas-management/cell-management-system/src/lambdas/PersistTenantMetadata', 
       handler: 'handler',
-      environmentVariables: {'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn}
+      environmentVariables: {'CELL_MANAGEMENT_TABLE': cellManagementTable.tableArn},
+      layers: [listenerPriorityLayer]
     });
     cellManagementTable.grantReadWriteData(persistTenantMetadataLambda.lambdaFunction);
 
@@ -657,6 +1089,7 @@ export class CellManagementSystem extends Stack {
     persistTenantMetadataRule.addTarget(new targets.LambdaFunction(persistTenantMetadataLambda.lambdaFunction));
 
     this.cellManagementTable = cellManagementTable
+    this.tenantDirectoryTable = tenantDirectoryTable
     
     new CfnOutput(this, 'UserPoolId', {
       value: identityProvider.identityDetails.details['userPoolId'],
@@ -4,6 +4,7 @@ import { IdentityDetails } from './identity-details';
 
 export class IdentityProvider extends Construct {
   public readonly identityDetails: IdentityDetails;
+  public readonly userPool: aws_cognito.UserPool;
   
   constructor(scope: Construct, id: string, props?: StackProps) {
     super(scope, id);
@@ -18,6 +19,10 @@ export class IdentityProvider extends Construct {
           mutable: true,
         },
       },
+      // SystemAdmin or ReadOnly, see controlPlaneAuthorizer.py; users without one are denied
+      customAttributes: {
+        role: new aws_cognito.StringAttribute({ mutable: true }),
+      },
     });
 
     const writeAttributes = new aws_cognito.ClientAttributes()
@@ -47,6 +52,7 @@ export class IdentityProvider extends Construct {
       },
     });    
 
+    this.userPool = systemAdminUserPool;
     this.identityDetails = {
       name: 'Cognito',
       details: {
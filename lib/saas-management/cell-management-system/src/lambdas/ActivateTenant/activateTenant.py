@@ -4,6 +4,7 @@ import boto3
 import logging
 from botocore.exceptions import ClientError
 from botocore.config import Config
+from tenant_directory import find_tenant_cell
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -46,6 +47,18 @@ def write_cell_routing_entry(tenantId, url):
     except Exception as e:
         logger.error(f'Unexpected Error persisting or parsing config object: {e}')
 
+def set_tenant_routing_active(cell_id, tenant_id, active):
+    """Records whether the tenant has a routing entry, the utilization aggregator counts tenants without one as inactive"""
+    ddb_table.update_item(
+        Key={
+            'PK': cell_id+"#"+tenant_id
+        },
+        UpdateExpression="set routing_active = :ra",
+        ExpressionAttributeValues={
+            ':ra': active
+        }
+    )
+
 def retrieve_cell_details(cell_id):
 
     try:
@@ -110,6 +123,13 @@ def handler(event, context):
             logger.debug('Tenant ID: %s', tenant_id)
             cell_id = data.get('CellId')
             logger.debug('Cell ID: %s', cell_id)
+            if not cell_id:
+                cell_id = find_tenant_cell(tenant_id)
+                if cell_id is None:
+                    return {
+                        'statusCode': 404,
+                        'body': json.dumps({'error': f'Tenant not found: {tenant_id}'})
+                    }
             
             cell_details = retrieve_cell_details(cell_id=cell_id)
             tenant_details = retrieve_tenant_details(cell_id=cell_id,tenant_id=tenant_id)
@@ -121,6 +141,7 @@ def handler(event, context):
                 logger.debug('updated config being written: %s -> %s',tenant_id, cell_details.get('cell_url'))
                 write_cell_routing_entry(tenant_id, cell_details.get('cell_url'))
                 logger.debug('config map successfully written to KVS')
+                set_tenant_routing_active(cell_id, tenant_id, True)
             else:
                 return {
                     'statusCode': 400,
@@ -5,15 +5,45 @@ import boto3
 import string
 import random
 import re
+import time
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from cellPlacement import CapacityIndex, CellContentionError, NoCapacityError, place_tenant, placement_config
+from listener_priority import CELL_ATTRIBUTES, ListenerPriorities, PrioritySpaceExhaustedError
+
+CELL_MANAGEMENT_TABLE_NAME = os.environ.get('CELL_MANAGEMENT_TABLE_NAME')
+TENANT_DIRECTORY_TABLE_NAME = os.environ.get('TENANT_DIRECTORY_TABLE_NAME')
 
 # Initialize clients
 eventbridge_client = boto3.client('events')
 dynamodb = boto3.resource('dynamodb')
+dynamodb_client = boto3.client('dynamodb')
 ssm_client = boto3.client('ssm')
+ddb_table = dynamodb.Table(os.environ.get('CELL_MANAGEMENT_TABLE'))
+serializer = TypeSerializer()
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+BATCH_GET_LIMIT = 100
+EMAIL_REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
+# how the tenant's ProductService writes products, passed to every deployment of the tenant
+PRODUCT_WRITE_MODES = ('direct', 'write-behind')
+# reservations retried after losing to concurrent onboardings in the same cell
+MAX_RESERVATION_ATTEMPTS = 5
+IMAGE_VERSION_CACHE_TTL_SECONDS = int(os.environ.get('IMAGE_VERSION_CACHE_TTL_SECONDS', 60))
+
+# the product image version, kept between invocations
+image_version_cache = {'value': None, 'expires_at': 0}
+
+# capacity of the available cells, kept between invocations for placing tenants onboarded without a CellId
+capacity_index = None
+
+
+class CellNotFoundError(Exception):
+    pass
+
 
 def handler(event, context):
     # Log the entire event
@@ -31,14 +61,19 @@ def handler(event, context):
             tenant_name = data.get('TenantName')
             tenant_tier = data.get('TenantTier')
             tenant_email = data.get('TenantEmail')
+            product_write_mode = data.get('ProductWriteMode') or 'direct'
 
-            email_regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
-            if(re.fullmatch(email_regex, tenant_email) is None):
+            if(re.fullmatch(EMAIL_REGEX, tenant_email) is None):
                 logger.error('Invalid email address')
                 return {
                     'statusCode': 400,
                     'body': json.dumps({'error': 'Invalid email address'})
                 }
+            if product_write_mode not in PRODUCT_WRITE_MODES:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'ProductWriteMode must be one of {}'.format(', '.join(PRODUCT_WRITE_MODES))})
+                }
         except (json.JSONDecodeError, UnicodeDecodeError):
             logger.error('Invalid JSON or encoding in request body')
             return {
@@ -52,155 +87,278 @@ def handler(event, context):
             'body': json.dumps({'error': 'Wrong request body'})
         }
 
-    cell_information = retrieve_cell_information(cell_id=cell_id)
-    cell_status = check_cell_status(cell_information)
-    if cell_status.get('statusCode') == 200:
-
-        # Generate tenant ID
-        generated_tenant_id_prefix = random.SystemRandom().choice(string.ascii_lowercase)
-        generated_tenant_id = generated_tenant_id_prefix + "".join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(8))
-
-        # Get next available listener priority for this cell
-        cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
-        ddb_table = dynamodb.Table(cell_management_table)
-        priority_response = ddb_table.update_item(
-            Key={
-                'PK': cell_id
-            },
-            UpdateExpression='ADD tenant_priority_counter :inc',
-            ExpressionAttributeValues={
-                ':inc': 10
-            },
-            ReturnValues='UPDATED_NEW'
-        )
-        new_tenant_listener_priority = str(int(priority_response['Attributes']['tenant_priority_counter']))
+    tenant = {
+        'tenant_name': tenant_name,
+        'tenant_tier': tenant_tier,
+        'tenant_email': tenant_email,
+        'product_write_mode': product_write_mode,
+        'product_image_version': get_product_image_version(),
+    }
 
-        image_version_param = os.environ.get('IMAGE_VER_SSM_PARAM_NAME')
-        # Get Latest Product Container Tag
-        image_version = ssm_client.get_parameter(Name=image_version_param)
-        product_image_version = image_version['Parameter']['Value']
-
-        response = create_tenant(cell_id=cell_id, tenant_id=generated_tenant_id, tenant_name=tenant_name,
-                                 tenant_tier=tenant_tier, tenant_email=tenant_email, tenant_listener_priority=new_tenant_listener_priority,
-                                 product_image_version=product_image_version, cell_size=cell_information.get('cell_size'))
-        # Log the response
-        logger.info('Response: %s', response)
-        return response
+    if cell_id:
+        try:
+            reservation = reserve_and_record(cell_id, tenant)
+        except CellNotFoundError:
+            response = {
+                'statusCode': 404,
+                'body': json.dumps(f'Cell not found: {cell_id}')
+            }
+            logger.info('Response: %s', response)
+            return response
+        except CellContentionError:
+            response = {
+                'statusCode': 503,
+                'body': json.dumps(f'Cell is currently unavailable or at full capacity')
+            }
+            logger.info('Response: %s', response)
+            return response
     else:
-        # Log the response
-        logger.info('Response: %s', cell_status)
-        return cell_status
+        # Without a CellId the tenant is placed in a cell chosen by the placement strategy
+        reservation = place(tenant)
+        if reservation is None:
+            response = {
+                'statusCode': 503,
+                'body': json.dumps('No cell is currently available with free capacity')
+            }
+            logger.info('Response: %s', response)
+            return response
 
+    response = publish_tenant(reservation)
+    # Log the response
+    logger.info('Response: %s', response)
+    return response
+
+
+def get_capacity_index(config):
+    global capacity_index
+    if capacity_index is None:
+        capacity_index = CapacityIndex(load_available_cells, ttl_seconds=config['cache_ttl_seconds'])
+    return capacity_index
+
+
+def place(tenant):
+    config = placement_config()
+    index = get_capacity_index(config)
+
+    def reserve(cell):
+        try:
+            return reserve_and_record(cell['cell_id'], tenant)
+        except CellNotFoundError:
+            # deleted since the index was loaded
+            raise CellContentionError(cell['cell_id'])
 
-def retrieve_cell_information(cell_id):
-    cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
-    ddb_table = dynamodb.Table(cell_management_table)
     try:
-        response = ddb_table.get_item(
-            Key={
-                'PK': cell_id
-            }
-        )
-    except Exception as e:
-        logger.error(f"Error retrieving tenant information: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps('Error retrieving tenant information')
-        }
+        cell, reservation = place_tenant(index, reserve, tenant['tenant_tier'], config)
+    except NoCapacityError:
+        return None
+    logger.info('Placed tenant in cell %s with the %s strategy', cell['cell_id'], config['strategy'])
+    return reservation
 
-    if 'Item' in response:
-        item = response['Item']
-        return item
-    else:
-        return {
-            'statusCode': 404,
-            'body': json.dumps(f'Cell not found: {cell_id}')
-        }
 
+def load_available_cells():
+    """The available cells' capacity from the cells index, with their size and wave read from the cell items"""
+    query_kwargs = {
+        'IndexName': 'CellsByItemTypeIndex',
+        'KeyConditionExpression': Key('item_type').eq('cell'),
+        'ProjectionExpression': 'PK, current_status, cell_utilization, cell_max_capacity'
+    }
+    cells = {}
+    while True:
+        response = ddb_table.query(**query_kwargs)
+        for item in response.get('Items', []):
+            if item.get('current_status') == 'available' and 'cell_max_capacity' in item:
+                cells[item['PK']] = {
+                    'cell_id': item['PK'],
+                    'utilization': int(item['cell_utilization']),
+                    'max_capacity': int(item['cell_max_capacity']),
+                }
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
-def check_cell_status(cell_information):
+    # size and wave aren't projected into the cells index
+    table_name = CELL_MANAGEMENT_TABLE_NAME
+    cell_ids = list(cells)
+    for start in range(0, len(cell_ids), BATCH_GET_LIMIT):
+        request = {table_name: {
+            'Keys': [{'PK': cell_id} for cell_id in cell_ids[start:start + BATCH_GET_LIMIT]],
+            'ProjectionExpression': 'PK, cell_size, wave_number'
+        }}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(table_name, []):
+                cells[item['PK']]['cell_size'] = item.get('cell_size')
+                cells[item['PK']]['wave_number'] = int(item.get('wave_number', 0))
+            request = response.get('UnprocessedKeys')
+    return [cell for cell in cells.values() if 'cell_size' in cell]
 
-    cell_status = cell_information.get('current_status')
-    cell_utilization = cell_information.get('cell_utilization')
-    cell_size = cell_information.get('cell_max_capacity')
 
-    if cell_status == 'available' and int(cell_utilization) < int(cell_size):
-        return {
-            'statusCode': 200,
-            'body': json.dumps(f'Cell has availability of {int(cell_size) - int(cell_utilization)}')
-        }
-    else:
-        return {
-            'statusCode': 503,
-            'body': json.dumps(f'Cell is currently unavailable or at full capacity')
+def reserve_and_record(cell_id, tenant):
+    """Takes a place in the cell, allocates the tenant's listener priority and records the tenant as creating,
+    in one transaction that only succeeds while the cell is available with room, so concurrent onboardings
+    can't overfill it; the tenant's tenant directory entry is added in the same transaction. The priority is
+    the lowest free one in the cell's priority map as read, the transaction is conditional on the map being
+    unchanged; when a concurrent onboarding won, the cell is read again and the reservation retried. Returns
+    the tenant record written."""
+    for _ in range(MAX_RESERVATION_ATTEMPTS):
+        cell = ddb_table.get_item(
+            Key={'PK': cell_id},
+            ProjectionExpression='PK, current_status, cell_utilization, cell_max_capacity, cell_size, ' + CELL_ATTRIBUTES,
+            ConsistentRead=True
+        ).get('Item')
+        if cell is None:
+            raise CellNotFoundError(cell_id)
+        if cell.get('current_status') != 'available' or int(cell.get('cell_utilization', 0)) >= int(cell.get('cell_max_capacity', 0)):
+            raise CellContentionError(cell_id)
+
+        priorities = ListenerPriorities.from_cell(cell)
+        try:
+            priority, = priorities.allocate()
+        except PrioritySpaceExhaustedError:
+            logger.error('Cell %s has no free listener priority', cell_id)
+            raise CellContentionError(cell_id)
+        item = tenant_record(cell, tenant, priority)
+        set_clause, condition, values = priorities.expression()
+        values.update({':one': 1, ':available': 'available'})
+        cell_update = {
+            'TableName': CELL_MANAGEMENT_TABLE_NAME,
+            'Key': {'PK': {'S': cell_id}},
+            'UpdateExpression': 'SET cell_utilization = cell_utilization + :one, ' + set_clause,
+            'ConditionExpression': 'current_status = :available AND cell_utilization < cell_max_capacity AND ' + condition,
+            'ExpressionAttributeValues': {key: serializer.serialize(value) for key, value in values.items()}
         }
-        
+        try:
+            dynamodb_client.transact_write_items(TransactItems=[
+                {'Update': cell_update},
+                {'Put': {
+                    'TableName': CELL_MANAGEMENT_TABLE_NAME,
+                    'Item': {key: serializer.serialize(value) for key, value in item.items()},
+                    'ConditionExpression': 'attribute_not_exists(PK)'
+                }},
+                # tenant ids are unique across cells, a generated id that is taken is generated again
+                {'Put': directory_entry(item)}
+            ])
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            logger.info('Reservation in cell %s lost to a concurrent onboarding: %s', cell_id,
+                        [reason.get('Code') for reason in e.response.get('CancellationReasons', [])])
+            continue
+        logger.info('Reserved a place in cell %s for tenant %s', cell_id, item['tenant_id'])
+        return item
+    raise CellContentionError(cell_id)
+
+
+def tenant_record(cell, tenant, tenant_listener_priority):
+    """The tenant item of a new tenant in the cell, as it is created"""
+    tenant_id = generate_tenant_id()
+    return dict(tenant, **{
+        'PK': cell['PK'] + "#" + tenant_id,
+        'cell_id': cell['PK'],
+        'cell_size': cell.get('cell_size'),
+        'tenant_id': tenant_id,
+        'tenant_listener_priority': str(tenant_listener_priority),
+        'current_status': 'creating',
+    })
+
+
+def directory_entry(item):
+    """The Put of the tenant's tenant directory entry, which fails if the tenant id is taken"""
+    return {
+        'TableName': TENANT_DIRECTORY_TABLE_NAME,
+        'Item': {'tenant_id': {'S': item['tenant_id']}, 'cell_id': {'S': item['cell_id']}},
+        'ConditionExpression': 'attribute_not_exists(tenant_id)'
+    }
+
+
+def release_reservation(item):
+    """Undoes reserve_and_record when the tenant can't be created. No listener rule was deployed for the
+    tenant, so its priority is free again right away"""
+    for _ in range(MAX_RESERVATION_ATTEMPTS):
+        cell = ddb_table.get_item(Key={'PK': item['cell_id']}, ProjectionExpression=CELL_ATTRIBUTES,
+                                  ConsistentRead=True).get('Item', {})
+        priorities = ListenerPriorities.from_cell(cell)
+        priorities.release([item['tenant_listener_priority']], hold=False)
+        set_clause, condition, values = priorities.expression()
+        values[':one'] = 1
+        try:
+            dynamodb_client.transact_write_items(TransactItems=[
+                {'Update': {
+                    'TableName': CELL_MANAGEMENT_TABLE_NAME,
+                    'Key': {'PK': {'S': item['cell_id']}},
+                    'UpdateExpression': 'SET cell_utilization = cell_utilization - :one, ' + set_clause,
+                    'ConditionExpression': condition,
+                    'ExpressionAttributeValues': {key: serializer.serialize(value) for key, value in values.items()}
+                }},
+                {'Delete': {
+                    'TableName': CELL_MANAGEMENT_TABLE_NAME,
+                    'Key': {'PK': {'S': item['PK']}}
+                }},
+                {'Delete': {
+                    'TableName': TENANT_DIRECTORY_TABLE_NAME,
+                    'Key': {'tenant_id': {'S': item['tenant_id']}}
+                }}
+            ])
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+    logger.error('Could not release the reservation of tenant %s in cell %s', item['tenant_id'], item['cell_id'])
+
+
+def generate_tenant_id():
+    # ID's need to start with a letter
+    generated_tenant_id_prefix = random.SystemRandom().choice(string.ascii_lowercase)
+    return generated_tenant_id_prefix + "".join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(8))
+
+
+def get_product_image_version():
+    """The latest product container tag, read from SSM at most once per IMAGE_VERSION_CACHE_TTL_SECONDS"""
+    now = time.monotonic()
+    if image_version_cache['value'] is None or now >= image_version_cache['expires_at']:
+        image_version_param = os.environ.get('IMAGE_VER_SSM_PARAM_NAME')
+        image_version = ssm_client.get_parameter(Name=image_version_param)
+        image_version_cache['value'] = image_version['Parameter']['Value']
+        image_version_cache['expires_at'] = now + IMAGE_VERSION_CACHE_TTL_SECONDS
+    return image_version_cache['value']
+
+
+def create_tenant_entry(item):
+    """The EventBridge entry that has the cell provisioning system deploy the tenant"""
+    return {
+        'Source': 'cellManagement.createTenant',
+        'DetailType': 'TenantData',
+        'Detail': json.dumps({
+            'event_type': 'create_tenant',
+            'cell_id': item['cell_id'],
+            'cell_size': item['cell_size'],
+            'tenant_name': item['tenant_name'],
+            'tenant_id': item['tenant_id'],
+            'tenant_tier': item['tenant_tier'],
+            'tenant_email': item['tenant_email'],
+            'product_write_mode': item['product_write_mode'],
+            'tenant_listener_priority': item['tenant_listener_priority'],
+            'product_image_version': item['product_image_version']
+        }),
+        'EventBusName': os.environ.get('CELL_MANAGEMENT_BUS')
+    }
+
+
+def publish_tenant(item):
 
-def create_tenant(cell_id, tenant_name, tenant_id, tenant_tier, tenant_email, tenant_listener_priority, product_image_version, cell_size):
-    
     # Send a message to EventBridge
-    cell_management_bus = os.environ.get('CELL_MANAGEMENT_BUS')
-    eventbridge_response = eventbridge_client.put_events(
-        Entries=[
-            {
-                'Source': 'cellManagement.createTenant',
-                'DetailType': 'TenantData',
-                'Detail': json.dumps({
-                    'event_type': 'create_tenant',
-                    'cell_id': cell_id,
-                    'cell_size': cell_size,
-                    'tenant_name': tenant_name,
-                    'tenant_id': tenant_id,
-                    'tenant_tier': tenant_tier,
-                    'tenant_email': tenant_email,
-                    'tenant_listener_priority': tenant_listener_priority,
-                    'product_image_version': product_image_version
-                }),
-                'EventBusName': cell_management_bus
-            }
-        ]
-    )
+    eventbridge_response = eventbridge_client.put_events(Entries=[create_tenant_entry(item)])
 
     # Check if the event was sent successfully
     if eventbridge_response['FailedEntryCount'] == 0:
-        # Store the metadata in DynamoDB
-        cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
-        ddb_table = dynamodb.Table(cell_management_table)
-        ddb_table.put_item(
-            Item={
-                'PK': cell_id+"#"+tenant_id,
-                'cell_id': cell_id,
-                'cell_size': cell_size,
-                'tenant_id': tenant_id,
-                'tenant_name': tenant_name,
-                'tenant_tier': tenant_tier,
-                'tenant_email': tenant_email,
-                'tenant_listener_priority': tenant_listener_priority,
-                'product_image_version': product_image_version,
-                'current_status': 'creating',
-            }
-        )
-
-        logger.info(f'Added tenant metadata to DynamoDB')
-
-        ddb_table.update_item(
-            Key={
-                'PK': cell_id
-            },
-            UpdateExpression='SET cell_utilization = cell_utilization + :inc',
-            ExpressionAttributeValues={
-                ':inc': 1
-            },
-            ReturnValues='UPDATED_NEW'
-        )
-        logger.info(f'Cell utilization updated on DynamoDB')
         return {
             'statusCode': 200,
-            'body': json.dumps({'CellId': cell_id,'TenantId': tenant_id, 'Status': 'creating'})
+            'body': json.dumps({'CellId': item['cell_id'], 'TenantId': item['tenant_id'], 'Status': 'creating'})
         }
     else:
         logger.error(f"Failed to send event to EventBridge")
+        release_reservation(item)
         return {
             'statusCode': 500,
             'body': json.dumps('Failed to send event to EventBridge')
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,277 @@
+import os
+import logging
+import json
+import re
+import time
+from botocore.exceptions import ClientError
+from cellPlacement import choose_cell, placement_config
+from listener_priority import CELL_ATTRIBUTES, ListenerPriorities
+import assignTenantToCell as assign
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MAX_BULK_TENANTS = int(os.environ.get('MAX_BULK_TENANTS', 100))
+PUT_EVENTS_LIMIT = 10
+# a transaction holds up to 100 items: the cell's update and two Puts per tenant
+TRANSACTION_TENANTS_LIMIT = 49
+# retries of the entries a PutEvents call failed, with exponential backoff
+MAX_BATCH_RETRIES = 5
+BATCH_RETRY_BASE_SECONDS = 0.05
+# reservations retried after losing to concurrent onboardings in the same cell
+MAX_RESERVATION_ATTEMPTS = 5
+
+
+def handler(event, context):
+    """Onboards up to MAX_BULK_TENANTS tenants in one request. The tenants are validated in one pass, then
+    their places are reserved and their tenant records and tenant directory entries written together, with
+    one conditional transaction per cell and up to TRANSACTION_TENANTS_LIMIT tenants. The create events are
+    sent with PutEvents, 10 entries at a time, failed entries are retried; a tenant whose event still fails
+    has its reservation undone. Returns a result per tenant, in request order."""
+    # Log the entire event
+    logger.info('Received event: %s', event)
+
+    try:
+        tenants = json.loads(event.get('body') or '').get('Tenants')
+    except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+        logger.error('Invalid JSON or encoding in request body')
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Invalid JSON or encoding in request body'})
+        }
+    if not isinstance(tenants, list) or not tenants or len(tenants) > MAX_BULK_TENANTS:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Tenants must be a list of 1 to {} tenants'.format(MAX_BULK_TENANTS)})
+        }
+
+    results = [None] * len(tenants)
+    valid = validate_tenants(tenants, results)
+    product_image_version = assign.get_product_image_version()
+    for _, tenant in valid:
+        tenant['product_image_version'] = product_image_version
+
+    reserved = reserve_places(valid, results)
+    publish_tenants(reserved, results)
+
+    accepted = sum(1 for result in results if result.get('Status') == 'creating')
+    logger.info('Onboarded %s of %s tenants', accepted, len(tenants))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'Accepted': accepted, 'Failed': len(tenants) - accepted, 'Tenants': results})
+    }
+
+
+def fail(results, position, status_code, error):
+    results[position] = {'Index': position, 'StatusCode': status_code, 'Error': error}
+
+
+def validate_tenants(tenants, results):
+    """Returns (position, tenant) of the valid tenants, the invalid ones get their error result"""
+    valid = []
+    for position, data in enumerate(tenants):
+        if not isinstance(data, dict):
+            fail(results, position, 400, 'Tenant must be an object')
+            continue
+        missing = [field for field in ('TenantName', 'TenantTier', 'TenantEmail') if not data.get(field)]
+        if missing:
+            fail(results, position, 400, 'Missing {}'.format(', '.join(missing)))
+            continue
+        if re.fullmatch(assign.EMAIL_REGEX, data['TenantEmail']) is None:
+            fail(results, position, 400, 'Invalid email address')
+            continue
+        if (data.get('ProductWriteMode') or 'direct') not in assign.PRODUCT_WRITE_MODES:
+            fail(results, position, 400, 'ProductWriteMode must be one of {}'.format(', '.join(assign.PRODUCT_WRITE_MODES)))
+            continue
+        valid.append((position, {
+            'cell_id': data.get('CellId'),
+            'tenant_name': data['TenantName'],
+            'tenant_tier': data['TenantTier'],
+            'tenant_email': data['TenantEmail'],
+            'product_write_mode': data.get('ProductWriteMode') or 'direct',
+        }))
+    return valid
+
+
+def reserve_places(valid, results):
+    """Reserves places for the tenants, per cell in aggregate. Tenants naming a cell get a place there or a
+    503; the others are planned onto cells with the placement strategy, and planned again elsewhere when
+    their cell had less room than the cached index showed, until a fresh load of the index has no cell left
+    with room for them. Returns (position, tenant record) of every tenant that got a place, its record
+    written."""
+    reserved = []
+    # tenant ids handed out in this request, so no two of its tenants share one
+    issued = set()
+    by_cell = {}
+    placed = []
+    for position, tenant in valid:
+        cell_id = tenant.pop('cell_id')
+        if cell_id:
+            by_cell.setdefault(cell_id, []).append((position, tenant))
+        else:
+            placed.append((position, tenant))
+
+    for cell_id, group in by_cell.items():
+        try:
+            granted, rejected = reserve_in_cell(cell_id, group, issued)
+        except assign.CellNotFoundError:
+            granted, rejected = [], []
+            for position, _ in group:
+                fail(results, position, 404, f'Cell not found: {cell_id}')
+        reserved.extend(granted)
+        for position, _ in rejected:
+            fail(results, position, 503, 'Cell is currently unavailable or at full capacity')
+
+    if placed:
+        config = placement_config()
+        index = assign.get_capacity_index(config)
+        excluded = set()
+        refreshed = False
+        while placed:
+            # plan on copies of the cached cells, each planned tenant counted against its cell so the
+            # plan spreads the tenants as single placements one after another would
+            cells = [dict(cell) for cell in index.cells()]
+            plan = {}
+            unplaced = []
+            for position, tenant in placed:
+                cell = choose_cell(cells, tenant['tenant_tier'], config['strategy'], config['tier_cell_sizes'],
+                                   config['wave_spread_tolerance'], excluded)
+                if cell is None:
+                    unplaced.append((position, tenant))
+                    continue
+                cell['utilization'] += 1
+                plan.setdefault(cell['cell_id'], []).append((position, tenant))
+
+            if not plan:
+                # nothing fits the cached cells; give up only once a fresh load has no room either
+                if refreshed:
+                    break
+                index.refresh()
+                refreshed = True
+                continue
+
+            # every round places tenants or leaves out a cell that turned out full, so this ends
+            placed = unplaced
+            for cell_id, group in plan.items():
+                try:
+                    granted, rejected = reserve_in_cell(cell_id, group, issued)
+                except assign.CellNotFoundError:
+                    # deleted since the index was loaded
+                    granted, rejected = [], group
+                reserved.extend(granted)
+                for _ in granted:
+                    index.record_reservation(cell_id)
+                if rejected:
+                    excluded.add(cell_id)
+                    placed.extend(rejected)
+            if placed:
+                # the cached cells were stale or full, a fresh load shows cells freed or created meanwhile
+                index.refresh()
+                refreshed = True
+        for position, _ in placed:
+            fail(results, position, 503, 'No cell is currently available with free capacity')
+    return reserved
+
+
+def reserve_in_cell(cell_id, group, issued):
+    """Takes as many places and listener priorities in the cell as it has room for, and records the tenants
+    that got one, in transactions of up to TRANSACTION_TENANTS_LIMIT tenants. Each transaction updates the
+    cell conditional on the utilization and listener priority map read, as reserve_and_record does for a
+    single tenant, and puts the tenant records and tenant directory entries conditional on them not existing,
+    so a crash can't leave places taken without their tenants and a taken tenant id is never overwritten.
+    Returns the (position, tenant record) of the tenants that got a place and the (position, tenant) of
+    those that didn't. Raises CellNotFoundError when there's no such cell."""
+    granted = []
+    attempts = 0
+    while group and attempts < MAX_RESERVATION_ATTEMPTS:
+        cell = assign.ddb_table.get_item(
+            Key={'PK': cell_id},
+            ProjectionExpression='PK, current_status, cell_utilization, cell_max_capacity, cell_size, ' + CELL_ATTRIBUTES,
+            ConsistentRead=True
+        ).get('Item')
+        if cell is None:
+            if granted:
+                break
+            raise assign.CellNotFoundError(cell_id)
+        if cell.get('current_status') != 'available':
+            break
+        utilization = int(cell.get('cell_utilization', 0))
+        priorities = ListenerPriorities.from_cell(cell)
+        count = min(len(group), TRANSACTION_TENANTS_LIMIT, int(cell.get('cell_max_capacity', 0)) - utilization,
+                    priorities.free_count())
+        if count <= 0:
+            break
+
+        allocated = priorities.allocate(count)
+        records = [(position, new_tenant_record(cell, tenant, priority, issued))
+                   for priority, (position, tenant) in zip(allocated, group[:count])]
+        set_clause, condition, values = priorities.expression()
+        values.update({':available': 'available', ':utilization': utilization, ':new_utilization': utilization + count})
+        cell_update = {
+            'TableName': assign.CELL_MANAGEMENT_TABLE_NAME,
+            'Key': {'PK': {'S': cell_id}},
+            'UpdateExpression': 'SET cell_utilization = :new_utilization, ' + set_clause,
+            'ConditionExpression': 'current_status = :available AND cell_utilization = :utilization AND ' + condition,
+            'ExpressionAttributeValues': {key: assign.serializer.serialize(value) for key, value in values.items()}
+        }
+        tenant_puts = [{'Put': {
+            'TableName': assign.CELL_MANAGEMENT_TABLE_NAME,
+            'Item': {key: assign.serializer.serialize(value) for key, value in item.items()},
+            'ConditionExpression': 'attribute_not_exists(PK)'
+        }} for _, item in records]
+        directory_puts = [{'Put': assign.directory_entry(item)} for _, item in records]
+        try:
+            assign.dynamodb_client.transact_write_items(TransactItems=[{'Update': cell_update}] + tenant_puts + directory_puts)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            # a concurrent onboarding won the cell or a generated tenant id was taken, the cell is read and
+            # the tenant ids generated again
+            logger.info('Reservation in cell %s cancelled: %s', cell_id,
+                        [reason.get('Code') for reason in e.response.get('CancellationReasons', [])])
+            attempts += 1
+            continue
+        logger.info('Reserved and recorded %s tenants in cell %s', count, cell_id)
+        granted.extend(records)
+        group = group[count:]
+        attempts = 0
+    return granted, group
+
+
+def new_tenant_record(cell, tenant, priority, issued):
+    """The tenant record of a new tenant, with a tenant id no other tenant of the request was given"""
+    item = assign.tenant_record(cell, tenant, priority)
+    while item['tenant_id'] in issued:
+        item = assign.tenant_record(cell, tenant, priority)
+    issued.add(item['tenant_id'])
+    return item
+
+
+def publish_tenants(written, results):
+    """Sends the create events with PutEvents, 10 entries at a time, retrying failed entries. Tenants whose
+    event couldn't be sent have their items removed and their place given back, in one transaction each"""
+    failed = []
+    for start in range(0, len(written), PUT_EVENTS_LIMIT):
+        batch = written[start:start + PUT_EVENTS_LIMIT]
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            if attempt:
+                time.sleep(BATCH_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+            response = assign.eventbridge_client.put_events(Entries=[assign.create_tenant_entry(item) for _, item in batch])
+            if response['FailedEntryCount'] == 0:
+                batch = []
+                break
+            # entries are answered in order, the ones with an ErrorCode are sent again
+            batch = [record for record, entry in zip(batch, response['Entries']) if entry.get('ErrorCode')]
+        failed.extend(batch)
+
+    sent = {item['PK'] for _, item in written} - {item['PK'] for _, item in failed}
+    for position, item in written:
+        if item['PK'] in sent:
+            results[position] = {'Index': position, 'StatusCode': 200, 'CellId': item['cell_id'],
+                                 'TenantId': item['tenant_id'], 'Status': 'creating'}
+
+    if failed:
+        logger.error('Failed to send %s events to EventBridge', len(failed))
+        for position, item in failed:
+            assign.release_reservation(item)
+            fail(results, position, 500, 'Failed to send event to EventBridge')
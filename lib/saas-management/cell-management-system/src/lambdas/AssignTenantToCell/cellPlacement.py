@@ -0,0 +1,129 @@
+"""Chooses a cell for a tenant that is onboarded without a CellId. Candidates come from a cached index of
+the cells' capacity, a strategy picks one and the caller reserves a place in it with a conditional write;
+when that write loses to a concurrent onboarding the index is refreshed and the next candidate is tried.
+The module makes no AWS calls itself, loading and reserving are passed in, so it runs in the simulator too."""
+
+import json
+import os
+import time
+
+STRATEGIES = ('least-loaded', 'best-fit', 'tier-affinity')
+DEFAULT_STRATEGY = 'least-loaded'
+# tiers mapped to the cell sizes the tier-affinity strategy places them in first
+DEFAULT_TIER_CELL_SIZES = {'basic': ['S'], 'advanced': ['M'], 'premium': ['L']}
+# a wave may be filled this much further than the emptiest wave before its cells are passed over, so a
+# deployment wave never holds a disproportionate share of the tenants
+DEFAULT_WAVE_SPREAD_TOLERANCE = 0.2
+DEFAULT_CACHE_TTL_SECONDS = 30
+
+
+class NoCapacityError(Exception):
+    """No available cell has room for the tenant"""
+
+
+class CellContentionError(Exception):
+    """The cell filled up or became unavailable before the reservation"""
+
+
+def placement_config():
+    """The placement settings from the function's environment"""
+    strategy = os.environ.get('PLACEMENT_STRATEGY', DEFAULT_STRATEGY)
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown placement strategy {}, expected one of {}'.format(strategy, ', '.join(STRATEGIES)))
+    tier_cell_sizes = os.environ.get('PLACEMENT_TIER_CELL_SIZES')
+    return {
+        'strategy': strategy,
+        'tier_cell_sizes': json.loads(tier_cell_sizes) if tier_cell_sizes else DEFAULT_TIER_CELL_SIZES,
+        'wave_spread_tolerance': float(os.environ.get('PLACEMENT_WAVE_SPREAD_TOLERANCE', DEFAULT_WAVE_SPREAD_TOLERANCE)),
+        'cache_ttl_seconds': float(os.environ.get('PLACEMENT_CACHE_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS)),
+    }
+
+
+class CapacityIndex:
+    """The available cells' capacity, loaded with load_cells and kept for ttl_seconds. Each cell is a dict of
+    cell_id, cell_size, wave_number, utilization and max_capacity. Reservations made through the index are
+    applied to the cached cells, so a warm function doesn't keep choosing a cell it just filled"""
+
+    def __init__(self, load_cells, ttl_seconds=DEFAULT_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.load_cells = load_cells
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.loaded_at = None
+        self.by_id = {}
+        self.refreshes = 0
+
+    def cells(self):
+        if self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl_seconds:
+            self.refresh()
+        return list(self.by_id.values())
+
+    def refresh(self):
+        self.by_id = {cell['cell_id']: dict(cell) for cell in self.load_cells()}
+        self.loaded_at = self.clock()
+        self.refreshes += 1
+
+    def record_reservation(self, cell_id):
+        if cell_id in self.by_id:
+            self.by_id[cell_id]['utilization'] += 1
+
+
+def choose_cell(cells, tenant_tier, strategy=DEFAULT_STRATEGY, tier_cell_sizes=None,
+                wave_spread_tolerance=DEFAULT_WAVE_SPREAD_TOLERANCE, excluded=()):
+    """Returns the cell the strategy places the tenant in, None when no cell has room.
+    least-loaded picks the cell with the lowest fill ratio, best-fit the cell with the least room left so
+    cells fill up one after another, tier-affinity the least loaded cell of a size matching the tenant's tier,
+    falling back to any size. All strategies only choose among the cells of the least filled waves."""
+    candidates = [cell for cell in cells
+                  if cell['cell_id'] not in excluded and cell['utilization'] < cell['max_capacity']]
+    if not candidates:
+        return None
+
+    # fill ratio of every wave, counted over all of its available cells
+    waves = {}
+    for cell in cells:
+        used, capacity = waves.get(cell['wave_number'], (0, 0))
+        waves[cell['wave_number']] = (used + cell['utilization'], capacity + cell['max_capacity'])
+    wave_fill = {wave: used / capacity if capacity else 1.0 for wave, (used, capacity) in waves.items()}
+    emptiest = min(wave_fill[cell['wave_number']] for cell in candidates)
+    candidates = [cell for cell in candidates if wave_fill[cell['wave_number']] <= emptiest + wave_spread_tolerance]
+
+    if strategy == 'tier-affinity':
+        sizes = (tier_cell_sizes or DEFAULT_TIER_CELL_SIZES).get((tenant_tier or '').lower(), [])
+        preferred = [cell for cell in candidates if cell['cell_size'] in sizes]
+        candidates = preferred or candidates
+        strategy = 'least-loaded'
+
+    if strategy == 'best-fit':
+        key = lambda cell: (cell['max_capacity'] - cell['utilization'], cell['cell_id'])
+    else:
+        key = lambda cell: (cell['utilization'] / cell['max_capacity'], cell['utilization'], cell['cell_id'])
+    return min(candidates, key=key)
+
+
+def place_tenant(index, reserve, tenant_tier, config):
+    """Chooses a cell and reserves a place in it with reserve(cell), which raises CellContentionError when
+    the cell no longer has room. Contention means the index is stale: it is refreshed and the contended cell
+    left out for this tenant. Every contention leaves out one more cell, so this keeps trying until a freshly
+    loaded index has no candidate left, and only then raises NoCapacityError. Returns the chosen cell and what
+    reserve returned."""
+    excluded = set()
+    refreshed = False
+    while True:
+        cell = choose_cell(index.cells(), tenant_tier, config['strategy'], config['tier_cell_sizes'],
+                           config['wave_spread_tolerance'], excluded)
+        if cell is None:
+            if refreshed:
+                raise NoCapacityError('No available cell has capacity for the tenant')
+            # the cached cells may all have been full, a fresh load shows cells created or freed meanwhile
+            index.refresh()
+            refreshed = True
+            continue
+        try:
+            reservation = reserve(cell)
+        except CellContentionError:
+            excluded.add(cell['cell_id'])
+            index.refresh()
+            refreshed = True
+            continue
+        index.record_reservation(cell['cell_id'])
+        return cell, reservation
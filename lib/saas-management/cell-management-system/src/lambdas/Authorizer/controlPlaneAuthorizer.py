@@ -1,16 +1,18 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import re
 import json
+import hashlib
 import os
 import time
-import urllib.request
 import logging
 
-from jose import jwk, jwt
+from jose import jwt
 from jose.utils import base64url_decode
 
+from auth_policy import HttpVerb, LruCache, getPolicy
+from jwks_cache import JwksCache
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -18,6 +20,26 @@ region = os.environ['AWS_REGION']
 
 idp_details=json.loads(os.environ['IDP_DETAILS'])
 
+# jwks.json of the control plane user pool, cached across invocations (see the cell authorizer)
+jwks_cache = JwksCache()
+
+# Tokens that passed signature verification, keyed by their SHA-256, in a bounded LRU.
+# Cached tokens still get exp and aud re-checked.
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', '1024'))
+verified_tokens = LruCache(VERIFIED_TOKEN_CACHE_SIZE)
+
+# Control plane roles come from the custom:role claim. Users without one are denied; the users created
+# before the claim was required got SystemAdmin from the BackfillAdminRoles trigger.
+# Policies cover every method a role may call, so one cached authorizer result serves all of a
+# principal's requests until the API Gateway authorizer cache expires.
+SYSTEM_ADMIN_ROLE = 'SystemAdmin'
+READ_ONLY_ROLE = 'ReadOnly'
+READ_ONLY_METHODS = [
+    (HttpVerb.GET, '/ListCells'),
+    (HttpVerb.GET, '/DescribeCell'),
+    (HttpVerb.GET, '/DescribeTenant'),
+]
+
 def handler(event, context):
     input_details={}
     input_details['idpDetails'] = idp_details
@@ -40,188 +62,31 @@ def handler(event, context):
         logger.info(response)
         principal_id = response["sub"]
         user_name = response["cognito:username"]
+        user_role = response.get("custom:role", "")
     
-    tmp = event['methodArn'].split(':')
-    api_gateway_arn_tmp = tmp[5].split('/')
-    aws_account_id = tmp[4]
-
-    policy = AuthPolicy(principal_id, aws_account_id)
-    policy.restApiId = api_gateway_arn_tmp[0]
-    policy.region = tmp[3]
-    policy.stage = api_gateway_arn_tmp[1]
-
-    policy.allowAllMethods()
-    authResponse = policy.build()
+    # the policy document is built once per principal, API, stage and role; a repeated
+    # request reuses it and just gets the current context attached
+    policy_document = getPolicy(principal_id, event['methodArn'], user_role, addPolicyStatements)
 
     context = {
-        'userName': user_name
+        'userName': user_name,
+        'userRole': user_role
     }
 
+    authResponse = dict(policy_document)
     authResponse['context'] = context
     
     return authResponse
 
-class HttpVerb:
-    GET = "GET"
-    POST = "POST"
-    PUT = "PUT"
-    PATCH = "PATCH"
-    HEAD = "HEAD"
-    DELETE = "DELETE"
-    OPTIONS = "OPTIONS"
-    ALL = "*"
-
-class AuthPolicy(object):
-    awsAccountId = ""
-    """The AWS account id the policy will be generated for. This is used to create the method ARNs."""
-    principalId = ""
-    """The principal used for the policy, this should be a unique identifier for the end user."""
-    version = "2012-10-17"
-    """The policy version used for the evaluation. This should always be '2012-10-17'"""
-    pathRegex = "^[/.a-zA-Z0-9-\*]+$"
-    """The regular expression used to validate resource paths for the policy"""
-
-    """these are the internal lists of allowed and denied methods. These are lists
-    of objects and each object has 2 properties: A resource ARN and a nullable
-    conditions statement.
-    the build method processes these lists and generates the approriate
-    statements for the final policy"""
-    allowMethods = []
-    denyMethods = []
-
-    restApiId = "*"
-    """The API Gateway API id. By default this is set to '*'"""
-    region = "*"
-    """The region where the API is deployed. By default this is set to '*'"""
-    stage = "*"
-    """The name of the stage used in the policy. By default this is set to '*'"""
-
-    def __init__(self, principal, awsAccountId):
-        self.awsAccountId = awsAccountId
-        self.principalId = principal
-        self.allowMethods = []
-        self.denyMethods = []
-
-    def _addMethod(self, effect, verb, resource, conditions):
-        """Adds a method to the internal lists of allowed or denied methods. Each object in
-        the internal list contains a resource ARN and a condition statement. The condition
-        statement can be null."""
-        if verb != "*" and not hasattr(HttpVerb, verb):
-            raise NameError("Invalid HTTP verb " + verb +
-                            ". Allowed verbs in HttpVerb class")
-        resourcePattern = re.compile(self.pathRegex)
-        if not resourcePattern.match(resource):
-            raise NameError("Invalid resource path: " + resource +
-                            ". Path should match " + self.pathRegex)
-
-        if resource[:1] == "/":
-            resource = resource[1:]
-
-        resourceArn = ("arn:aws:execute-api:" +
-                       self.region + ":" +
-                       self.awsAccountId + ":" +
-                       self.restApiId + "/" +
-                       self.stage + "/" +
-                       verb + "/" +
-                       resource)
-
-        if effect.lower() == "allow":
-            self.allowMethods.append({
-                'resourceArn': resourceArn,
-                'conditions': conditions
-            })
-        elif effect.lower() == "deny":
-            self.denyMethods.append({
-                'resourceArn': resourceArn,
-                'conditions': conditions
-            })
-
-    def _getEmptyStatement(self, effect):
-        """Returns an empty statement object prepopulated with the correct action and the
-        desired effect."""
-        statement = {
-            'Action': 'execute-api:Invoke',
-            'Effect': effect[:1].upper() + effect[1:].lower(),
-            'Resource': []
-        }
-
-        return statement
-
-    def _getStatementForEffect(self, effect, methods):
-        """This function loops over an array of objects containing a resourceArn and
-        conditions statement and generates the array of statements for the policy."""
-        statements = []
-
-        if len(methods) > 0:
-            statement = self._getEmptyStatement(effect)
-
-            for curMethod in methods:
-                if curMethod['conditions'] is None or len(curMethod['conditions']) == 0:
-                    statement['Resource'].append(curMethod['resourceArn'])
-                else:
-                    conditionalStatement = self._getEmptyStatement(effect)
-                    conditionalStatement['Resource'].append(
-                        curMethod['resourceArn'])
-                    conditionalStatement['Condition'] = curMethod['conditions']
-                    statements.append(conditionalStatement)
-
-            statements.append(statement)
-
-        return statements
-
-    def allowAllMethods(self):
-        """Adds a '*' allow to the policy to authorize access to all methods of an API"""
-        self._addMethod("Allow", HttpVerb.ALL, "*", [])
-
-    def denyAllMethods(self):
-        """Adds a '*' allow to the policy to deny access to all methods of an API"""
-        self._addMethod("Deny", HttpVerb.ALL, "*", [])
-
-    def allowMethod(self, verb, resource):
-        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
-        methods for the policy"""
-        self._addMethod("Allow", verb, resource, [])
-
-    def denyMethod(self, verb, resource):
-        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
-        methods for the policy"""
-        self._addMethod("Deny", verb, resource, [])
-
-    def allowMethodWithConditions(self, verb, resource, conditions):
-        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
-        methods and includes a condition for the policy statement. More on AWS policy
-        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
-        self._addMethod("Allow", verb, resource, conditions)
-
-    def denyMethodWithConditions(self, verb, resource, conditions):
-        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
-        methods and includes a condition for the policy statement. More on AWS policy
-        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
-        self._addMethod("Deny", verb, resource, conditions)
-
-    def build(self):
-        """Generates the policy document based on the internal lists of allowed and denied
-        conditions. This will generate a policy with two main statements for the effect:
-        one statement for Allow and one statement for Deny.
-        Methods that includes conditions will have their own statement in the policy."""
-        if ((self.allowMethods is None or len(self.allowMethods) == 0) and
-                (self.denyMethods is None or len(self.denyMethods) == 0)):
-            raise NameError("No statements defined for the policy")
-
-        policy = {
-            'principalId': self.principalId,
-            'policyDocument': {
-                'Version': self.version,
-                'Statement': []
-            }
-        }
-
-        policy['policyDocument']['Statement'].extend(
-            self._getStatementForEffect("Allow", self.allowMethods))
-        policy['policyDocument']['Statement'].extend(
-            self._getStatementForEffect("Deny", self.denyMethods))
-
-        return policy
+def addPolicyStatements(policy, role):
+    if role == SYSTEM_ADMIN_ROLE:
+        policy.allowAllMethods()
+    elif role == READ_ONLY_ROLE:
+        for verb, resource in READ_ONLY_METHODS:
+            policy.allowMethod(verb, resource)
+    else:
+        logger.error('Unknown control plane role: %r', role)
+        policy.denyAllMethods()
 
 def validateJWT(event):
 
@@ -234,50 +99,49 @@ def validateJWT(event):
 
     keys_url = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format(
         region, user_pool_id)
-    with urllib.request.urlopen(keys_url) as f:
-        response = f.read()
-    keys = json.loads(response.decode('utf-8'))['keys']
 
-    response = __validateCognitoJWT(token, app_client_id, keys)
+    response = __validateCognitoJWT(token, app_client_id, keys_url)
 
     return response
 
-def __validateCognitoJWT(token, app_client_id, keys):
-    # get the kid from the headers prior to verification
-    headers = jwt.get_unverified_headers(token)
-    kid = headers['kid']
-    # search for the kid in the downloaded public keys
-    key_index = -1
-    for i in range(len(keys)):
-        if kid == keys[i]['kid']:
-            key_index = i
-            break
-    if key_index == -1:
-        logger.info('Public key not found in jwks.json')
-        return False
-    # construct the public key
-    public_key = jwk.construct(keys[key_index])
-    # get the last two sections of the token,
-    # message and signature (encoded in base64)
-    message, encoded_signature = str(token).rsplit('.', 1)
-    # decode the signature
-    decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
-    # verify the signature
-    if not public_key.verify(message.encode("utf8"), decoded_signature):
-        logger.info('Signature verification failed')
-        return False
-    logger.info('Signature successfully verified')
-    # since we passed the verification, we can now safely
-    # use the unverified claims
-    claims = jwt.get_unverified_claims(token)
+def __validateCognitoJWT(token, app_client_id, keys_url):
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    claims = verified_tokens.get(token_hash)
+    if claims is not None:
+        logger.info('Token found in verified token cache')
+    else:
+        # get the kid from the headers prior to verification
+        headers = jwt.get_unverified_headers(token)
+        kid = headers['kid']
+        # look up the public key for the kid in the cached jwks.json
+        public_key = jwks_cache.get_public_key(keys_url, kid)
+        if public_key is None:
+            logger.info('Public key not found in jwks.json')
+            return False
+        # get the last two sections of the token,
+        # message and signature (encoded in base64)
+        message, encoded_signature = str(token).rsplit('.', 1)
+        # decode the signature
+        decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
+        # verify the signature
+        if not public_key.verify(message.encode("utf8"), decoded_signature):
+            logger.info('Signature verification failed')
+            return False
+        logger.info('Signature successfully verified')
+        # since we passed the verification, we can now safely
+        # use the unverified claims
+        claims = jwt.get_unverified_claims(token)
     # additionally we can verify the token expiration
     if time.time() > claims['exp']:
         logger.info('Token is expired')
+        verified_tokens.pop(token_hash)
         return False
     # and the Audience  (use claims['client_id'] if verifying an access token)
     if claims['aud'] != app_client_id:
         logger.info('Token was not issued for this audience')
         return False
+    # the token is only cached once it passed every check, and drops out again at exp
+    verified_tokens.put(token_hash, claims)
     # now we can use the claims
     logger.info(claims)
     return claims
\ No newline at end of file
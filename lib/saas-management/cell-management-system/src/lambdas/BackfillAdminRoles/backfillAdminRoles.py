@@ -0,0 +1,34 @@
+import os
+import boto3
+import logging
+
+cognito = boto3.client('cognito-idp')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SYSTEM_ADMIN_ROLE = 'SystemAdmin'
+
+def handler(event, context):
+    """Sets custom:role to SystemAdmin on the control plane users created before the authorizer required
+    the attribute (users without a role are now denied). Users that have a role keep it. Safe to run
+    more than once."""
+    logger.info('Received event: %s', event)
+
+    user_pool_id = os.environ.get('USER_POOL_ID')
+    updated = 0
+    paginator = cognito.get_paginator('list_users')
+    for page in paginator.paginate(UserPoolId=user_pool_id):
+        for user in page.get('Users', []):
+            attributes = {attribute['Name']: attribute['Value'] for attribute in user.get('Attributes', [])}
+            if attributes.get('custom:role'):
+                continue
+            cognito.admin_update_user_attributes(
+                UserPoolId=user_pool_id,
+                Username=user['Username'],
+                UserAttributes=[{'Name': 'custom:role', 'Value': SYSTEM_ADMIN_ROLE}]
+            )
+            updated += 1
+
+    logger.info('Set custom:role to %s on %s users', SYSTEM_ADMIN_ROLE, updated)
+    return {'updated': updated}
@@ -0,0 +1,50 @@
+import os
+import boto3
+import logging
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource('dynamodb')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CELL_ITEM_TYPE = 'cell'
+
+def handler(event, context):
+    """Sets item_type on the cell items written before createCell did, so they show up in the
+    CellsByItemTypeIndex. Tenant items (PK's with a #) are left without one and stay out of the index.
+    Safe to run more than once, items that already have an item_type are skipped."""
+    logger.info('Received event: %s', event)
+
+    cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
+    table = dynamodb.Table(cell_management_table)
+    scan_kwargs = {
+        "ProjectionExpression": "PK",
+        "FilterExpression": "attribute_not_exists(item_type) AND NOT contains(PK, :separator)",
+        "ExpressionAttributeValues": {":separator": "#"}
+    }
+    updated = 0
+    done = False
+    start_key = None
+    while not done:
+        if start_key:
+            scan_kwargs["ExclusiveStartKey"] = start_key
+        response = table.scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            try:
+                table.update_item(
+                    Key={'PK': item['PK']},
+                    UpdateExpression="set item_type = :item_type",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeValues={':item_type': CELL_ITEM_TYPE}
+                )
+                updated += 1
+            except ClientError as e:
+                # the cell was deleted since the scan read it
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        start_key = response.get("LastEvaluatedKey", None)
+        done = start_key is None
+
+    logger.info('Set item_type on %s cells', updated)
+    return {'updated': updated}
@@ -0,0 +1,45 @@
+import os
+import boto3
+import logging
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource('dynamodb')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+def handler(event, context):
+    """Adds the tenants created before the tenant directory existed to it, with the cell their item is in.
+    An entry is only added where there is none, so an entry written meanwhile by an onboarding or a move
+    is never overwritten with the cell the scan saw. Safe to run more than once."""
+    logger.info('Received event: %s', event)
+
+    cell_management_table = dynamodb.Table(os.environ.get('CELL_MANAGEMENT_TABLE'))
+    tenant_directory_table = dynamodb.Table(os.environ.get('TENANT_DIRECTORY_TABLE_NAME'))
+    scan_kwargs = {
+        "ProjectionExpression": "PK, cell_id, tenant_id",
+        "FilterExpression": "contains(PK, :separator) AND attribute_exists(tenant_id)",
+        "ExpressionAttributeValues": {":separator": "#"}
+    }
+    added = 0
+    done = False
+    start_key = None
+    while not done:
+        if start_key:
+            scan_kwargs["ExclusiveStartKey"] = start_key
+        response = cell_management_table.scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            try:
+                tenant_directory_table.put_item(
+                    Item={'tenant_id': item['tenant_id'], 'cell_id': item.get('cell_id', item['PK'].split('#')[0])},
+                    ConditionExpression="attribute_not_exists(tenant_id)"
+                )
+                added += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        start_key = response.get("LastEvaluatedKey", None)
+        done = start_key is None
+
+    logger.info('Added %s tenants to the tenant directory', added)
+    return {'added': added}
@@ -1,23 +1,36 @@
 import base64
 import json
 import os
+import struct
+import time
 import boto3
 import logging
-from aws_embedded_metrics import metric_scope
-from aws_embedded_metrics.storage_resolution import StorageResolution
-from aws_embedded_metrics.config import get_config
+from emf_batch import EmfBatch
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-Config = get_config()
-Config.service_type = "CellObserver"
-
 DYNAMO_CELL_MANAGEMENT_TABLE = os.environ.get('CELL_MANAGEMENT_TABLE')
+CELL_UTILIZATION_TABLE = os.environ.get('CELL_UTILIZATION_TABLE')
+
+EMF_SERVICE_TYPE = "CellObserver"
+EMF_UNITS = {"CellUtilizationRatio": "Percent", "CellTimeToFull": "Seconds"}
+
+# Utilization samples of the last day, one every 15 minutes, kept as a ring buffer on the cell's item
+# in the utilization table: a binary of fixed size slots, each the sample time in epoch seconds and the
+# cell utilization, and the number of samples ever written, whose remainder is the next slot
+SAMPLE_INTERVAL_SECONDS = 15 * 60
+SAMPLE_SLOTS = 96
+SAMPLE_FORMAT = struct.Struct('>II')
+# fewer samples than this give no forecast
+MIN_FORECAST_SAMPLES = 4
+BATCH_GET_LIMIT = 100
 
 dynamodb = boto3.resource('dynamodb')
 ddb_table = dynamodb.Table(DYNAMO_CELL_MANAGEMENT_TABLE)
+utilization_table = dynamodb.Table(CELL_UTILIZATION_TABLE)
 
 def handler(event, context):
      
@@ -30,11 +43,14 @@ def handler(event, context):
     logger.info('Response: %s', response)
     return response
 
-def list_and_process_cells():
+def list_and_process_cells(sink=None):
     cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
     table = dynamodb.Table(cell_management_table)
     cells = []
-    scan_kwargs = {
+    # only cell items carry an item_type, so the query reads cells and none of the tenants
+    query_kwargs = {
+        "IndexName": "CellsByItemTypeIndex",
+        "KeyConditionExpression": Key("item_type").eq("cell"),
         "ProjectionExpression": "PK, cell_name, cell_max_capacity, cell_utilization, current_status"
     }
     try:
@@ -42,66 +58,141 @@ def list_and_process_cells():
         start_key = None
         while not done:
             if start_key:
-                scan_kwargs["ExclusiveStartKey"] = start_key
-            response = table.scan(**scan_kwargs)
-            dynamo_response = response.get("Items",[])
-            # Iterate over a copy of the list to avoid semgrep list-modify-while-iterate rule.
-            for item in dynamo_response[:]:
-                # We're only interested in cells, so ignore the tenants (PK's with a #)
-                if "#" in item['PK']:
-                    dynamo_response.remove(item)
+                query_kwargs["ExclusiveStartKey"] = start_key
+            response = table.query(**query_kwargs)
+            for item in response.get("Items", []):
                 # If the cell is provisioning or failed to provision, ignore
-                elif "available" not in item['current_status']:
-                    dynamo_response.remove(item)
-                else:
-                    item['CellId'] = item.pop('PK')
-                    item['CellName'] = item.pop('cell_name')
-                    item['Status'] = item.pop('current_status')
-                    item['CellMaxSize'] = item.pop('cell_max_capacity')
-                    item['CellUtilization'] = item.pop('cell_utilization')
-            cells.extend(response.get("Items", []))
+                if "available" not in item['current_status']:
+                    continue
+                item['CellId'] = item.pop('PK')
+                item['CellName'] = item.pop('cell_name')
+                item['Status'] = item.pop('current_status')
+                item['CellMaxSize'] = item.pop('cell_max_capacity')
+                item['CellUtilization'] = item.pop('cell_utilization')
+                cells.append(item)
             start_key = response.get("LastEvaluatedKey", None)
             done = start_key is None
     except Exception as e:
-        logger.error("Couldn't scan for cells: %s",e)
+        logger.error("Couldn't query for cells: %s",e)
         raise
     else:
+        now = int(time.time())
+        samples = get_cell_samples([cell['CellId'] for cell in cells])
         for cell in cells:
-            logger.info("Cell: %s", cell)
-            try:
-                emit_cell_metrics(cell)
-            except Exception as e:
-                logger.error("Error processing metrics for cell: %s", e)
+            cell_samples = samples.get(cell['CellId'], {})
+            record_sample(cell, cell_samples, now)
+            cell.update(forecast(cell, cell_samples.get('samples', []), now))
+            cell['Tiers'] = cell_samples.get('tiers', {})
+        emit_cell_metrics(cells, sink)
 
     # Process the request and generate a response
     response = {
         'statusCode': 200,
         'body': {
-            "processed": True
+            "processed": True,
+            "cells": len(cells)
             }
     }
     return response
 
-@metric_scope
-def emit_cell_metrics(cell_details,metrics):
+def get_cell_samples(cell_ids):
+    """Reads the cells' items in the utilization table: the utilization samples, oldest first, the
+    number of samples written, and the tenant counts by tier kept there by the UtilizationAggregator"""
+    cells = {}
+    for start in range(0, len(cell_ids), BATCH_GET_LIMIT):
+        request = {CELL_UTILIZATION_TABLE: {'Keys': [{'PK': cell_id} for cell_id in cell_ids[start:start + BATCH_GET_LIMIT]]}}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(CELL_UTILIZATION_TABLE, []):
+                buffer = item.get('capacity_samples')
+                buffer = bytes(buffer.value if hasattr(buffer, 'value') else buffer) if buffer else b''
+                head = int(item.get('capacity_sample_head', 0))
+                cells[item['PK']] = {
+                    'head': head,
+                    'buffer': buffer,
+                    'samples': unpack_samples(buffer, head),
+                    'tiers': {attribute[len('tier_'):]: int(count) for attribute, count in item.items()
+                              if attribute.startswith('tier_') and count},
+                }
+            request = response.get('UnprocessedKeys')
+    return cells
+
+def unpack_samples(buffer, head):
+    slots = [SAMPLE_FORMAT.unpack_from(buffer, slot * SAMPLE_FORMAT.size) for slot in range(len(buffer) // SAMPLE_FORMAT.size)]
+    # the slot after the last written one holds the oldest sample, unless the buffer hasn't wrapped yet
+    oldest = head % SAMPLE_SLOTS if head >= SAMPLE_SLOTS else 0
+    return [sample for sample in slots[oldest:] + slots[:oldest] if sample[0]]
+
+def record_sample(cell, cell_samples, now):
+    """Writes the cell's current utilization into the next slot of its ring buffer, at most once per sample
+    interval. The write is conditional on the number of samples read, so overlapping invocations write once"""
+    samples = cell_samples.get('samples', [])
+    if samples and now - samples[-1][0] < SAMPLE_INTERVAL_SECONDS:
+        return
+    head = cell_samples.get('head', 0)
+    buffer = bytearray(SAMPLE_SLOTS * SAMPLE_FORMAT.size)
+    buffer[:len(cell_samples.get('buffer', b''))] = cell_samples.get('buffer', b'')[:len(buffer)]
+    SAMPLE_FORMAT.pack_into(buffer, (head % SAMPLE_SLOTS) * SAMPLE_FORMAT.size, now, int(cell['CellUtilization']))
     try:
-        cell_id = cell_details['CellId']
-        cell_name = cell_details['CellName']
-        cell_max_size = cell_details['CellMaxSize']
-        cell_utilization = cell_details['CellUtilization']
-
-        # Emit metrics
-        logger.info("Emitting metrics for cell: %s", cell_id)
-        logger.info("Cell name: %s", cell_name)
-        logger.info("Cell max size: %s", cell_max_size)
-        logger.info("Cell utilization: %s", cell_utilization)
-
-        # Emit metrics
-        metrics.reset_dimensions(False)
-        metrics.set_namespace("CellManagement")
-        metrics.put_dimensions({ "CellId": cell_id,"CellName": cell_name })
-        metrics.put_metric("CellUtilization", int(cell_utilization), "Count", StorageResolution.STANDARD)
-        metrics.put_metric("CellMaxSize", int(cell_max_size), "Count", StorageResolution.STANDARD)
+        utilization_table.update_item(
+            Key={'PK': cell['CellId']},
+            UpdateExpression='SET capacity_samples = :samples, capacity_sample_head = :next',
+            ConditionExpression='attribute_not_exists(capacity_sample_head) OR capacity_sample_head = :head',
+            ExpressionAttributeValues={':samples': bytes(buffer), ':next': head + 1, ':head': head}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Sample of cell %s was already written", cell['CellId'])
 
-    except Exception as e:
-        logger.error("Error emitting metrics: %s", e)
\ No newline at end of file
+def forecast(cell, samples, now):
+    """Headroom, utilization ratio, onboarding rate and, while the cell is filling up, the time until it is
+    full, from a least squares fit of the samples and the current utilization over time"""
+    utilization = int(cell['CellUtilization'])
+    max_size = int(cell['CellMaxSize'])
+    points = [(float(t), float(u)) for t, u in samples] + [(float(now), float(utilization))]
+    metrics = {
+        'CellHeadroom': max(max_size - utilization, 0),
+        'CellUtilizationRatio': utilization * 100.0 / max_size if max_size else 100.0,
+    }
+    elapsed = points[-1][0] - points[0][0]
+    onboarded = sum(max(b[1] - a[1], 0) for a, b in zip(points, points[1:]))
+    metrics['CellOnboardingsPerHour'] = onboarded * 3600 / elapsed if elapsed else 0.0
+
+    if utilization >= max_size:
+        metrics['CellTimeToFull'] = 0
+    elif len(points) >= MIN_FORECAST_SAMPLES:
+        mean_t = sum(t for t, _ in points) / len(points)
+        mean_u = sum(u for _, u in points) / len(points)
+        variance = sum((t - mean_t) ** 2 for t, _ in points)
+        slope = sum((t - mean_t) * (u - mean_u) for t, u in points) / variance if variance else 0.0
+        # a cell that isn't filling up has no forecast, rather than a time to full that is far off
+        if slope > 0:
+            metrics['CellTimeToFull'] = int((max_size - utilization) / slope)
+    return metrics
+
+def emit_cell_metrics(cells, sink=None):
+    """Writes the metrics of every cell in a single flush. An EMF document holds one value per dimension,
+    so each cell still needs a document of its own; the documents carry nothing but the directive, the
+    dimensions and the values, and are written to the log in one go."""
+    batch = EmfBatch(sink, service_type=EMF_SERVICE_TYPE)
+    for cell in cells:
+        try:
+            metrics = {"CellUtilization": int(cell['CellUtilization']), "CellMaxSize": int(cell['CellMaxSize'])}
+            for name in ("CellHeadroom", "CellUtilizationRatio", "CellOnboardingsPerHour", "CellTimeToFull"):
+                if name in cell:
+                    metrics[name] = cell[name]
+            batch.add(
+                dimensions={"CellId": cell['CellId'], "CellName": cell['CellName']},
+                metrics=metrics,
+                units=EMF_UNITS
+            )
+            for tier, count in cell.get('Tiers', {}).items():
+                batch.add(
+                    dimensions={"CellId": cell['CellId'], "CellName": cell['CellName'], "TenantTier": tier},
+                    metrics={"CellTenants": count}
+                )
+        except Exception as e:
+            logger.error("Error processing metrics for cell %s: %s", cell.get('CellId'), e)
+    emitted = batch.flush()
+    logger.info("Emitted metrics for %s cells", emitted)
@@ -84,6 +84,7 @@ def create_cell(cell_id, cell_name, cell_size, wave_number):
         ddb_table.put_item(
             Item={
                 'PK': cell_id,
+                'item_type': 'cell',
                 'cell_name': cell_name,
                 'cell_size': cell_size,
                 'wave_number': wave_number,
@@ -4,10 +4,12 @@ import boto3
 import logging
 from botocore.exceptions import ClientError
 from botocore.config import Config
+from tenant_directory import find_tenant_cell
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+DYNAMO_CELL_MANAGEMENT_TABLE = os.environ.get('CELL_MANAGEMENT_TABLE')
 CELL_ROUTER_KVS_ARN = os.environ.get('CELL_ROUTER_KVS_ARN')
 
 kvsClient = boto3.session.Session().client(
@@ -39,6 +41,26 @@ def delete_cell_routing_entry(tenantId):
     except Exception as e:
         logger.error(f'Unexpected Error persisting or parsing config object: {e}')
 
+dynamodb = boto3.resource('dynamodb')
+ddb_table = dynamodb.Table(DYNAMO_CELL_MANAGEMENT_TABLE)
+
+def set_tenant_routing_inactive(tenantId):
+    """Records on the tenant's item that it has no routing entry, the utilization aggregator counts it as inactive.
+    The tenant directory tells which cell holds the tenant."""
+    try:
+        cell_id = find_tenant_cell(tenantId)
+        if cell_id is None:
+            logger.info('Tenant %s not found in the tenant directory', tenantId)
+            return
+        ddb_table.update_item(
+            Key={'PK': cell_id+"#"+tenantId},
+            UpdateExpression="set routing_active = :ra",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeValues={':ra': False}
+        )
+    except ClientError as e:
+        logger.error(f'Error recording the tenant as inactive: {e}')
+
 def handler(event, context):
      
     # Log the entire event
@@ -51,6 +73,7 @@ def handler(event, context):
             data = json.loads(body)
             tenant_id = data.get('TenantId')
             delete_cell_routing_entry(tenant_id)
+            set_tenant_routing_inactive(tenant_id)
             logger.info('routing successfully removed for %s', tenant_id)
         except json.JSONDecodeError:
             logger.error('Invalid JSON in request body')
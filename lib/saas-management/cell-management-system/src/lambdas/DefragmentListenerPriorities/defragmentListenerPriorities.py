@@ -0,0 +1,93 @@
+import os
+import boto3
+import logging
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from listener_priority import CELL_ATTRIBUTES, defragment
+from table_sweep import parallel_scan
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CELL_MANAGEMENT_TABLE_NAME = os.environ.get('CELL_MANAGEMENT_TABLE_NAME')
+BATCH_GET_LIMIT = 100
+
+dynamodb = boto3.resource('dynamodb')
+ddb_table = dynamodb.Table(CELL_MANAGEMENT_TABLE_NAME)
+
+
+def handler(event, context):
+    """Rebuilds every cell's listener priority map from the priorities its tenants hold, freeing slots that
+    a failed release leaked and, for cells created before the map existed, the slots the old counter skipped.
+    The cells are read before the tenants, consistently, and a map is only written if its version is still
+    the one read, so a priority allocated or released during the sweep is never lost; such a cell is left
+    for the next run."""
+    logger.info('Received event: %s', event)
+
+    cells = get_cells()
+    tenant_priorities = {cell_id: [] for cell_id in cells}
+    for item in parallel_scan(CELL_MANAGEMENT_TABLE_NAME, ConsistentRead=True,
+                              ProjectionExpression='PK, cell_id, current_status, tenant_listener_priority, '
+                                                   'move_target_cell_id, move_target_listener_priority'):
+        # failed tenants give their priority back, those that failed before they did still have it on their item
+        if '#' not in item['PK'] or item.get('current_status') == 'failed':
+            continue
+        if item.get('tenant_listener_priority') and item.get('cell_id') in tenant_priorities:
+            tenant_priorities[item['cell_id']].append(item['tenant_listener_priority'])
+        # a moving tenant holds a priority in its target cell too
+        if item.get('move_target_listener_priority') and item.get('move_target_cell_id') in tenant_priorities:
+            tenant_priorities[item['move_target_cell_id']].append(item['move_target_listener_priority'])
+
+    defragmented = 0
+    for cell_id, cell in cells.items():
+        rebuilt = defragment(cell, tenant_priorities[cell_id])
+        if rebuilt is None:
+            continue
+        set_clause, condition, values = rebuilt.expression()
+        try:
+            ddb_table.update_item(
+                Key={'PK': cell_id},
+                UpdateExpression='SET ' + set_clause,
+                ConditionExpression='attribute_exists(PK) AND ' + condition,
+                ExpressionAttributeValues=values
+            )
+            defragmented += 1
+            logger.info('Rebuilt the listener priority map of cell %s, %s priorities in use, %s held',
+                        cell_id, len(rebuilt.in_use()), len(rebuilt.held))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info('Listener priorities of cell %s changed during the sweep, leaving them for the next run', cell_id)
+
+    logger.info('Checked %s cells, rebuilt %s', len(cells), defragmented)
+    return {'cells': len(cells), 'defragmented': defragmented}
+
+
+def get_cells():
+    """The cell items with their listener priority map, keyed by PK"""
+    query_kwargs = {
+        'IndexName': 'CellsByItemTypeIndex',
+        'KeyConditionExpression': Key('item_type').eq('cell'),
+        'ProjectionExpression': 'PK'
+    }
+    cell_ids = []
+    while True:
+        response = ddb_table.query(**query_kwargs)
+        cell_ids.extend(item['PK'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    cells = {}
+    for start in range(0, len(cell_ids), BATCH_GET_LIMIT):
+        request = {CELL_MANAGEMENT_TABLE_NAME: {
+            'Keys': [{'PK': cell_id} for cell_id in cell_ids[start:start + BATCH_GET_LIMIT]],
+            'ProjectionExpression': 'PK, ' + CELL_ATTRIBUTES,
+            'ConsistentRead': True
+        }}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(CELL_MANAGEMENT_TABLE_NAME, []):
+                cells[item['PK']] = item
+            request = response.get('UnprocessedKeys')
+    return cells
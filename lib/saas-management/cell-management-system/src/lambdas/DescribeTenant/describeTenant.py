@@ -4,6 +4,7 @@ import json
 import os
 import boto3
 import logging
+from tenant_directory import find_tenant_cell
 
 dynamodb = boto3.resource('dynamodb')
 
@@ -50,6 +51,15 @@ def describe_tenant(cell_id, tenant_id):
         tenant_management_table = os.environ.get('TENANT_MANAGEMENT_TABLE')
         ddb_table = dynamodb.Table(tenant_management_table)
         try:
+            if not cell_id:
+                # without a CellId the tenant directory tells which cell holds the tenant, the tenant
+                # record is then read from that cell
+                cell_id = find_tenant_cell(tenant_id)
+                if cell_id is None:
+                    return {
+                        'statusCode': 404,
+                        'body': json.dumps(f'Tenant not found: {tenant_id}')
+                    }
             ddb_response = ddb_table.get_item(
                 Key={
                     'PK': cell_id + "#" + tenant_id
@@ -89,4 +99,4 @@ def describe_tenant(cell_id, tenant_id):
             return {
                 'statusCode': 404,
                 'body': json.dumps(f'Tenant not found: {cell_id} & {tenant_id}')
-            }
\ No newline at end of file
+            }
@@ -1,64 +1,72 @@
-
-import base64
 import json
 import os
 import boto3
+from boto3.dynamodb.conditions import Key
 import logging
+from pagination import InvalidPaginationError, get_page_size, encode_token, decode_token
 
 dynamodb = boto3.resource('dynamodb')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+PAGINATION_SCOPE = 'ListCells'
+
 def handler(event, context):
      
     # Log the entire event
     logger.info('Received event: %s', event)
 
-    # Extract the request body
+    # Extract the request parameters
+    query_parameters = event.get('queryStringParameters')
     try:
-        return list_cells()
+        return list_cells(get_page_size(query_parameters), decode_token(query_parameters, PAGINATION_SCOPE))
+    except InvalidPaginationError as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
+        }
     except Exception as e:
-        logger.error("Couldn't scan for cells: %s",e)
+        logger.error("Couldn't query for cells: %s",e)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'A Problem occured listing cells'})
         }
 
-def list_cells():
+def list_cells(page_size, start_key):
+    """Returns a single page of cells, with a NextToken when there are more"""
     cell_management_table = os.environ.get('CELL_MANAGEMENT_TABLE')
     table = dynamodb.Table(cell_management_table)
-    cells = []
-    scan_kwargs = {
-        "ProjectionExpression": "PK, cell_name, current_status, cell_utilization"
+    # only cell items carry an item_type, so the query reads cells and none of the tenants
+    query_kwargs = {
+        "IndexName": "CellsByItemTypeIndex",
+        "KeyConditionExpression": Key("item_type").eq("cell"),
+        "ProjectionExpression": "PK, cell_name, current_status, cell_utilization",
+        "Limit": page_size
     }
+    if start_key:
+        query_kwargs["ExclusiveStartKey"] = start_key
     try:
-        done = False
-        start_key = None
-        while not done:
-            if start_key:
-                scan_kwargs["ExclusiveStartKey"] = start_key
-            response = table.scan(**scan_kwargs)
-            dynamo_response = response.get("Items",[])
-            # Iterate over a copy of the list to avoid semgrep list-modify-while-iterate rule.
-            for item in dynamo_response[:]:
-                if "#" in item['PK']:
-                    dynamo_response.remove(item)
-                else:
-                    item['CellId'] = item.pop('PK')
-                    item['CellName'] = item.pop('cell_name')
-                    item['Status'] = item.pop('current_status')
-                    item['CellUtilization'] = str(item.pop('cell_utilization'))
-            cells.extend(response.get("Items", []))
-            start_key = response.get("LastEvaluatedKey", None)
-            done = start_key is None
+        response = table.query(**query_kwargs)
     except Exception as e:
-        logger.error("Couldn't scan for cells: %s",e)
+        logger.error("Couldn't query for cells: %s",e)
         raise
 
+    cells = [{
+        'CellId': item['PK'],
+        'CellName': item.get('cell_name'),
+        'Status': item.get('current_status'),
+        'CellUtilization': str(item.get('cell_utilization'))
+    } for item in response.get("Items", [])]
+
+    body = {'Cells': cells}
+    next_token = encode_token(response.get("LastEvaluatedKey"), PAGINATION_SCOPE)
+    if next_token:
+        body['NextToken'] = next_token
+
     # Process the request and generate a response
     response = {
         'statusCode': 200,
-        'body': json.dumps(cells)
+        'body': json.dumps(body)
     }
-    return response
\ No newline at end of file
+    return response
@@ -1,9 +1,9 @@
 
-import base64
 import json
 import os
 import boto3
 import logging
+from pagination import InvalidPaginationError, get_page_size, encode_token, decode_token
 
 dynamodb = boto3.resource('dynamodb')
 
@@ -21,59 +21,64 @@ def handler(event, context):
             cell_id = event['queryStringParameters']['CellId']
             logger.info('CellId: %s', cell_id)
             if cell_id is not None:
-                return list_tenants(cell_id)
+                query_parameters = event['queryStringParameters']
+                return list_tenants(cell_id, get_page_size(query_parameters),
+                                    decode_token(query_parameters, pagination_scope(cell_id)))
         else:
             logger.error('Invalid request parameters')
             return {
                 'statusCode': 400,
                 'body': json.dumps({'error': 'Invalid JSON in request body'})
             }
+    except InvalidPaginationError as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
+        }
     except Exception as e:
-        logger.error("Couldn't scan for tenants: %s",e)
+        logger.error("Couldn't query for tenants: %s",e)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'A Problem occurred listing tenants'})
         }
 
-def list_tenants(cell_id):
+def list_tenants(cell_id, page_size, start_key):
+    """Returns a single page of the cell's tenants, with a NextToken when there are more"""
     tenant_management_table = os.environ.get('TENANT_MANAGEMENT_TABLE')
     table = dynamodb.Table(tenant_management_table)
-    tenants = []
+    query_kwargs = {
+        'IndexName': 'TenantsByCellIdIndex',
+        'KeyConditionExpression': 'cell_id = :cell_id',
+        'ExpressionAttributeValues': {
+            ':cell_id': cell_id
+        },
+        'ProjectionExpression': 'tenant_id, tenant_name, current_status',
+        'Limit': page_size
+    }
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
     try:
-        
-        response = table.query(
-            IndexName='TenantsByCellIdIndex',
-            KeyConditionExpression='cell_id = :cell_id',
-            ExpressionAttributeValues={
-                ':cell_id': cell_id
-            },
-            ProjectionExpression='tenant_id, tenant_name, current_status'
-        )
-
-        if 'Items' in response:
-            for item in response['Items']:
-                tenant_id = item.get('tenant_id')
-                tenant_name = item.get('tenant_name')
-                tenant_status = item.get('current_status')
-                                                                                    
-                tenants.append({
-                    'TenantId': tenant_id,
-                    'TenantName': tenant_name,
-                    'Status': tenant_status
-                })
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(tenants)
-        }
-
+        response = table.query(**query_kwargs)
     except Exception as e:
-        logger.error("Couldn't scan for tenants: %s",e)
+        logger.error("Couldn't query for tenants: %s",e)
         raise
 
-    # Process the request and generate a response
-    response = {
+    tenants = [{
+        'TenantId': item.get('tenant_id'),
+        'TenantName': item.get('tenant_name'),
+        'Status': item.get('current_status')
+    } for item in response.get('Items', [])]
+
+    body = {'Tenants': tenants}
+    next_token = encode_token(response.get('LastEvaluatedKey'), pagination_scope(cell_id))
+    if next_token:
+        body['NextToken'] = next_token
+
+    return {
         'statusCode': 200,
-        'body': json.dumps(tenants)
+        'body': json.dumps(body)
     }
-    return response
\ No newline at end of file
+
+def pagination_scope(cell_id):
+    # a token only continues the listing of the cell it was issued for
+    return 'ListTenants#' + cell_id
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import logging
+import boto3
+from botocore.exceptions import ClientError
+from listener_priority import CELL_ATTRIBUTES, ListenerPriorities, PrioritySpaceExhaustedError, release_priorities
+
+# Initialize clients
+eventbridge_client = boto3.client('events')
+dynamodb = boto3.resource('dynamodb')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CELL_MANAGEMENT_TABLE = os.environ.get('CELL_MANAGEMENT_TABLE')
+CELL_MANAGEMENT_BUS = os.environ.get('CELL_MANAGEMENT_BUS')
+# reservations retried after losing to concurrent onboardings in the target cell
+MAX_RESERVATION_ATTEMPTS = 5
+
+ddb_table = dynamodb.Table(CELL_MANAGEMENT_TABLE)
+
+
+def handler(event, context):
+    """Starts moving a tenant to another cell. The target cell's capacity and a listener priority are
+    reserved here and the tenant is marked as moving; the tenant move state machine of the cell
+    provisioning system then deploys the tenant into the target cell, copies its data and switches
+    its routing entry (see moveTenantData.py)."""
+    logger.info('Received event: %s', event)
+
+    body = event.get('body')
+    if body:
+        try:
+            data = json.loads(body)
+            tenant_id = data.get('TenantId')
+            source_cell_id = data.get('SourceCellId')
+            target_cell_id = data.get('TargetCellId')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logger.error('Invalid JSON or encoding in request body')
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'Invalid JSON or encoding in request body'})
+            }
+    else:
+        logger.info('Wrong request body')
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Wrong request body'})
+        }
+
+    if source_cell_id == target_cell_id:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Source and target cell are the same'})
+        }
+
+    tenant = ddb_table.get_item(Key={'PK': source_cell_id + "#" + tenant_id}).get('Item')
+    if tenant is None or tenant.get('current_status') != 'available':
+        return {
+            'statusCode': 409,
+            'body': json.dumps({'error': 'Tenant is not available in the source cell'})
+        }
+    # moving a deactivated tenant would give it a routing entry in the target cell
+    if tenant.get('routing_active') is False:
+        return {
+            'statusCode': 409,
+            'body': json.dumps({'error': 'Tenant is deactivated, activate it before moving it'})
+        }
+
+    # reserve a slot and a listener priority in the target cell
+    reservation = reserve_target_cell(target_cell_id)
+    if reservation is None:
+        return {
+            'statusCode': 503,
+            'body': json.dumps('Target cell is currently unavailable or at full capacity')
+        }
+    target_cell, tenant_listener_priority = reservation
+
+    move_id = str(int(time.time()))
+    try:
+        # the target priority is kept on the tenant until the move completes, so defragmenting the target
+        # cell's priorities doesn't free it
+        ddb_table.update_item(
+            Key={'PK': source_cell_id + "#" + tenant_id},
+            UpdateExpression='SET current_status = :moving, move_target_cell_id = :target, move_id = :move_id, '
+                             'move_target_listener_priority = :priority',
+            ConditionExpression='current_status = :available AND (attribute_not_exists(routing_active) OR routing_active <> :inactive)',
+            ExpressionAttributeValues={':moving': 'moving', ':available': 'available', ':target': target_cell_id,
+                                       ':move_id': move_id, ':priority': str(tenant_listener_priority), ':inactive': False}
+        )
+    except ClientError as e:
+        release_target_cell(target_cell_id, tenant_listener_priority)
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return {
+                'statusCode': 409,
+                'body': json.dumps({'error': 'Tenant is not available in the source cell'})
+            }
+        raise
+
+    detail = {
+        'event_type': 'move_tenant',
+        'tenant_id': tenant_id,
+        'move_id': move_id,
+        'source_cell_id': source_cell_id,
+        'target_cell_id': target_cell_id,
+        'target_cell_size': target_cell.get('cell_size'),
+        'tenant_email': tenant.get('tenant_email'),
+        'tenant_tier': tenant.get('tenant_tier', ''),
+        'product_write_mode': tenant.get('product_write_mode', 'direct'),
+        'tenant_listener_priority': str(tenant_listener_priority),
+        'product_image_version': tenant.get('product_image_version'),
+        # the tenant's secret in the source cell exists until the move completes
+        'tenant_secret_name': '{0}Credentials-{1}-{2}'.format(tenant_id, target_cell_id, move_id)
+    }
+    eventbridge_response = eventbridge_client.put_events(
+        Entries=[
+            {
+                'Source': 'cellManagement.moveTenant',
+                'DetailType': 'TenantMove',
+                'Detail': json.dumps(detail),
+                'EventBusName': CELL_MANAGEMENT_BUS
+            }
+        ]
+    )
+
+    if eventbridge_response['FailedEntryCount'] != 0:
+        logger.error('Failed to send event to EventBridge: %s', eventbridge_response)
+        release_target_cell(target_cell_id, tenant_listener_priority)
+        ddb_table.update_item(
+            Key={'PK': source_cell_id + "#" + tenant_id},
+            UpdateExpression='SET current_status = :available REMOVE move_target_cell_id, move_id, move_target_listener_priority',
+            ExpressionAttributeValues={':available': 'available'}
+        )
+        return {
+            'statusCode': 500,
+            'body': json.dumps('Failed to send event to EventBridge')
+        }
+
+    response = {
+        'statusCode': 200,
+        'body': json.dumps({'TenantId': tenant_id, 'SourceCellId': source_cell_id, 'TargetCellId': target_cell_id,
+                            'MoveId': move_id, 'Status': 'moving'})
+    }
+    logger.info('Response: %s', response)
+    return response
+
+
+def reserve_target_cell(target_cell_id):
+    """Takes a place and the lowest free listener priority in the target cell, with an update conditional on
+    the cell's priority map being unchanged since it was read. Returns the cell as read and the priority,
+    None when the cell is unavailable, full or out of listener priorities."""
+    for _ in range(MAX_RESERVATION_ATTEMPTS):
+        target_cell = ddb_table.get_item(
+            Key={'PK': target_cell_id},
+            ProjectionExpression='PK, current_status, cell_utilization, cell_max_capacity, cell_size, ' + CELL_ATTRIBUTES,
+            ConsistentRead=True
+        ).get('Item')
+        if target_cell is None or target_cell.get('current_status') != 'available' or \
+                int(target_cell.get('cell_utilization', 0)) >= int(target_cell.get('cell_max_capacity', 0)):
+            return None
+        priorities = ListenerPriorities.from_cell(target_cell)
+        try:
+            tenant_listener_priority, = priorities.allocate()
+        except PrioritySpaceExhaustedError:
+            logger.error('Cell %s has no free listener priority', target_cell_id)
+            return None
+        set_clause, condition, values = priorities.expression()
+        values.update({':one': 1, ':available': 'available'})
+        try:
+            ddb_table.update_item(
+                Key={'PK': target_cell_id},
+                UpdateExpression='SET cell_utilization = cell_utilization + :one, ' + set_clause,
+                ConditionExpression='current_status = :available AND cell_utilization < cell_max_capacity AND ' + condition,
+                ExpressionAttributeValues=values
+            )
+            return target_cell, tenant_listener_priority
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info('Reservation in cell %s lost to a concurrent onboarding', target_cell_id)
+    return None
+
+
+def release_target_cell(target_cell_id, tenant_listener_priority):
+    # the tenant wasn't deployed into the target cell, its priority is free again right away
+    if not release_priorities(ddb_table, target_cell_id, [tenant_listener_priority], hold=False, places=1):
+        logger.error('Could not release the reservation in cell %s', target_cell_id)
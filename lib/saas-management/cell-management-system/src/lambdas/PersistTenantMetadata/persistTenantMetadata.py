@@ -4,6 +4,8 @@ import json
 import os
 import boto3
 import logging
+from botocore.exceptions import ClientError
+from listener_priority import release_priorities
 import json
 import boto3
 
@@ -79,45 +81,36 @@ def handler(event, context):
     else:
         stack_name = "Cell-" + detail.get("CELL_ID") + "-Tenant-" + detail.get("TENANT_ID")
 
-        tenent_update_response = ddb_table.update_item(
-            Key={
-                'PK': detail.get("CELL_ID")+"#"+detail.get("TENANT_ID")
-            },
-            UpdateExpression="set current_status = :cs, cf_stack = :cfs",
-            ExpressionAttributeValues={
-                ':cs': 'failed',
-                ':cfs': stack_name
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-
+        # only a tenant not marked failed yet gives back its place and listener priority, so a redelivered
+        # event doesn't; the failed tenant no longer holds the priority
         try:
-            ddb_response = ddb_table.get_item(
+            tenent_update_response = ddb_table.update_item(
                 Key={
-                    'PK': detail.get("CELL_ID")
-                }
+                    'PK': detail.get("CELL_ID")+"#"+detail.get("TENANT_ID")
+                },
+                UpdateExpression="set current_status = :cs, cf_stack = :cfs remove tenant_listener_priority",
+                ConditionExpression="attribute_exists(PK) AND current_status <> :cs",
+                ExpressionAttributeValues={
+                    ':cs': 'failed',
+                    ':cfs': stack_name
+                },
+                ReturnValues="ALL_OLD"
             )
-        except Exception as e:
-            logger.error(f"Error retrieving cell status: {str(e)}")
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info('Tenant %s already failed or not found', detail.get("TENANT_ID"))
             return {
-                'statusCode': 500,
-                'body': json.dumps('Error retrieving cell status')
+                'statusCode': 200,
+                'body': json.dumps({'status': 'tenant error processed'})
             }
 
-        if 'Item' in ddb_response:
-            item = ddb_response['Item']
-            cell_utilization = int(item.get('cell_utilization','0'))
-
-        cell_update_response = ddb_table.update_item(
-            Key={
-                'PK': detail.get("CELL_ID")
-            },
-            UpdateExpression="set cell_utilization = :cu",
-            ExpressionAttributeValues={
-                ':cu': cell_utilization - 1
-            },
-            ReturnValues="UPDATED_NEW"
-        )                          
+        # the place is given back with an atomic decrement, in the same conditional write as the priority; the
+        # build may have created the listener rule, so the priority is held before it is handed out again
+        priority = tenent_update_response.get('Attributes', {}).get('tenant_listener_priority')
+        if not release_priorities(ddb_table, detail.get("CELL_ID"), [priority] if priority else [], hold=True, places=1):
+            logger.error('Could not give back the place and listener priority %s of tenant %s in cell %s',
+                         priority, detail.get("TENANT_ID"), detail.get("CELL_ID"))
         return {
             'statusCode': 200,
             'body': json.dumps({'status': 'tenant error processed'})
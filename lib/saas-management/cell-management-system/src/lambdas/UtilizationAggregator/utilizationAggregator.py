@@ -0,0 +1,262 @@
+import os
+import time
+import boto3
+import logging
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from emf_batch import EmfBatch
+from table_sweep import parallel_scan
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CELL_MANAGEMENT_TABLE_NAME = os.environ.get('CELL_MANAGEMENT_TABLE_NAME')
+CELL_UTILIZATION_TABLE = os.environ.get('CELL_UTILIZATION_TABLE')
+
+# the states a tenant is counted in, an available tenant whose routing entry was removed is inactive
+TENANT_STATES = ('creating', 'available', 'inactive', 'moving', 'failed')
+COUNTERS = {state: 'tenants_' + state for state in TENANT_STATES}
+METRIC_NAMES = {state: 'Tenants' + state.capitalize() for state in TENANT_STATES}
+# tenants holding a place in their cell are also counted by tier, in a tier_<tier> counter
+CAPACITY_STATES = ('creating', 'available', 'inactive', 'moving')
+TIER_COUNTER_PREFIX = 'tier_'
+EMF_SERVICE_TYPE = "CellUtilizationAggregator"
+
+# stream sequence numbers are compared as zero padded strings, they have up to 40 digits
+SEQUENCE_NUMBER_WIDTH = 40
+# the sequence marker of a deleted tenant outlives the stream's 24 hour retention, then expires
+REMOVED_TENANT_MARKER_TTL_SECONDS = 7 * 24 * 3600
+BATCH_GET_LIMIT = 100
+
+dynamodb_client = boto3.client('dynamodb')
+deserializer = TypeDeserializer()
+
+def handler(event, context):
+    """Applies a batch of cell management table stream records to the per-cell tenant counters.
+    Every tenant has a sequence marker holding the last stream record applied for it, records at or below
+    it are skipped, so redelivered batches and retries after a partial failure are applied once. A tenant's
+    records in the batch are folded into one state change, applied together with its new marker in a
+    transaction. Tenants that fail are reported so Lambda retries from their first unapplied record."""
+    changes = collect_tenant_changes(event.get('Records', []))
+    markers = get_sequence_markers(list(changes))
+
+    failures = []
+    changed_cells = set()
+    for tenant_key, records in changes.items():
+        marker = markers.get(tenant_key)
+        pending = [record for record in records if marker is None or record['sequence'] > marker]
+        if not pending:
+            continue
+        old_counters = pending[0]['old']
+        new_counters = pending[-1]['new']
+        try:
+            apply_tenant_change(tenant_key, pending[0]['cell_id'], old_counters, new_counters, pending[-1]['sequence'], marker)
+        except ClientError as e:
+            logger.error('Error applying %s records of %s: %s', len(pending), tenant_key, e)
+            failures.append(pending[0]['streamSequence'])
+            continue
+        if old_counters != new_counters:
+            changed_cells.add(pending[0]['cell_id'])
+
+    if changed_cells:
+        emit_cell_metrics(get_cell_counters(changed_cells))
+
+    logger.info('Applied %s tenants, %s cells changed, %s failed', len(changes) - len(failures), len(changed_cells), len(failures))
+    return {'batchItemFailures': [{'itemIdentifier': sequence} for sequence in failures]}
+
+def reconcile_handler(event, context):
+    """Recounts every cell's tenants from the cell management table and corrects counters that drifted.
+    A counter is only overwritten if it still holds the value read before the recount, so a stream update
+    landing meanwhile is not lost; the cell is then left for the next reconcile."""
+    counts = {}
+    for item in parallel_scan(CELL_MANAGEMENT_TABLE_NAME,
+                              ProjectionExpression='PK, cell_id, current_status, routing_active, tenant_tier'):
+        if '#' not in item['PK']:
+            counts.setdefault(item['PK'], empty_counters())
+            continue
+        for counter in tenant_counters(item):
+            cell_counts = counts.setdefault(item['cell_id'], empty_counters())
+            cell_counts[counter] = cell_counts.get(counter, 0) + 1
+
+    counters = get_cell_counters(counts)
+    corrected = 0
+    for cell_id, cell_counts in counts.items():
+        current = counters.get(cell_id)
+        if current == cell_counts:
+            continue
+        try:
+            set_cell_counters(cell_id, cell_counts, current)
+            corrected += 1
+            logger.info('Corrected counters of cell %s from %s to %s', cell_id, current, cell_counts)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info('Counters of cell %s changed during the reconcile, leaving them for the next one', cell_id)
+
+    emit_cell_metrics(counts)
+    logger.info('Reconciled %s cells, corrected %s', len(counts), corrected)
+    return {'cells': len(counts), 'corrected': corrected}
+
+def tenant_state(item):
+    """The state a tenant item is counted in, None for items that aren't counted"""
+    if not item:
+        return None
+    status = item.get('current_status')
+    if status == 'available' and item.get('routing_active') is False:
+        return 'inactive'
+    return status if status in COUNTERS else None
+
+def tenant_counters(item):
+    """The counters a tenant item is counted in, its state's and, while it holds a place in the cell, its tier's"""
+    state = tenant_state(item)
+    if state is None:
+        return ()
+    if state not in CAPACITY_STATES:
+        return (COUNTERS[state],)
+    return (COUNTERS[state], TIER_COUNTER_PREFIX + (item.get('tenant_tier') or 'unspecified'))
+
+def empty_counters():
+    return dict.fromkeys(COUNTERS.values(), 0)
+
+def collect_tenant_changes(records):
+    """Groups the batch's tenant records by tenant, in stream order"""
+    changes = {}
+    for record in records:
+        stream_record = record['dynamodb']
+        tenant_key = stream_record['Keys']['PK']['S']
+        # cells carry no tenant counts, their records are skipped
+        if '#' not in tenant_key:
+            continue
+        old_image = deserialize(stream_record.get('OldImage'))
+        new_image = deserialize(stream_record.get('NewImage'))
+        changes.setdefault(tenant_key, []).append({
+            'streamSequence': stream_record['SequenceNumber'],
+            'sequence': stream_record['SequenceNumber'].zfill(SEQUENCE_NUMBER_WIDTH),
+            'cell_id': (new_image or old_image).get('cell_id', tenant_key.split('#')[0]),
+            'old': tenant_counters(old_image),
+            'new': tenant_counters(new_image),
+        })
+    return changes
+
+def deserialize(image):
+    if not image:
+        return None
+    return {key: deserializer.deserialize(value) for key, value in image.items()}
+
+def apply_tenant_change(tenant_key, cell_id, old_counters, new_counters, sequence, marker):
+    marker_update = {
+        'TableName': CELL_UTILIZATION_TABLE,
+        'Key': {'PK': {'S': tenant_key}},
+        'UpdateExpression': 'SET last_sequence_number = :sequence',
+        'ExpressionAttributeValues': {':sequence': {'S': sequence}},
+    }
+    if marker is None:
+        marker_update['ConditionExpression'] = 'attribute_not_exists(last_sequence_number)'
+    else:
+        marker_update['ConditionExpression'] = 'last_sequence_number = :marker'
+        marker_update['ExpressionAttributeValues'][':marker'] = {'S': marker}
+    if not new_counters:
+        marker_update['UpdateExpression'] += ', expires_at = :expires_at'
+        marker_update['ExpressionAttributeValues'][':expires_at'] = {'N': str(int(time.time()) + REMOVED_TENANT_MARKER_TTL_SECONDS)}
+    else:
+        marker_update['UpdateExpression'] += ' REMOVE expires_at'
+
+    transact_items = [{'Update': marker_update}]
+    deltas = {counter: -1 for counter in old_counters if counter not in new_counters}
+    deltas.update({counter: 1 for counter in new_counters if counter not in old_counters})
+    if deltas:
+        names = {}
+        values = {}
+        additions = []
+        for i, (counter, delta) in enumerate(deltas.items()):
+            # tier names come from tenant data, so counters are always referenced through names
+            names['#c{0}'.format(i)] = counter
+            value = ':increment' if delta > 0 else ':decrement'
+            values[value] = {'N': str(delta)}
+            additions.append('#c{0} {1}'.format(i, value))
+        transact_items.append({'Update': {
+            'TableName': CELL_UTILIZATION_TABLE,
+            'Key': {'PK': {'S': cell_id}},
+            'UpdateExpression': 'ADD ' + ', '.join(additions),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+        }})
+    dynamodb_client.transact_write_items(TransactItems=transact_items)
+
+def get_sequence_markers(tenant_keys):
+    items = batch_get(tenant_keys, 'PK, last_sequence_number')
+    return {key: item['last_sequence_number'] for key, item in items.items() if 'last_sequence_number' in item}
+
+def get_cell_counters(cell_ids):
+    """The counters of the given cells, keyed by counter attribute. Tier counters are read whole, as the
+    tiers aren't known up front, and left out when they are 0"""
+    items = batch_get(list(cell_ids))
+    counters = {}
+    for cell_id, item in items.items():
+        cell_counts = empty_counters()
+        for attribute, value in item.items():
+            if attribute in cell_counts or (attribute.startswith(TIER_COUNTER_PREFIX) and value):
+                cell_counts[attribute] = int(value)
+        counters[cell_id] = cell_counts
+    return counters
+
+def batch_get(keys, projection=None):
+    """Reads the items with the given PKs from the utilization table, keyed by PK"""
+    items = {}
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {CELL_UTILIZATION_TABLE: {
+            'Keys': [{'PK': {'S': key}} for key in keys[start:start + BATCH_GET_LIMIT]],
+            'ConsistentRead': True
+        }}
+        if projection:
+            request[CELL_UTILIZATION_TABLE]['ProjectionExpression'] = projection
+        while request:
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(CELL_UTILIZATION_TABLE, []):
+                item = deserialize(item)
+                items[item['PK']] = item
+            request = response.get('UnprocessedKeys')
+    return items
+
+def set_cell_counters(cell_id, counts, current):
+    """Sets the cell's counters to counts, removing tier counters that are no longer counted"""
+    attributes = list(counts) + [attribute for attribute in (current or {}) if attribute not in counts]
+    names = {'#c{0}'.format(i): attribute for i, attribute in enumerate(attributes)}
+    values = {}
+    sets = []
+    removes = []
+    for i, attribute in enumerate(attributes):
+        if attribute in counts:
+            values[':v{0}'.format(i)] = {'N': str(counts[attribute])}
+            sets.append('#c{0} = :v{0}'.format(i))
+        else:
+            removes.append('#c{0}'.format(i))
+    update = {
+        'TableName': CELL_UTILIZATION_TABLE,
+        'Key': {'PK': {'S': cell_id}},
+        'UpdateExpression': 'SET ' + ', '.join(sets) + (' REMOVE ' + ', '.join(removes) if removes else ''),
+        'ExpressionAttributeNames': names,
+    }
+    if current is None:
+        update['ConditionExpression'] = 'attribute_not_exists(PK)'
+    else:
+        conditions = []
+        for i, attribute in enumerate(attributes):
+            read = current.get(attribute, 0)
+            values[':r{0}'.format(i)] = {'N': str(read)}
+            # a counter never written reads as 0
+            if read == 0:
+                conditions.append('(attribute_not_exists(#c{0}) OR #c{0} = :r{0})'.format(i))
+            else:
+                conditions.append('#c{0} = :r{0}'.format(i))
+        update['ConditionExpression'] = ' AND '.join(conditions)
+    update['ExpressionAttributeValues'] = values
+    dynamodb_client.update_item(**update)
+
+def emit_cell_metrics(counters):
+    """Publishes the tenant counts by state, the counts by tier are published by the CapacityObserver"""
+    batch = EmfBatch(service_type=EMF_SERVICE_TYPE)
+    for cell_id, cell_counts in counters.items():
+        batch.add(dimensions={"CellId": cell_id},
+                  metrics={METRIC_NAMES[state]: cell_counts[attribute] for state, attribute in COUNTERS.items()})
+    batch.flush()
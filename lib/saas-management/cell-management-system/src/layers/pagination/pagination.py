@@ -0,0 +1,79 @@
+"""Continuation tokens for the control plane list APIs. A token carries the DynamoDB LastEvaluatedKey
+of the previous page and the listing it belongs to, signed with an HMAC so callers can't hand in keys
+of their own or resume a different listing with it."""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+
+import boto3
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '100'))
+
+secrets_client = boto3.client('secretsmanager')
+# read once per execution environment
+signing_key = None
+
+
+class InvalidPaginationError(Exception):
+    pass
+
+
+def get_page_size(query_parameters):
+    limit = (query_parameters or {}).get('Limit')
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidPaginationError('Limit must be a number')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise InvalidPaginationError('Limit must be between 1 and {0}'.format(MAX_PAGE_SIZE))
+    return limit
+
+
+def encode_token(last_evaluated_key, scope):
+    """Returns the NextToken for a page, None when it was the last one"""
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps({'s': scope, 'k': last_evaluated_key}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return '{0}.{1}'.format(__b64encode(payload), __b64encode(__sign(payload)))
+
+
+def decode_token(query_parameters, scope):
+    """Returns the ExclusiveStartKey for the NextToken in the query parameters, None when there is none"""
+    token = (query_parameters or {}).get('NextToken')
+    if not token:
+        return None
+    try:
+        encoded_payload, encoded_signature = token.split('.')
+        payload = __b64decode(encoded_payload)
+        signature = __b64decode(encoded_signature)
+    except (ValueError, binascii.Error):
+        raise InvalidPaginationError('Invalid NextToken')
+    if not hmac.compare_digest(signature, __sign(payload)):
+        raise InvalidPaginationError('Invalid NextToken')
+    data = json.loads(payload)
+    if data.get('s') != scope:
+        raise InvalidPaginationError('NextToken belongs to a different listing')
+    return data['k']
+
+
+def __sign(payload):
+    global signing_key
+    if signing_key is None:
+        secret = secrets_client.get_secret_value(SecretId=os.environ['PAGINATION_TOKEN_SECRET_ARN'])
+        signing_key = secret['SecretString'].encode('utf-8')
+    return hmac.new(signing_key, payload, hashlib.sha256).digest()
+
+
+def __b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def __b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
@@ -43,6 +43,10 @@ export class CdkNagUtils {
       {
         id: 'AwsSolutions-L1',
         reason: 'Ignoring, for stability of workshop'
+      },
+      {
+        id: 'AwsSolutions-SMG4',
+        reason: 'The pagination token signing key is not a credential, rotating it only invalidates NextTokens in flight.'
       }
     ]);
   }
@@ -3,6 +3,7 @@ import * as iam from 'aws-cdk-lib/aws-iam';
 import * as s3 from 'aws-cdk-lib/aws-s3';
 import { Construct } from 'constructs';
 import * as lambda from "aws-cdk-lib/aws-lambda";
+import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
 import * as codepipeline from 'aws-cdk-lib/aws-codepipeline';
 import * as codepipeline_actions from 'aws-cdk-lib/aws-codepipeline-actions';
 import * as codebuild from 'aws-cdk-lib/aws-codebuild';
@@ -56,6 +57,12 @@ export class AppPlaneStaggeredDeploymentsConstruct extends Construct {
       })
 
       
+      // parallel scan of the cell management table, shared by the fleet-wide sweeps
+      const tableSweepLayer = new lambda_python.PythonLayerVersion(this, 'TableSweepLayer', {
+        entry: 'lib/saas-management/src/layers/table-sweep',
+        compatibleRuntimes: [lambda.Runtime.PYTHON_3_13],
+      });
+
       const lambdaFunctionPrep = new lambda.Function(this, "prep-deploy", {
         handler: "lambda-prepare-deploy.lambda_handler",
         runtime: lambda.Runtime.PYTHON_3_13,
@@ -67,6 +74,7 @@ export class AppPlaneStaggeredDeploymentsConstruct extends Construct {
           CELL_MANAGEMENT_TABLE_NAME: props.cellManagementTable.tableName
         },
         initialPolicy: [lambdaPolicy],
+        layers: [tableSweepLayer],
         logRetention: logs.RetentionDays.ONE_DAY,        
       });
 
@@ -98,6 +106,7 @@ export class AppPlaneStaggeredDeploymentsConstruct extends Construct {
             "dynamodb:Query",
             "dynamodb:Scan",
             "dynamodb:GetItem",
+            "dynamodb:DescribeTable",
           ],
           resources: [
             `arn:aws:dynamodb:${props.region}:${props.account}:table/${props.cellManagementTable.tableName}`,
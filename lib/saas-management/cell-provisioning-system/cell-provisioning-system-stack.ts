@@ -1,14 +1,17 @@
-import { CfnOutput, Stack, StackProps, RemovalPolicy, Fn } from 'aws-cdk-lib';
-import { IntegrationPattern,JsonPath, Fail, Succeed, StateMachine, DefinitionBody, LogLevel } from 'aws-cdk-lib/aws-stepfunctions';
+import { CfnOutput, Stack, StackProps, RemovalPolicy, Fn, Duration } from 'aws-cdk-lib';
+import { IntegrationPattern,JsonPath, Fail, Succeed, StateMachine, DefinitionBody, LogLevel, TaskInput, Timeout, Choice, Condition } from 'aws-cdk-lib/aws-stepfunctions';
 import { CodeBuildStartBuild, LambdaInvoke } from 'aws-cdk-lib/aws-stepfunctions-tasks';
 import { Project, BuildSpec, Source, ComputeType, LinuxBuildImage } from 'aws-cdk-lib/aws-codebuild';
 import { SfnStateMachine } from 'aws-cdk-lib/aws-events-targets';
 import * as ecr from 'aws-cdk-lib/aws-ecr';
-import { Bucket } from 'aws-cdk-lib/aws-s3';
+import { Bucket, BlockPublicAccess, BucketEncryption } from 'aws-cdk-lib/aws-s3';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import { Key } from 'aws-cdk-lib/aws-kms';
+import { KeyValueStore } from 'aws-cdk-lib/aws-cloudfront';
 import { LambdaFunction  } from '../src/lambda-function-construct';
+import { Runtime } from 'aws-cdk-lib/aws-lambda';
+import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
 import * as events from 'aws-cdk-lib/aws-events';
 import { Table } from 'aws-cdk-lib/aws-dynamodb';
 import { LogGroup, RetentionDays} from 'aws-cdk-lib/aws-logs';
@@ -19,9 +22,11 @@ import { CdkNagUtils } from './src/utils/cdk-nag-utils'
 export interface CellProvisioningSystemProps extends StackProps {
   orchestrationBus: events.EventBus;
   cellManagementTable: Table;
+  tenantDirectoryTable: Table;
   s3LoggingBucketArn: string;
   s3CellSourceBucketArn: string;
   aggregateHttp5xxAlarmName: string;
+  cellToTenantKvsArn: string;
 }
 
 export class CellProvisioningSystem extends Stack {
@@ -58,6 +63,13 @@ export class CellProvisioningSystem extends Stack {
     // Add the policy to the repository
     repository.addToResourcePolicy(repositoryPolicyStatement);
 
+    // PgBouncer image of the cell connection brokers, mirrored by build-broker-image.sh
+    const brokerRepository = new ecr.Repository(this, `ConnectionBrokerRepo`, {
+      repositoryName: `connection-broker`,
+      removalPolicy: RemovalPolicy.DESTROY,
+      emptyOnDelete: true
+    });
+
     // Create a new KMS key
     const codeBuildCmk = new Key(this, 'CodeBuildEncryptionKey', {
       description: 'KMS key for CodeBuild project encryption',
@@ -83,7 +95,8 @@ export class CellProvisioningSystem extends Stack {
           },
           build: {
             commands: [
-              `./build-product-image.sh ${this.region} ${this.account}`
+              `./build-product-image.sh ${this.region} ${this.account}`,
+              `./build-broker-image.sh ${this.region} ${this.account}`
             ],
           },
           post_build: {
@@ -123,12 +136,15 @@ export class CellProvisioningSystem extends Stack {
           'ecr:PutImage',
           'ecr:GetAuthorizationToken',
           'ecr:UploadLayerPart',
-          'sts:GetCallerIdentity'
+          'sts:GetCallerIdentity',
+          // deploy-cell.sh runs the tenant schema migrations through the cell's TenantRDSInitializer
+          'lambda:InvokeFunction'
         ],
         resources: ['*'],
     }));
 
     repository.grantPullPush(productServiceProject);
+    brokerRepository.grantPullPush(productServiceProject);
 
     productServiceProject.addToRolePolicy(new iam.PolicyStatement({
         actions: [
@@ -343,6 +359,8 @@ export class CellProvisioningSystem extends Stack {
               'echo TENANT_EMAIL=$TENANT_EMAIL',
               'echo TENANT_LISTENER_PRIORITY=$TENANT_LISTENER_PRIORITY',
               'echo PRODUCT_IMAGE_VERSION=$PRODUCT_IMAGE_VERSION',
+              'echo TENANT_TIER=$TENANT_TIER',
+              'echo PRODUCT_WRITE_MODE=$PRODUCT_WRITE_MODE',
               'npm install -g typescript',
               'npm install -g aws-cdk',
               'cd cdk',
@@ -352,7 +370,7 @@ export class CellProvisioningSystem extends Stack {
           build: {
             commands: [
               'cd $CODEBUILD_SRC_DIR/scripts',
-              'source ./deploy-tenant.sh $CELL_ID $CELL_SIZE $TENANT_ID $TENANT_EMAIL $TENANT_LISTENER_PRIORITY $PRODUCT_IMAGE_VERSION',
+              'source ./deploy-tenant.sh $CELL_ID $CELL_SIZE $TENANT_ID $TENANT_EMAIL $TENANT_LISTENER_PRIORITY $PRODUCT_IMAGE_VERSION ${PRODUCT_WRITE_MODE:-direct} "$TENANT_TIER" "$TENANT_SECRET_NAME"',
               'cd $CODEBUILD_SRC_DIR/cdk',
               'STACK_OUTPUTS=$(<tenant_stack_outputs.json)',
             ],
@@ -450,7 +468,9 @@ export class CellProvisioningSystem extends Stack {
         TENANT_NAME: { value: JsonPath.stringAt('$.TenantName') },
         TENANT_EMAIL: { value: JsonPath.stringAt('$.TenantEmail') },
         TENANT_LISTENER_PRIORITY: { value: JsonPath.stringAt('$.TenantListenerPriority') },
-        PRODUCT_IMAGE_VERSION: { value: JsonPath.stringAt('$.ProductImageVersion') }
+        PRODUCT_IMAGE_VERSION: { value: JsonPath.stringAt('$.ProductImageVersion') },
+        TENANT_TIER: { value: JsonPath.stringAt('$.TenantTier') },
+        PRODUCT_WRITE_MODE: { value: JsonPath.stringAt('$.ProductWriteMode') }
       },
     }).addCatch(invokeTenantLambdaTaskOnFailure.next(tenantBuildFailed));
 
@@ -482,6 +502,167 @@ export class CellProvisioningSystem extends Stack {
             TenantEmail: events.EventField.fromPath('$.detail.tenant_email'),
             TenantListenerPriority: events.EventField.fromPath('$.detail.tenant_listener_priority'),
             ProductImageVersion: events.EventField.fromPath('$.detail.product_image_version'),
+            TenantTier: events.EventField.fromPath('$.detail.tenant_tier'),
+            ProductWriteMode: events.EventField.fromPath('$.detail.product_write_mode'),
+        })
+    }));
+
+    // ------- Tenant Moves -------- //
+
+    // Tenant data is handed from the source cell to the target cell through this bucket, the cells'
+    // TenantRDSInitializer functions read and write it with presigned urls
+    const tenantMoveBucket = new Bucket(this, 'TenantMoveBucket', {
+      encryption: BucketEncryption.S3_MANAGED,
+      blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+      enforceSSL: true,
+      serverAccessLogsBucket: logBucket,
+      serverAccessLogsPrefix: 'tenant-moves/',
+      lifecycleRules: [{ expiration: Duration.days(1) }],
+      removalPolicy: RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+    });
+
+    const cellToTenantKvs = KeyValueStore.fromKeyValueStoreArn(this, 'CellToTenantKvs', props.cellToTenantKvsArn);
+
+    const moveTenantRule = new events.Rule(this, 'MoveTenantRule', {
+        eventBus: props.orchestrationBus,
+        eventPattern: {
+          source: ['cellManagement.moveTenant'],
+          detailType: ['TenantMove'],
+        },
+    });
+
+    // the listener priority allocator, releasing the priorities of moved tenants
+    const listenerPriorityLayer = new lambda_python.PythonLayerVersion(this, 'ListenerPriorityLayer', {
+      entry: 'lib/saas-management/src/layers/listener-priority',
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+    });
+
+    const moveTenantDataLambda = new LambdaFunction(this, 'MoveTenantData', {
+      friendlyFunctionName: 'MoveTenantDataFunction',
+      index: 'moveTenantData.py',
+      entry: 'lib/saas-management/cell-provisioning-system/src/lambdas/MoveTenantData',
+      handler: 'handler',
+      timeout: Duration.minutes(15),
+      environmentVariables: {
+        CELL_MANAGEMENT_TABLE: props.cellManagementTable.tableArn,
+        CELL_ROUTER_KVS_ARN: cellToTenantKvs.keyValueStoreArn,
+        MOVE_BUCKET: tenantMoveBucket.bucketName,
+        TENANT_DIRECTORY_TABLE_NAME: props.tenantDirectoryTable.tableName
+      },
+      layers: [listenerPriorityLayer]
+    });
+
+    props.cellManagementTable.grantReadWriteData(moveTenantDataLambda.lambdaFunction);
+    props.tenantDirectoryTable.grantReadWriteData(moveTenantDataLambda.lambdaFunction);
+    tenantMoveBucket.grantReadWrite(moveTenantDataLambda.lambdaFunction);
+
+    moveTenantDataLambda.lambdaFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['cloudfront-keyvaluestore:PutKey','cloudfront-keyvaluestore:DescribeKeyValueStore'],
+      resources: [cellToTenantKvs.keyValueStoreArn],
+    }));
+
+    moveTenantDataLambda.lambdaFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['lambda:InvokeFunction'],
+      resources: [`arn:aws:lambda:${this.region}:${this.account}:function:*TenantRDSInitializer*`],
+    }));
+
+    // the tenant stacks are removed by CloudFormation with the CDK execution role they were deployed with
+    moveTenantDataLambda.lambdaFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['cloudformation:DescribeStacks', 'cloudformation:DeleteStack'],
+      resources: [`arn:aws:cloudformation:${this.region}:${this.account}:stack/Cell-*`],
+    }));
+
+    moveTenantDataLambda.lambdaFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['iam:PassRole'],
+      resources: ['arn:aws:iam::*:role/cdk-hnb659fds-cfn-exec-role-*'],
+    }));
+
+    // the tenant's users are copied from the source cell's user pool to the target cell's
+    moveTenantDataLambda.lambdaFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: [
+        'cognito-idp:ListUsersInGroup',
+        'cognito-idp:AdminGetUser',
+        'cognito-idp:AdminCreateUser',
+        'cognito-idp:AdminDisableUser',
+        'cognito-idp:AdminAddUserToGroup',
+        'cognito-idp:AdminDeleteUser'
+      ],
+      resources: [`arn:aws:cognito-idp:${this.region}:${this.account}:userpool/*`],
+    }));
+
+    // each invocation copies chunks of the tenant's data until it runs short of time and returns its
+    // progress, the state machine invokes it again with that progress until the move is complete
+    const moveTenantDataTask = new LambdaInvoke(this, 'MoveTenantDataTask', {
+      lambdaFunction: moveTenantDataLambda.lambdaFunction,
+      payload: TaskInput.fromObject({ action: 'move', move: JsonPath.entirePayload }),
+      payloadResponseOnly: true,
+      resultPath: '$.MoveProgress',
+      taskTimeout: Timeout.duration(Duration.minutes(15)),
+    });
+
+    const abortTenantMoveTask = new LambdaInvoke(this, 'AbortTenantMoveTask', {
+      lambdaFunction: moveTenantDataLambda.lambdaFunction,
+      payload: TaskInput.fromObject({ action: 'abort', move: JsonPath.entirePayload }),
+      outputPath: '$.Payload',
+    });
+
+    const tenantMoveSucceeded = new Succeed(this, 'Tenant Move Succeeded');
+    const tenantMoveFailed = new Fail(this, 'Tenant Move Failed', {
+      cause: 'Tenant move failed',
+    });
+    const abortTenantMove = abortTenantMoveTask.next(tenantMoveFailed);
+
+    // Deploy the tenant into the target cell, with a secret name of its own as the tenant still exists in the source cell
+    const startTenantMoveBuildTask = new CodeBuildStartBuild(this, 'StartTenantMoveDeployment', {
+      project: tenantMgtCodeBuild,
+      integrationPattern: IntegrationPattern.RUN_JOB,
+      resultPath: '$.TenantBuild',
+      environmentVariablesOverride: {
+        CELL_ID: { value: JsonPath.stringAt('$.TargetCellId') },
+        CELL_SIZE: { value: JsonPath.stringAt('$.TargetCellSize') },
+        TENANT_ID: { value: JsonPath.stringAt('$.TenantId') },
+        TENANT_EMAIL: { value: JsonPath.stringAt('$.TenantEmail') },
+        TENANT_LISTENER_PRIORITY: { value: JsonPath.stringAt('$.TenantListenerPriority') },
+        PRODUCT_IMAGE_VERSION: { value: JsonPath.stringAt('$.ProductImageVersion') },
+        TENANT_TIER: { value: JsonPath.stringAt('$.TenantTier') },
+        PRODUCT_WRITE_MODE: { value: JsonPath.stringAt('$.ProductWriteMode') },
+        TENANT_SECRET_NAME: { value: JsonPath.stringAt('$.TenantSecretName') }
+      },
+    }).addCatch(abortTenantMove, { resultPath: '$.Error' });
+
+    moveTenantDataTask.addCatch(abortTenantMove, { resultPath: '$.Error' });
+
+    const tenantMoveComplete = new Choice(this, 'Tenant Move Complete?')
+      .when(Condition.stringEquals('$.MoveProgress.state', 'IN_PROGRESS'), moveTenantDataTask)
+      .otherwise(tenantMoveSucceeded);
+
+    const moveTenantStateMachine = new StateMachine(this, 'MoveTenantStateMachine', {
+      definitionBody: DefinitionBody.fromChainable(startTenantMoveBuildTask.next(moveTenantDataTask).next(tenantMoveComplete)),
+      logs: { 
+        level: LogLevel.ALL,
+        destination: new LogGroup(this, 'MoveTenantStepFunctionLogGroup', {
+          retention: RetentionDays.ONE_WEEK,
+          removalPolicy: RemovalPolicy.DESTROY,
+        }),
+      },
+      tracingEnabled: true,
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
+
+    moveTenantRule.addTarget(new SfnStateMachine(moveTenantStateMachine, {
+        input: events.RuleTargetInput.fromObject({
+            MoveId: events.EventField.fromPath('$.detail.move_id'),
+            TenantId: events.EventField.fromPath('$.detail.tenant_id'),
+            SourceCellId: events.EventField.fromPath('$.detail.source_cell_id'),
+            TargetCellId: events.EventField.fromPath('$.detail.target_cell_id'),
+            TargetCellSize: events.EventField.fromPath('$.detail.target_cell_size'),
+            TenantEmail: events.EventField.fromPath('$.detail.tenant_email'),
+            TenantTier: events.EventField.fromPath('$.detail.tenant_tier'),
+            ProductWriteMode: events.EventField.fromPath('$.detail.product_write_mode'),
+            TenantListenerPriority: events.EventField.fromPath('$.detail.tenant_listener_priority'),
+            ProductImageVersion: events.EventField.fromPath('$.detail.product_image_version'),
+            TenantSecretName: events.EventField.fromPath('$.detail.tenant_secret_name'),
         })
     }));
 
@@ -0,0 +1,354 @@
+import json
+import os
+import time
+import logging
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from listener_priority import release_priorities
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CELL_MANAGEMENT_TABLE = os.environ.get('CELL_MANAGEMENT_TABLE')
+CELL_ROUTER_KVS_ARN = os.environ.get('CELL_ROUTER_KVS_ARN')
+MOVE_BUCKET = os.environ.get('MOVE_BUCKET')
+TENANT_DIRECTORY_TABLE_NAME = os.environ.get('TENANT_DIRECTORY_TABLE_NAME')
+# catch-up rounds run until a round moves fewer than MOVE_CATCH_UP_THRESHOLD products, so the
+# final round, the only one during which the tenant can't write, stays short
+MOVE_CATCH_UP_THRESHOLD = int(os.environ.get('MOVE_CATCH_UP_THRESHOLD', '100'))
+MAX_CATCH_UP_ROUNDS = int(os.environ.get('MAX_CATCH_UP_ROUNDS', '5'))
+# products per export and import, one chunk must fit the cells' TenantRDSInitializer timeout (5 minutes)
+MOVE_CHUNK_ROWS = int(os.environ.get('MOVE_CHUNK_ROWS', '50000'))
+# no chunk is started with less than this left, room for a chunk's export and import at their timeouts;
+# the move returns IN_PROGRESS and the state machine invokes it again to go on
+MOVE_TIME_RESERVE_MS = 600000
+PRESIGNED_URL_EXPIRY_SECONDS = 900
+KVS_PUT_RETRIES = 5
+
+dynamodb = boto3.resource('dynamodb')
+ddb_table = dynamodb.Table(CELL_MANAGEMENT_TABLE)
+dynamodb_client = boto3.client('dynamodb')
+lambda_client = boto3.client('lambda', config=Config(read_timeout=900, retries={'max_attempts': 0}))
+cloudformation_client = boto3.client('cloudformation')
+cognito_client = boto3.client('cognito-idp')
+s3_client = boto3.client('s3', config=Config(signature_version='s3v4'))
+kvs_client = boto3.session.Session().client('cloudfront-keyvaluestore', region_name='us-east-1')
+serializer = TypeSerializer()
+
+
+class TenantSwitchedError(Exception):
+    """Raised when the move fails after the tenant's routing entry already points to the target cell,
+    the move must then be completed rather than rolled back"""
+
+
+def handler(event, context):
+    """Invoked by the tenant move state machine once the tenant's stack is deployed into the target cell.
+    'move' copies the tenant's products from the source cell's database to the target cell's in chunks,
+    copies the tenant's users into the target cell's user pool, switches the tenant's routing entry and
+    retires the tenant in the source cell. A move that runs out of time returns IN_PROGRESS with its
+    progress, which the state machine passes back in as MoveProgress. 'abort' undoes a failed move."""
+    logger.info('Received event: %s', event)
+    move = event['move']
+    if event.get('action') == 'abort':
+        return abort_move(move)
+    return move_tenant(move, context)
+
+
+def move_tenant(move, context):
+    tenant_id = move['TenantId']
+    move_id = move['MoveId']
+    source_cell_id = move['SourceCellId']
+    target_cell_id = move['TargetCellId']
+    progress = move.get('MoveProgress') or {'phase': 'snapshot', 'rounds': []}
+
+    tenant = ddb_table.get_item(Key={'PK': source_cell_id + "#" + tenant_id}, ConsistentRead=True)['Item']
+    target_cell = ddb_table.get_item(Key={'PK': target_cell_id}, ConsistentRead=True)['Item']
+    source_outputs = get_cell_outputs(source_cell_id)
+    target_outputs = get_cell_outputs(target_cell_id)
+    source_function = find_cell_output(source_outputs, 'TenantRDSInitializerLambdaName', source_cell_id)
+    target_function = find_cell_output(target_outputs, 'TenantRDSInitializerLambdaName', target_cell_id)
+    source_pool = find_cell_output(source_outputs, 'CellUserPoolId', source_cell_id)
+    target_pool = find_cell_output(target_outputs, 'CellUserPoolId', target_cell_id)
+    source = {'tenantId': tenant_id, 'tenantSecretName': tenant.get('tenant_secret_name', tenant_id + 'Credentials')}
+    target = {'tenantId': tenant_id, 'tenantSecretName': move['TenantSecretName']}
+
+    while progress['phase'] != 'switch':
+        if context and context.get_remaining_time_in_millis() < MOVE_TIME_RESERVE_MS:
+            logger.info('Move %s of tenant %s continues in the next invocation: %s', move_id, tenant_id, progress)
+            return dict(progress, state='IN_PROGRESS')
+        copy_chunk(source_function, source, target_function, target, move, progress)
+        if progress['phase'] == 'final' and 'frozenAt' not in progress:
+            # users are copied before the freeze, the ones added since are picked up at the switch
+            progress['usersMigrated'] = migrate_tenant_users(source_pool, target_pool, tenant_id)
+
+    # the tenant can't write until its routing entry points to the target cell
+    progress['usersMigrated'] += migrate_tenant_users(source_pool, target_pool, tenant_id)
+    # a tenant deactivated during the move has no routing entry and stays deactivated in the target cell
+    tenant = ddb_table.get_item(Key={'PK': source_cell_id + "#" + tenant_id}, ConsistentRead=True)['Item']
+    if tenant.get('routing_active') is not False:
+        write_cell_routing_entry(tenant_id, target_cell['cell_url'])
+    freeze_window_ms = int(time.time() * 1000) - progress['frozenAt']
+    logger.info('Tenant %s switched to cell %s, writes were frozen for %sms', tenant_id, target_cell_id, freeze_window_ms)
+
+    try:
+        complete_move(move, tenant, target_cell)
+    except Exception as e:
+        raise TenantSwitchedError('Tenant {0} routes to cell {1} but the move could not be completed: {2}'.format(
+            tenant_id, target_cell_id, e))
+
+    # retire the tenant in the source cell, its database and roles go with the tenant stack
+    try:
+        invoke_rds_initializer(source_function, dict(source, tenantState='END-MOVE'))
+        remove_tenant_users(source_pool, tenant_id)
+        cloudformation_client.delete_stack(StackName=tenant.get('cf_stack', 'Cell-{0}-Tenant-{1}'.format(source_cell_id, tenant_id)))
+        # the listener rule goes with the stack, its priority is held until the deletion has had time to finish
+        if not release_priorities(ddb_table, source_cell_id, [tenant['tenant_listener_priority']], hold=True):
+            logger.error('Could not release listener priority %s in cell %s', tenant['tenant_listener_priority'], source_cell_id)
+    except Exception as e:
+        logger.error('Error retiring tenant %s in cell %s: %s', tenant_id, source_cell_id, e)
+
+    result = {
+        'state': 'COMPLETE',
+        'status': 'moved',
+        'tenantId': tenant_id,
+        'moveId': move_id,
+        'sourceCellId': source_cell_id,
+        'targetCellId': target_cell_id,
+        'freezeWindowMs': freeze_window_ms,
+        'usersMigrated': progress['usersMigrated'],
+        'rounds': progress['rounds']
+    }
+    logger.info('Move result: %s', json.dumps(result))
+    return result
+
+
+def copy_chunk(source_function, source, target_function, target, move, progress):
+    """Exports a chunk of the current phase from the source cell to S3, imports it into the target cell and
+    advances progress. A chunk of fewer than MOVE_CHUNK_ROWS rows ends its round, the chunks of a round are
+    added up in progress['rounds']. 'changes' rounds follow the snapshot, then 'final' freezes the tenant's
+    writes with its first chunk; once it's done progress['phase'] is 'switch'."""
+    phase = progress['phase']
+    after_product_id = progress.get('afterProductId')
+    export = {'tenantState': 'EXPORT-TENANT', 'phase': phase, 'chunkRows': MOVE_CHUNK_ROWS}
+    if phase == 'snapshot' and after_product_id is not None:
+        export['afterProductId'] = after_product_id
+    if phase == 'final' and 'frozenAt' not in progress:
+        export['freeze'] = True
+        progress['frozenAt'] = int(time.time() * 1000)
+
+    key = 'moves/{0}/{1}/{2}-{3}.csv.gz'.format(move['TenantId'], move['MoveId'], phase, int(time.time() * 1000))
+    upload_url = s3_client.generate_presigned_url('put_object', Params={'Bucket': MOVE_BUCKET, 'Key': key},
+                                                  ExpiresIn=PRESIGNED_URL_EXPIRY_SECONDS)
+    download_url = s3_client.generate_presigned_url('get_object', Params={'Bucket': MOVE_BUCKET, 'Key': key},
+                                                    ExpiresIn=PRESIGNED_URL_EXPIRY_SECONDS)
+    exported = invoke_rds_initializer(source_function, dict(source, uploadUrl=upload_url, **export))
+    imported = invoke_rds_initializer(target_function, dict(target, tenantState='IMPORT-TENANT', phase=phase, downloadUrl=download_url,
+                                                            truncate=phase == 'snapshot' and after_product_id is None))
+    logger.info('Moved a %s chunk of tenant %s: %s rows, %s bytes', phase, move['TenantId'], exported['rows'], exported['bytes'])
+
+    rounds = progress['rounds']
+    if not progress.get('roundOpen'):
+        rounds.append({'phase': phase, 'chunks': 0, 'rows': 0, 'bytes': 0, 'exportMs': 0, 'importMs': 0})
+    current = rounds[-1]
+    current['chunks'] += 1
+    current['rows'] += exported['rows']
+    current['bytes'] += exported['bytes']
+    current['exportMs'] += exported['durationMs']
+    current['importMs'] += imported['durationMs']
+
+    progress['roundOpen'] = exported['rows'] >= MOVE_CHUNK_ROWS
+    if progress['roundOpen']:
+        if phase == 'snapshot':
+            progress['afterProductId'] = exported['lastProductId']
+        return
+    progress.pop('afterProductId', None)
+    if phase == 'final':
+        progress['phase'] = 'switch'
+    elif current['rows'] >= MOVE_CATCH_UP_THRESHOLD and len(rounds) <= MAX_CATCH_UP_ROUNDS:
+        progress['phase'] = 'changes'
+    else:
+        progress['phase'] = 'final'
+
+
+def migrate_tenant_users(source_pool, target_pool, tenant_id):
+    """Creates the users of the tenant's group in the source cell's user pool that the target cell's pool
+    doesn't have yet, with the same username and attributes, and adds them to the tenant's group there.
+    Passwords can't be read from a user pool, so Cognito invites the users by email with a temporary
+    password; users disabled in the source stay disabled. The tenant admin was already created in the
+    target cell with the tenant's stack. Returns the number of users created."""
+    existing = {user['Username'] for user in list_tenant_users(target_pool, tenant_id)}
+    migrated = 0
+    for user in list_tenant_users(source_pool, tenant_id):
+        if user['Username'] in existing:
+            continue
+        attributes = [attribute for attribute in user.get('Attributes', [])
+                      if attribute['Name'] not in ('sub', 'identities')]
+        enabled = user.get('Enabled', True)
+        invite = {'DesiredDeliveryMediums': ['EMAIL']} if enabled else {'MessageAction': 'SUPPRESS'}
+        try:
+            cognito_client.admin_create_user(UserPoolId=target_pool, Username=user['Username'], UserAttributes=attributes, **invite)
+            if not enabled:
+                cognito_client.admin_disable_user(UserPoolId=target_pool, Username=user['Username'])
+            migrated += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'UsernameExistsException':
+                raise
+            # created by an earlier invocation of this move but not added to the group yet, unless the
+            # username belongs to a user of another tenant of the target cell
+            existing_user = cognito_client.admin_get_user(UserPoolId=target_pool, Username=user['Username'])
+            if {'Name': 'custom:tenantId', 'Value': tenant_id} not in existing_user.get('UserAttributes', []):
+                raise Exception('User {0} of tenant {1} is taken by another tenant in user pool {2}'.format(
+                    user['Username'], tenant_id, target_pool))
+        cognito_client.admin_add_user_to_group(UserPoolId=target_pool, Username=user['Username'], GroupName=tenant_id)
+    logger.info('Created %s users of tenant %s in user pool %s', migrated, tenant_id, target_pool)
+    return migrated
+
+
+def remove_tenant_users(user_pool, tenant_id):
+    """Deletes the users of the tenant's group from the user pool, except the tenant admin, which goes with
+    the tenant's stack"""
+    for user in list_tenant_users(user_pool, tenant_id):
+        if user['Username'] != 'tenantadmin-' + tenant_id:
+            cognito_client.admin_delete_user(UserPoolId=user_pool, Username=user['Username'])
+
+
+def list_tenant_users(user_pool, tenant_id):
+    users = []
+    paginator = cognito_client.get_paginator('list_users_in_group')
+    for page in paginator.paginate(UserPoolId=user_pool, GroupName=tenant_id):
+        users.extend(page.get('Users', []))
+    return users
+
+
+def complete_move(move, tenant, target_cell):
+    """Moves the tenant item to the target cell, points the tenant directory at it and releases the tenant's
+    slot in the source cell in one transaction. The target cell's slot was reserved when the move was
+    requested."""
+    tenant_id = move['TenantId']
+    target_cell_id = move['TargetCellId']
+    build_outputs = {item['Name']: item['Value'] for item in move['TenantBuild']['Build']['ExportedEnvironmentVariables']}
+    stack_name = 'Cell-{0}-Tenant-{1}'.format(target_cell_id, tenant_id)
+    stack_outputs = json.loads(build_outputs['STACK_OUTPUTS'])
+
+    item = {key: value for key, value in tenant.items()
+            if key not in ('move_target_cell_id', 'move_id', 'move_target_listener_priority')}
+    item.update({
+        'PK': target_cell_id + "#" + tenant_id,
+        'cell_id': target_cell_id,
+        'current_status': 'available',
+        'routing_active': tenant.get('routing_active') is not False,
+        'tenant_listener_priority': move['TenantListenerPriority'],
+        'tenant_secret_name': move['TenantSecretName'],
+        'cf_stack': stack_name,
+        'cf_metadata': json.dumps(stack_outputs[stack_name]),
+        'moved_from_cell_id': move['SourceCellId'],
+        'moved_at': int(time.time())
+    })
+    table_name = CELL_MANAGEMENT_TABLE.split('/')[-1]
+    dynamodb_client.transact_write_items(TransactItems=[
+        {'Put': {
+            'TableName': table_name,
+            'Item': {key: serializer.serialize(value) for key, value in item.items()},
+            'ConditionExpression': 'attribute_not_exists(PK)'
+        }},
+        {'Delete': {
+            'TableName': table_name,
+            'Key': {'PK': {'S': move['SourceCellId'] + "#" + tenant_id}},
+            'ConditionExpression': 'current_status = :moving',
+            'ExpressionAttributeValues': {':moving': {'S': 'moving'}}
+        }},
+        {'Update': {
+            'TableName': table_name,
+            'Key': {'PK': {'S': move['SourceCellId']}},
+            'UpdateExpression': 'SET cell_utilization = cell_utilization - :one',
+            'ExpressionAttributeValues': {':one': {'N': '1'}}
+        }},
+        {'Update': {
+            'TableName': TENANT_DIRECTORY_TABLE_NAME,
+            'Key': {'tenant_id': {'S': tenant_id}},
+            'UpdateExpression': 'SET cell_id = :target',
+            # a tenant the backfill hasn't reached yet has no entry
+            'ConditionExpression': 'attribute_not_exists(tenant_id) OR cell_id = :source',
+            'ExpressionAttributeValues': {':target': {'S': target_cell_id}, ':source': {'S': move['SourceCellId']}}
+        }}
+    ])
+
+
+def abort_move(move):
+    """Rolls back a move that failed before the tenant was switched: the source cell gets the tenant's writes
+    back, the target cell's reservation is released and the tenant's stack in the target cell is removed"""
+    tenant_id = move['TenantId']
+    source_cell_id = move['SourceCellId']
+    target_cell_id = move['TargetCellId']
+    error = move.get('Error', {})
+    logger.error('Move %s of tenant %s failed: %s', move['MoveId'], tenant_id, error)
+
+    if error.get('Error') == TenantSwitchedError.__name__:
+        # the target cell already serves the tenant, rolling back would lose its writes since the switch
+        return {'status': 'switched', 'tenantId': tenant_id, 'targetCellId': target_cell_id}
+
+    try:
+        tenant = ddb_table.get_item(Key={'PK': source_cell_id + "#" + tenant_id}, ConsistentRead=True)['Item']
+        source_outputs = get_cell_outputs(source_cell_id)
+        invoke_rds_initializer(find_cell_output(source_outputs, 'TenantRDSInitializerLambdaName', source_cell_id), {
+            'tenantId': tenant_id,
+            'tenantSecretName': tenant.get('tenant_secret_name', tenant_id + 'Credentials'),
+            'tenantState': 'END-MOVE',
+            'unfreeze': True
+        })
+    except Exception as e:
+        logger.error('Error restoring tenant %s in cell %s: %s', tenant_id, source_cell_id, e)
+
+    # the tenant's stack in the target cell may have deployed its listener rule, the priority is held
+    if not release_priorities(ddb_table, target_cell_id, [move['TenantListenerPriority']], hold=True, places=1):
+        logger.error('Could not release the reservation of tenant %s in cell %s', tenant_id, target_cell_id)
+    ddb_table.update_item(
+        Key={'PK': source_cell_id + "#" + tenant_id},
+        UpdateExpression='SET current_status = :available REMOVE move_target_cell_id, move_id, move_target_listener_priority',
+        ExpressionAttributeValues={':available': 'available'}
+    )
+    # the users copied into the target cell's pool, its tenant admin goes with the tenant's stack
+    try:
+        remove_tenant_users(find_cell_output(get_cell_outputs(target_cell_id), 'CellUserPoolId', target_cell_id), tenant_id)
+    except Exception as e:
+        logger.error('Error removing the users of tenant %s from cell %s: %s', tenant_id, target_cell_id, e)
+    cloudformation_client.delete_stack(StackName='Cell-{0}-Tenant-{1}'.format(target_cell_id, tenant_id))
+    return {'status': 'aborted', 'tenantId': tenant_id, 'sourceCellId': source_cell_id}
+
+
+def get_cell_outputs(cell_id):
+    return cloudformation_client.describe_stacks(StackName='Cell-' + cell_id)['Stacks'][0].get('Outputs', [])
+
+
+def find_cell_output(outputs, name, cell_id):
+    """Returns a cell stack output, e.g. the name of the cell's TenantRDSInitializer function or its user
+    pool id, by its export name <name>-<cell_id>"""
+    for output in outputs:
+        if name in output['OutputKey'] or output.get('ExportName') == name + '-' + cell_id:
+            return output['OutputValue']
+    raise Exception('{0} not found in the outputs of Cell-{1}'.format(name, cell_id))
+
+
+def invoke_rds_initializer(function_name, payload):
+    response = lambda_client.invoke(FunctionName=function_name, Payload=json.dumps(payload))
+    result = json.loads(response['Payload'].read())
+    if response.get('FunctionError') or not isinstance(result, dict) or result.get('status') == 'ERROR':
+        raise Exception('{0} failed for tenant {1}: {2}'.format(payload['tenantState'], payload['tenantId'], result))
+    return result
+
+
+def write_cell_routing_entry(tenant_id, url):
+    """Points the tenant's routing entry to the cell url. Unlike activating a tenant the switch must not
+    be lost, so a concurrent write to the key value store is retried with the new ETag."""
+    for attempt in range(KVS_PUT_RETRIES):
+        etag = kvs_client.describe_key_value_store(KvsARN=CELL_ROUTER_KVS_ARN)['ETag']
+        try:
+            kvs_client.put_key(Key=tenant_id, Value=url, KvsARN=CELL_ROUTER_KVS_ARN, IfMatch=etag)
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('ConflictException', 'ValidationException') or attempt == KVS_PUT_RETRIES - 1:
+                raise
+            logger.info('Key value store changed concurrently, retrying with the new ETag')
+            time.sleep(0.2 * (attempt + 1))
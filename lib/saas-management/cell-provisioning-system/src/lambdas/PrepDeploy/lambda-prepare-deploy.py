@@ -6,12 +6,12 @@ import boto3
 import simplejson as json
 import zipfile
 import traceback
+from table_sweep import parallel_scan
 
 print('Loading function')
 s3 = boto3.client('s3')
 code_pipeline = boto3.client('codepipeline')
-dynamodb = boto3.resource('dynamodb')
-cell_management_table_name = dynamodb.Table(os.environ['CELL_MANAGEMENT_TABLE_NAME'])
+cell_management_table_name = os.environ['CELL_MANAGEMENT_TABLE_NAME']
 
 def find_artifact(artifacts, name):
     """Finds the artifact 'name' among the 'artifacts'
@@ -135,15 +135,19 @@ def lambda_handler(event, context):
         output_artifact = job_data['outputArtifacts'][0]
 
         # Get all the stacks for each tenant to be updated/created from tenant stack mapping table
-        mappings = cell_management_table_name.scan()
-        print('mappings success: ', mappings)
+        # every page of the table is read, the segments in parallel
+        mappings = parallel_scan(
+            cell_management_table_name,
+            ProjectionExpression='PK, cf_stack, wave_number, cell_size, cell_id, tenant_id, tenant_email, '
+                                 'tenant_listener_priority, tenant_tier, tenant_secret_name, product_write_mode'
+        )
         output_bucket = output_artifact['location']['s3Location']['bucketName']
         output_key = output_artifact['location']['s3Location']['objectKey']
         cellStacks = []
         tenantStacks = []
 
         # Create array to pass to step function
-        for mapping in mappings['Items']:
+        for mapping in mappings:
             if 'cell_id' not in mapping:
                 stack = mapping['cf_stack']
                 cellId = mapping['PK']
@@ -168,6 +172,9 @@ def lambda_handler(event, context):
                         "cellSize": mapping['cell_size'],
                         "tenantEmail": mapping['tenant_email'],
                         "tenantListenerPriority": mapping['tenant_listener_priority'],
+                        "tenantTier": mapping.get('tenant_tier', ''),
+                        "productWriteMode": mapping.get('product_write_mode', 'direct'),
+                        "tenantSecretName": mapping.get('tenant_secret_name', ''),
                         "productImageVersion": product_image_version
                     }
                 )                
@@ -186,6 +193,9 @@ def lambda_handler(event, context):
                         "cellSize": item["cellSize"],
                         "tenantEmail": item["tenantEmail"],
                         "tenantListenerPriority": str(item["tenantListenerPriority"]),
+                        "tenantTier": item["tenantTier"],
+                        "productWriteMode": item["productWriteMode"],
+                        "tenantSecretName": item["tenantSecretName"],
                         "productImageVersion": item["productImageVersion"]
                     })
             cells["tenantsInCell"] = tenantsInCell                        
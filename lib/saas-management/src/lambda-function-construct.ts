@@ -1,5 +1,5 @@
-import { RemovalPolicy } from 'aws-cdk-lib';
-import { Function, Runtime }  from 'aws-cdk-lib/aws-lambda';
+import { Duration, RemovalPolicy } from 'aws-cdk-lib';
+import { Function, ILayerVersion, Runtime }  from 'aws-cdk-lib/aws-lambda';
 import { Role, Policy, ServicePrincipal, PolicyStatement, Effect } from 'aws-cdk-lib/aws-iam';
 import { Construct } from 'constructs';
 import { LogGroup, RetentionDays } from "aws-cdk-lib/aws-logs";
@@ -11,6 +11,8 @@ export interface LambdaFunctionProps {
   entry: string 
   handler: string    
   environmentVariables?: {[key: string]: string}
+  layers?: ILayerVersion[]
+  timeout?: Duration
 }
 
 export class LambdaFunction extends Construct {
@@ -51,6 +53,8 @@ export class LambdaFunction extends Construct {
       handler: props.handler,
       index: props.index,
       logGroup: logGroup,
+      layers: props.layers,
+      timeout: props.timeout,
       environment: {
         ...props.environmentVariables
       },
@@ -0,0 +1,49 @@
+"""Embedded metric format (EMF) output for the control plane functions. An EMF document holds one value
+per dimension, so every dimension value combination needs a document of its own; EmfBatch keeps the
+documents to the required fields and writes all of an invocation's documents in one write and flush."""
+
+import json
+import sys
+import time
+
+EMF_NAMESPACE = "CellManagement"
+
+
+class EmfBatch:
+    """Collects EMF documents sharing a timestamp and writes them with a single write and flush"""
+
+    def __init__(self, sink=None, namespace=EMF_NAMESPACE, unit="Count", service_type=None):
+        self.sink = sink or sys.stdout
+        self.namespace = namespace
+        self.unit = unit
+        self.service_type = service_type
+        self.timestamp = int(time.time() * 1000)
+        self.documents = []
+
+    def add(self, dimensions, metrics, units=None):
+        """Adds a document for one dimension value set. units maps metric names to a unit other than
+        the batch's own"""
+        units = units or {}
+        document = {
+            "_aws": {
+                "Timestamp": self.timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": units.get(name, self.unit)} for name in metrics]
+                }]
+            }
+        }
+        if self.service_type:
+            document["ServiceType"] = self.service_type
+        document.update(dimensions)
+        document.update(metrics)
+        self.documents.append(json.dumps(document, separators=(',', ':')))
+
+    def flush(self):
+        count = len(self.documents)
+        if count:
+            self.sink.write('\n'.join(self.documents) + '\n')
+            self.sink.flush()
+            self.documents = []
+        return count
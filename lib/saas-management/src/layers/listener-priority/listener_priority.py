@@ -0,0 +1,192 @@
+"""Allocation of the ALB listener rule priorities of a cell's tenants. Every tenant's rule needs a priority
+unique on the cell's listener; the priorities in use are kept on the cell item as a bitmap of slots, slot s
+being priority s * PRIORITY_STEP, so a priority freed when a tenant leaves the cell is handed out again.
+Allocation takes the lowest free slots, which keeps the priorities in use packed at the bottom of the range.
+
+The map is versioned: callers read the cell, change the map and write it back with their own update,
+conditional on the version read, and read again when a concurrent writer won. A slot whose listener rule may
+still exist, because the tenant's stack is being deleted, is held for REUSE_DELAY_SECONDS before it is free.
+defragment rebuilds the map from the priorities the cell's tenant items hold, reclaiming slots leaked by
+failed releases and those of cells allocated from tenant_priority_counter before the map existed."""
+
+import os
+import time
+
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+# the gap leaves room for rules inserted between tenants' rules
+PRIORITY_STEP = 10
+# tenant rules sit between the cell's health rule (priority 1) and its default rule (priority 50000)
+MAX_SLOTS = 49999 // PRIORITY_STEP
+REUSE_DELAY_SECONDS = int(os.getenv('LISTENER_PRIORITY_REUSE_DELAY_SECONDS', '900'))
+MAX_ATTEMPTS = 5
+
+# the cell attributes ListenerPriorities.from_cell reads
+CELL_ATTRIBUTES = 'listener_priority_bitmap, listener_priority_held, listener_priority_version, tenant_priority_counter'
+
+
+class PrioritySpaceExhaustedError(Exception):
+    """The cell has fewer free listener priorities than requested"""
+
+
+class ListenerPriorities:
+    """A cell's listener priority map: bitmap marks the slots that can't be allocated, those in use and those
+    held, held maps held slots to the time they were released"""
+
+    def __init__(self, bitmap=b'', held=None, version=None):
+        self.bitmap = bytearray(bitmap)
+        self.held = dict(held or {})
+        self.version = version
+
+    @classmethod
+    def from_cell(cls, cell):
+        """The map of a cell item as read with CELL_ATTRIBUTES. A cell the allocator hasn't written yet got its
+        priorities from tenant_priority_counter, every slot up to the counter is taken as in use"""
+        version = cell.get('listener_priority_version')
+        if version is None:
+            priorities = cls()
+            counter = int(cell.get('tenant_priority_counter') or 0)
+            priorities.mark(range(1, min(counter // PRIORITY_STEP, MAX_SLOTS) + 1))
+            return priorities
+        bitmap = cell.get('listener_priority_bitmap') or b''
+        if isinstance(bitmap, Binary):
+            bitmap = bitmap.value
+        held = {int(slot): int(released_at) for slot, released_at in (cell.get('listener_priority_held') or {}).items()}
+        return cls(bitmap, held, int(version))
+
+    def is_set(self, slot):
+        index, bit = divmod(slot - 1, 8)
+        return index < len(self.bitmap) and self.bitmap[index] & (1 << bit) != 0
+
+    def mark(self, slots):
+        for slot in slots:
+            index, bit = divmod(slot - 1, 8)
+            if index >= len(self.bitmap):
+                self.bitmap.extend(bytes(index + 1 - len(self.bitmap)))
+            self.bitmap[index] |= 1 << bit
+
+    def clear(self, slots):
+        for slot in slots:
+            index, bit = divmod(slot - 1, 8)
+            if index < len(self.bitmap):
+                self.bitmap[index] &= ~(1 << bit) & 0xFF
+        # trailing free slots aren't stored
+        while self.bitmap and self.bitmap[-1] == 0:
+            self.bitmap.pop()
+
+    def expire_held(self, now=None):
+        """Frees the held slots whose delay has passed"""
+        now = int(time.time()) if now is None else now
+        expired = [slot for slot, released_at in self.held.items() if now - released_at >= REUSE_DELAY_SECONDS]
+        for slot in expired:
+            del self.held[slot]
+        self.clear(expired)
+
+    def in_use(self):
+        """The priorities allocated to tenants, held ones excluded"""
+        return [slot * PRIORITY_STEP for slot in range(1, len(self.bitmap) * 8 + 1)
+                if slot not in self.held and self.is_set(slot)]
+
+    def free_count(self, now=None):
+        self.expire_held(now)
+        return MAX_SLOTS - sum(bin(byte).count('1') for byte in self.bitmap)
+
+    def allocate(self, count=1, now=None):
+        """Takes the count lowest free slots, returns their priorities"""
+        self.expire_held(now)
+        slots = []
+        for index, byte in enumerate(self.bitmap + bytes(1)):
+            if byte == 0xFF:
+                continue
+            for bit in range(8):
+                slot = index * 8 + bit + 1
+                if len(slots) == count or slot > MAX_SLOTS:
+                    break
+                if byte & (1 << bit) == 0:
+                    slots.append(slot)
+            if len(slots) == count:
+                break
+        # slots past the stored bitmap are all free
+        next_slot = len(self.bitmap) * 8 + 9
+        while len(slots) < count and next_slot <= MAX_SLOTS:
+            slots.append(next_slot)
+            next_slot += 1
+        if len(slots) < count:
+            raise PrioritySpaceExhaustedError('{} listener priorities requested, {} free'.format(count, len(slots)))
+        self.mark(slots)
+        return [slot * PRIORITY_STEP for slot in slots]
+
+    def release(self, priorities, hold=True, now=None):
+        """Returns the priorities to the free slots. With hold the slots are only allocated again after
+        REUSE_DELAY_SECONDS, for priorities whose listener rule may still be in place"""
+        now = int(time.time()) if now is None else now
+        slots = [int(priority) // PRIORITY_STEP for priority in priorities
+                 if int(priority) % PRIORITY_STEP == 0 and 0 < int(priority) // PRIORITY_STEP <= MAX_SLOTS]
+        if hold:
+            self.held.update({slot: now for slot in slots if self.is_set(slot)})
+        else:
+            for slot in slots:
+                self.held.pop(slot, None)
+            self.clear(slots)
+
+    def expression(self):
+        """The SET clause writing the map, the condition that the version is still the one read and their
+        values, for the caller's update of the cell item"""
+        values = {
+            ':lp_bitmap': bytes(self.bitmap),
+            ':lp_held': {str(slot): released_at for slot, released_at in self.held.items()},
+            ':lp_version': (self.version or 0) + 1,
+        }
+        if self.version is None:
+            condition = 'attribute_not_exists(listener_priority_version)'
+        else:
+            condition = 'listener_priority_version = :lp_read'
+            values[':lp_read'] = self.version
+        set_clause = ('listener_priority_bitmap = :lp_bitmap, listener_priority_held = :lp_held, '
+                      'listener_priority_version = :lp_version')
+        return set_clause, condition, values
+
+
+def release_priorities(table, cell_id, priorities, hold=True, places=0, max_attempts=MAX_ATTEMPTS):
+    """Releases the priorities in the cell and gives back that many tenant places in the same conditional
+    write, through the boto3 Table resource. Returns False when the cell is gone or kept changing"""
+    for _ in range(max_attempts):
+        cell = table.get_item(Key={'PK': cell_id}, ProjectionExpression=CELL_ATTRIBUTES + ', PK',
+                              ConsistentRead=True).get('Item')
+        if cell is None:
+            return False
+        state = ListenerPriorities.from_cell(cell)
+        state.release(priorities, hold)
+        set_clause, condition, values = state.expression()
+        if places:
+            set_clause += ', cell_utilization = cell_utilization - :places'
+            values[':places'] = places
+        try:
+            table.update_item(
+                Key={'PK': cell_id},
+                UpdateExpression='SET ' + set_clause,
+                ConditionExpression='attribute_exists(PK) AND ' + condition,
+                ExpressionAttributeValues=values
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return False
+
+
+def defragment(cell, tenant_priorities, now=None):
+    """The cell's map rebuilt from the priorities its tenants hold, keeping the slots still held, or None
+    when it is unchanged. The caller writes it conditional on the version read with the cell, which must
+    have been read before the tenants"""
+    current = ListenerPriorities.from_cell(cell)
+    current.expire_held(now)
+    rebuilt = ListenerPriorities(version=current.version)
+    rebuilt.mark(int(priority) // PRIORITY_STEP for priority in tenant_priorities
+                 if int(priority) % PRIORITY_STEP == 0 and 0 < int(priority) // PRIORITY_STEP <= MAX_SLOTS)
+    rebuilt.held = {slot: released_at for slot, released_at in current.held.items() if not rebuilt.is_set(slot)}
+    rebuilt.mark(rebuilt.held)
+    if current.version is not None and rebuilt.bitmap == current.bitmap and rebuilt.held == current.held:
+        return None
+    return rebuilt
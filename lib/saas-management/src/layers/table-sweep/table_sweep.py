@@ -0,0 +1,75 @@
+"""Fleet-wide sweeps of the cell management table. parallel_scan splits the table into segments that
+are scanned concurrently (DynamoDB parallel scan), so a sweep takes about as long as its slowest segment
+rather than as long as reading every page in turn. Items are yielded as soon as their page arrives."""
+
+import math
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+# one segment per this many bytes of table, up to MAX_SEGMENTS; DynamoDB returns at most 1 MB per page,
+# so a segment takes a handful of round trips whatever the table size
+SEGMENT_SIZE_BYTES = int(os.getenv('SWEEP_SEGMENT_SIZE_BYTES', str(4 * 1024 * 1024)))
+MAX_SEGMENTS = int(os.getenv('SWEEP_MAX_SEGMENTS', '16'))
+
+# boto3 clients are thread safe, resources are not, so every segment uses the same client
+dynamodb_client = boto3.client('dynamodb')
+deserializer = TypeDeserializer()
+
+_SEGMENT_DONE = object()
+
+
+def get_total_segments(table_name, max_segments=MAX_SEGMENTS, client=None):
+    """Picks the segment count from the table size DynamoDB reports (refreshed about every six hours)"""
+    client = client or dynamodb_client
+    size_bytes = client.describe_table(TableName=table_name)['Table'].get('TableSizeBytes', 0)
+    return max(1, min(max_segments, math.ceil(size_bytes / SEGMENT_SIZE_BYTES)))
+
+
+def parallel_scan(table_name, total_segments=None, max_segments=MAX_SEGMENTS, client=None, **scan_kwargs):
+    """Yields every item of the table, deserialized like the boto3 Table resource does. scan_kwargs are
+    passed to every Scan call in the low-level client's format (e.g. ProjectionExpression,
+    ExpressionAttributeNames). Items of different segments interleave, so callers must not rely on order.
+    Leaving the loop early stops the remaining segments after their current page."""
+    client = client or dynamodb_client
+    if total_segments is None:
+        total_segments = get_total_segments(table_name, max_segments, client)
+
+    pages = queue.Queue()
+    stopped = threading.Event()
+
+    def scan_segment(segment):
+        kwargs = dict(scan_kwargs, TableName=table_name, Segment=segment, TotalSegments=total_segments)
+        try:
+            while not stopped.is_set():
+                response = client.scan(**kwargs)
+                pages.put(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(_SEGMENT_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=total_segments, thread_name_prefix='sweep')
+    try:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        remaining = total_segments
+        while remaining:
+            page = pages.get()
+            if page is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield {key: deserializer.deserialize(value) for key, value in item.items()}
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False)
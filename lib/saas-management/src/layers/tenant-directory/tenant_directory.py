@@ -0,0 +1,21 @@
+"""Lookups in the tenant directory, the table mapping every tenant_id to the cell holding the tenant.
+Entries are written in the same transaction as the tenant record and repointed when a tenant is moved.
+
+Resolving a tenant by id alone takes two reads: a consistent GetItem of the directory entry here, then
+the tenant record by its cell#tenant key. The entry deliberately holds nothing but the cell. Copying the
+tenant's name, tier or status onto it would save the second read, but every write that changes those
+(activation, deactivation, moves, the provisioning status updates) would then have to keep the copy in
+step. Callers that know the cell skip the lookup and read the tenant record directly."""
+
+import os
+
+import boto3
+
+dynamodb = boto3.resource('dynamodb')
+tenant_directory_table = dynamodb.Table(os.environ.get('TENANT_DIRECTORY_TABLE_NAME', ''))
+
+
+def find_tenant_cell(tenant_id):
+    """The cell of the tenant from the tenant directory, None for an unknown tenant"""
+    item = tenant_directory_table.get_item(Key={'tenant_id': tenant_id}, ConsistentRead=True).get('Item')
+    return item['cell_id'] if item else None
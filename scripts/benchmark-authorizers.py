@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Benchmark harness for the cell and control plane Lambda authorizers that needs no Cognito pool.
+
+Generates an RSA key pair, serves it as jwks.json from a local HTTP server and mints Cognito-shaped
+ID tokens (custom:tenantId, custom:role) signed with it. Requests for the user pool's jwks.json are
+routed to the local server, then each authorizer's handler is run many times and the harness reports
+cold init time, warm p50/p99 latency and memory allocated per call.
+
+Requires python-jose[cryptography] (as in the authorizers' requirements.txt). Run from the repo root:
+    python3 scripts/benchmark-authorizers.py [--iterations N] [--tokens N] [--output results.json] [--baseline results.json]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+AUTH_POLICY_LAYER = os.path.join(REPO_ROOT, 'lib/application-plane/cell-app-plane/cdk/layers/auth-policy')
+AUTHORIZERS = {
+    'cell': {
+        'path': os.path.join(REPO_ROOT, 'lib/application-plane/cell-app-plane/cdk/lambdas/authorizer.py'),
+        'methodArn': 'arn:aws:execute-api:us-east-1:123456789012:abcdef1234/prod/GET/product',
+        'role': 'TenantUser',
+    },
+    'control-plane': {
+        'path': os.path.join(REPO_ROOT, 'lib/saas-management/cell-management-system/src/lambdas/Authorizer/controlPlaneAuthorizer.py'),
+        'methodArn': 'arn:aws:execute-api:us-east-1:123456789012:fedcba4321/prod/GET/ListCells',
+        'role': 'SystemAdmin',
+    },
+}
+REGION = 'us-east-1'
+USER_POOL_ID = 'us-east-1_benchmark'
+APP_CLIENT_ID = 'benchmarkclient'
+KID = 'benchmark-key'
+
+
+class JwksServer:
+    """Serves a single RSA public key as jwks.json and counts how often it was fetched"""
+
+    def __init__(self, public_jwk):
+        body = json.dumps({'keys': [public_jwk]}).encode('utf-8')
+        self.fetches = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.fetches += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class LocalJwksHandler(urllib.request.BaseHandler):
+    """Routes the authorizers' https requests for the Cognito jwks.json to the local server, so the
+    authorizer code runs unchanged"""
+    handler_order = 100
+
+    def __init__(self, jwks_url):
+        self.jwks_url = jwks_url
+        self.opener = urllib.request.build_opener()
+
+    def https_open(self, req):
+        if req.full_url.endswith('/.well-known/jwks.json'):
+            return self.opener.open(self.jwks_url, timeout=req.timeout)
+        return None
+
+
+def generate_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()).decode('utf-8')
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk = {k: v.decode('utf-8') if isinstance(v, bytes) else v for k, v in public_jwk.items()}
+    public_jwk.update({'kid': KID, 'use': 'sig'})
+    return private_pem, public_jwk
+
+
+def mint_token(private_pem, tenant_id, role, lifetime_seconds=3600):
+    """Mints a token shaped like a Cognito ID token of the cell or control plane user pools"""
+    now = int(time.time())
+    claims = {
+        'sub': str(uuid.uuid4()),
+        'aud': APP_CLIENT_ID,
+        'iss': 'https://cognito-idp.{}.amazonaws.com/{}'.format(REGION, USER_POOL_ID),
+        'token_use': 'id',
+        'auth_time': now,
+        'iat': now,
+        'exp': now + lifetime_seconds,
+        'cognito:username': 'user-{}'.format(tenant_id),
+        'email': '{}@example.com'.format(tenant_id),
+        'custom:tenantId': tenant_id,
+        'custom:role': role,
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': KID})
+
+
+def configure_environment(jwks_url):
+    os.environ['AWS_REGION'] = REGION
+    os.environ['IDP_DETAILS'] = json.dumps({'name': 'Cognito', 'details': {'userPoolId': USER_POOL_ID, 'appClientId': APP_CLIENT_ID}})
+    urllib.request.install_opener(urllib.request.build_opener(LocalJwksHandler(jwks_url)))
+    if AUTH_POLICY_LAYER not in sys.path:
+        sys.path.insert(0, AUTH_POLICY_LAYER)
+
+
+def load_authorizer(name):
+    spec = importlib.util.spec_from_file_location('{}_authorizer'.format(name.replace('-', '_')), AUTHORIZERS[name]['path'])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def event_for(name, token):
+    return {'type': 'TOKEN', 'authorizationToken': 'Bearer ' + token, 'methodArn': AUTHORIZERS[name]['methodArn']}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure_cold(name, private_pem, jwks_url):
+    """Import plus first invocation, the work a fresh Lambda execution environment does"""
+    configure_environment(jwks_url)
+    token = mint_token(private_pem, 'tenant0', AUTHORIZERS[name]['role'])
+    start = time.perf_counter()
+    module = load_authorizer(name)
+    imported = time.perf_counter()
+    module.handler(event_for(name, token), None)
+    invoked = time.perf_counter()
+    return {'importMs': (imported - start) * 1000, 'firstInvocationMs': (invoked - imported) * 1000}
+
+
+def measure_warm(name, private_pem, jwks_server, iterations, token_count):
+    configure_environment(jwks_server.url)
+    module = load_authorizer(name)
+    tokens = [mint_token(private_pem, 'tenant{}'.format(i), AUTHORIZERS[name]['role']) for i in range(token_count)]
+    events = [event_for(name, token) for token in tokens]
+    for event in events:
+        module.handler(event, None)
+
+    fetches_before = jwks_server.fetches
+    samples = []
+    for i in range(iterations):
+        event = events[i % len(events)]
+        start = time.perf_counter_ns()
+        module.handler(event, None)
+        samples.append((time.perf_counter_ns() - start) / 1000)
+
+    allocation_calls = min(iterations, 2000)
+    tracemalloc.start()
+    allocated = 0
+    for i in range(allocation_calls):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        module.handler(events[i % len(events)], None)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - current
+    tracemalloc.stop()
+
+    return {
+        'p50Us': percentile(samples, 50),
+        'p99Us': percentile(samples, 99),
+        'meanUs': statistics.fmean(samples),
+        'invocationsPerSecond': 1e6 / statistics.fmean(samples),
+        'allocatedBytesPerCall': allocated / allocation_calls,
+        'jwksFetches': jwks_server.fetches - fetches_before,
+    }
+
+
+def run_cold_child(name, private_pem, jwks_url):
+    """Runs measure_cold in a fresh interpreter so imports of jose and cryptography are included"""
+    output = subprocess.check_output([sys.executable, __file__, '--cold-child', name, '--jwks-url', jwks_url],
+                                     input=private_pem, text=True)
+    return json.loads(output)
+
+
+def print_results(results, baseline):
+    for name, result in results.items():
+        print('== {} authorizer =='.format(name))
+        for key, value in result.items():
+            line = '  {:<24} {:>12.2f}'.format(key, value)
+            base = baseline.get(name, {}).get(key) if baseline else None
+            if base:
+                line += '   baseline {:>12.2f} ({:+.1f}%)'.format(base, (value - base) / base * 100)
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--tokens', type=int, default=50, help='distinct tokens the warm calls cycle through')
+    parser.add_argument('--authorizer', choices=list(AUTHORIZERS), action='append')
+    parser.add_argument('--output', help='write results as JSON, to be used as a later --baseline')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--cold-child', help=argparse.SUPPRESS)
+    parser.add_argument('--jwks-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_child:
+        print(json.dumps(measure_cold(args.cold_child, sys.stdin.read(), args.jwks_url)))
+        return
+
+    private_pem, public_jwk = generate_key()
+    jwks_server = JwksServer(public_jwk)
+    results = {}
+    try:
+        for name in args.authorizer or list(AUTHORIZERS):
+            result = run_cold_child(name, private_pem, jwks_server.url)
+            result.update(measure_warm(name, private_pem, jwks_server, args.iterations, args.tokens))
+            results[name] = result
+    finally:
+        jwks_server.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
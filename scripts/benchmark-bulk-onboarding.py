@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Onboards the same tenants into a throwaway copy of the cell management table in DynamoDB Local twice:
+one AssignTenantToCell call per tenant, and BulkAssignTenants calls of --batch tenants. Reports tenants
+onboarded per second and the AWS calls made per tenant for both, and checks that each run left every
+cell's utilization equal to its tenant records and a tenant directory entry for every tenant. EventBridge
+and SSM are in-process stand-ins that count calls, DynamoDB is the real local one; with --call-ms every
+AWS call is delayed by that much to model the round trip to the service, which is what dominates in Lambda.
+
+Start DynamoDB Local first, e.g. docker run -p 8000:8000 amazon/dynamodb-local, then run from the repo root:
+    python3 scripts/benchmark-bulk-onboarding.py [--endpoint-url URL] [--tenants N] [--batch N] [--call-ms MS]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import boto3
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HANDLER_DIR = 'lib/saas-management/cell-management-system/src/lambdas/AssignTenantToCell'
+# the listener priority allocator, a Lambda layer of the handlers
+LAYER_DIR = 'lib/saas-management/src/layers/listener-priority'
+TABLE_NAME = 'BulkOnboardingBenchmark'
+DIRECTORY_TABLE_NAME = TABLE_NAME + 'Directory'
+# enough room in every run for all tenants, spread over waves and sizes like a real fleet
+CELLS = {'w1s0': ('S', 1, 400), 'w1m0': ('M', 1, 400), 'w2s0': ('S', 2, 400), 'w2l0': ('L', 2, 400)}
+
+
+class CallCounter:
+    """Counts AWS calls and delays each by call_ms"""
+
+    def __init__(self, call_ms):
+        self.calls = 0
+        self.call_ms = call_ms
+        self.lock = threading.Lock()
+
+    def count(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.call_ms / 1000)
+
+    def __call__(self, **kwargs):
+        self.count()
+
+    def attach(self, client):
+        client.meta.events.register('before-call.dynamodb', self)
+
+
+class StandInEvents:
+    def __init__(self, counter):
+        self.counter = counter
+
+    def put_events(self, Entries):
+        assert len(Entries) <= 10
+        self.counter.count()
+        return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(i)} for i in range(len(Entries))]}
+
+
+class StandInSsm:
+    def __init__(self, counter):
+        self.counter = counter
+
+    def get_parameter(self, Name):
+        self.counter.count()
+        return {'Parameter': {'Value': '1.0.0'}}
+
+
+def create_table(dynamodb):
+    """The cell management table with the GSIs the onboarding functions use"""
+    if TABLE_NAME in dynamodb.meta.client.list_tables()['TableNames']:
+        dynamodb.Table(TABLE_NAME).delete()
+        dynamodb.Table(TABLE_NAME).wait_until_not_exists()
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ('PK', 'item_type')],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'CellsByItemTypeIndex',
+            'KeySchema': [{'AttributeName': 'item_type', 'KeyType': 'HASH'}, {'AttributeName': 'PK', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    for cell_id, (size, wave, capacity) in CELLS.items():
+        table.put_item(Item={'PK': cell_id, 'item_type': 'cell', 'cell_name': cell_id, 'cell_size': size,
+                             'wave_number': wave, 'current_status': 'available', 'cell_utilization': 0,
+                             'cell_max_capacity': capacity})
+    return table
+
+
+def create_directory_table(dynamodb):
+    """The tenant directory, tenant_id to the cell holding the tenant"""
+    if DIRECTORY_TABLE_NAME in dynamodb.meta.client.list_tables()['TableNames']:
+        dynamodb.Table(DIRECTORY_TABLE_NAME).delete()
+        dynamodb.Table(DIRECTORY_TABLE_NAME).wait_until_not_exists()
+    table = dynamodb.create_table(
+        TableName=DIRECTORY_TABLE_NAME,
+        KeySchema=[{'AttributeName': 'tenant_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'tenant_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def load_handlers(counter):
+    """Fresh imports of both handlers, sharing the single tenant handler's clients as in the Lambda"""
+    sys.path.insert(0, os.path.join(REPO_ROOT, HANDLER_DIR))
+    sys.path.insert(0, os.path.join(REPO_ROOT, LAYER_DIR))
+    for name in ('assignTenantToCell', 'bulkAssignTenants', 'cellPlacement'):
+        sys.modules.pop(name, None)
+    import assignTenantToCell
+    import bulkAssignTenants
+    assignTenantToCell.eventbridge_client = StandInEvents(counter)
+    assignTenantToCell.ssm_client = StandInSsm(counter)
+    counter.attach(assignTenantToCell.dynamodb.meta.client)
+    counter.attach(assignTenantToCell.dynamodb_client)
+    return assignTenantToCell, bulkAssignTenants
+
+
+def tenant(i):
+    return {'TenantName': 'tenant{}'.format(i), 'TenantTier': ('basic', 'advanced', 'premium')[i % 3],
+            'TenantEmail': 'tenant{}@example.com'.format(i)}
+
+
+def check(table, directory):
+    """Every cell's utilization equals its tenant records, with unique priorities, and every tenant record has
+    the matching tenant directory entry"""
+    items = table.scan(ConsistentRead=True)['Items']
+    entries = {entry['tenant_id']: entry['cell_id'] for entry in directory.scan(ConsistentRead=True)['Items']}
+    ok = entries == {item['tenant_id']: item['cell_id'] for item in items if '#' in item['PK']}
+    for cell_id in CELLS:
+        cell = next(item for item in items if item['PK'] == cell_id)
+        tenants = [item for item in items if item.get('cell_id') == cell_id]
+        priorities = [item['tenant_listener_priority'] for item in tenants]
+        ok = ok and int(cell['cell_utilization']) == len(tenants) and len(set(priorities)) == len(priorities)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint-url', default='http://localhost:8000')
+    parser.add_argument('--tenants', type=int, default=300)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--call-ms', type=float, default=10, help='modelled round trip of one AWS call')
+    args = parser.parse_args()
+
+    os.environ.update({'AWS_ENDPOINT_URL_DYNAMODB': args.endpoint_url, 'AWS_DEFAULT_REGION': 'us-east-1',
+                       'AWS_ACCESS_KEY_ID': 'local', 'AWS_SECRET_ACCESS_KEY': 'local',
+                       'CELL_MANAGEMENT_TABLE': TABLE_NAME, 'CELL_MANAGEMENT_TABLE_NAME': TABLE_NAME,
+                       'TENANT_DIRECTORY_TABLE_NAME': DIRECTORY_TABLE_NAME,
+                       'CELL_MANAGEMENT_BUS': 'local', 'IMAGE_VER_SSM_PARAM_NAME': 'local',
+                       'MAX_BULK_TENANTS': str(args.batch)})
+    dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+    tenants = [tenant(i) for i in range(args.tenants)]
+
+    runs = {}
+    for name in ('single', 'bulk'):
+        table = create_table(dynamodb)
+        directory = create_directory_table(dynamodb)
+        counter = CallCounter(args.call_ms)
+        single, bulk = load_handlers(counter)
+        started = time.perf_counter()
+        if name == 'single':
+            accepted = sum(single.handler({'body': json.dumps(body)}, None)['statusCode'] == 200 for body in tenants)
+        else:
+            accepted = 0
+            for start in range(0, len(tenants), args.batch):
+                response = bulk.handler({'body': json.dumps({'Tenants': tenants[start:start + args.batch]})}, None)
+                accepted += json.loads(response['body'])['Accepted']
+        elapsed = time.perf_counter() - started
+        runs[name] = accepted / elapsed
+        print('{:<7} {:>5} of {} onboarded in {:6.2f}s, {:8.1f} tenants/s, {:5.2f} AWS calls per tenant, {}'.format(
+            name, accepted, len(tenants), elapsed, accepted / elapsed, counter.calls / len(tenants),
+            'consistent' if check(table, directory) else 'INCONSISTENT'))
+        table.delete()
+        directory.delete()
+    print('bulk throughput {:.1f}x single'.format(runs['bulk'] / runs['single']))
+
+
+if __name__ == '__main__':
+    main()
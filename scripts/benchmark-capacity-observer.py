@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Measures the log output of one CapacityObserver invocation: writes, flushes, lines and bytes that
+reach stdout, the Lambda log stream. Runs the observer against an in-memory stand-in for the cell
+management table and a counting stand-in for stdout, at the current tree and, when aws-embedded-metrics
+is installed, at a baseline git revision that emitted EMF per cell with @metric_scope.
+
+Requires boto3 (no AWS calls are made). Run from the repo root:
+    python3 scripts/benchmark-capacity-observer.py [--cells N] [--baseline-ref REF]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import logging
+import os
+import subprocess
+import sys
+import time
+import types
+from decimal import Decimal
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+OBSERVER_PATH = 'lib/saas-management/cell-management-system/src/lambdas/CapacityObserver/capacityObserver.py'
+EMF_BATCH_LAYER = os.path.join(REPO_ROOT, 'lib/saas-management/src/layers/emf-batch')
+
+
+class CountingSink:
+    """Stand-in for the Lambda log stream"""
+
+    def __init__(self):
+        self.writes = 0
+        self.flushes = 0
+        self.lines = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.lines += data.count('\n')
+        self.bytes += len(data.encode('utf-8'))
+        return len(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class StandInTable:
+    """Answers the observer's scan (baseline) and query (current) with the same cells and tenants, and
+    stands in for the utilization table the current observer keeps its samples in"""
+
+    def __init__(self, cells, tenants_per_cell):
+        self.items = []
+        for c in range(cells):
+            self.items.append({'PK': 'cell{}'.format(c), 'cell_name': 'cell-{}'.format(c), 'current_status': 'available',
+                               'cell_utilization': Decimal(c % 50), 'cell_max_capacity': Decimal(50)})
+            self.items.extend({'PK': 'cell{}#tenant{}'.format(c, t)} for t in range(tenants_per_cell))
+
+    def scan(self, **kwargs):
+        return {'Items': [dict(item) for item in self.items]}
+
+    def query(self, **kwargs):
+        return {'Items': [dict(item) for item in self.items if '#' not in item['PK']]}
+
+    def batch_get_item(self, RequestItems):
+        return {'Responses': {}}
+
+    def update_item(self, **kwargs):
+        return {}
+
+
+def load_observer(name, source, table):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('CELL_MANAGEMENT_TABLE', 'CellManagementTable')
+    os.environ.setdefault('CELL_UTILIZATION_TABLE', 'CellUtilizationTable')
+    module = types.ModuleType(name)
+    exec(compile(source, name, 'exec'), module.__dict__)
+    module.dynamodb = types.SimpleNamespace(Table=lambda name: table, batch_get_item=table.batch_get_item)
+    module.utilization_table = table
+    return module
+
+
+def first_commit():
+    return subprocess.check_output(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=REPO_ROOT, text=True).split()[0]
+
+
+def run(module, sink):
+    """One invocation with stdout and the root logger (as set up by the Lambda runtime) going to the sink"""
+    handler = logging.StreamHandler(sink)
+    handler.terminator = '\n'
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        with contextlib.redirect_stdout(sink):
+            started = time.perf_counter()
+            module.handler({}, None)
+            return (time.perf_counter() - started) * 1000
+    finally:
+        root.removeHandler(handler)
+
+
+def report(name, sink, elapsed_ms):
+    print('{:<28} {:>7} writes {:>7} flushes {:>7} lines {:>10} bytes {:>9.1f} ms'.format(
+        name, sink.writes, sink.flushes, sink.lines, sink.bytes, elapsed_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cells', type=int, default=500)
+    parser.add_argument('--tenants-per-cell', type=int, default=5)
+    parser.add_argument('--baseline-ref', default=None, help='git revision of the per-cell emitter (default: first commit)')
+    args = parser.parse_args()
+    os.environ.setdefault('AWS_EMF_ENVIRONMENT', 'Lambda')
+    sys.path.insert(0, EMF_BATCH_LAYER)
+    table = StandInTable(args.cells, args.tenants_per_cell)
+
+    if importlib.util.find_spec('aws_embedded_metrics') is None:
+        print('before: aws-embedded-metrics not installed, skipping the baseline')
+    else:
+        ref = args.baseline_ref or first_commit()
+        source = subprocess.check_output(['git', 'show', '{}:{}'.format(ref, OBSERVER_PATH)], cwd=REPO_ROOT, text=True)
+        sink = CountingSink()
+        elapsed = run(load_observer('baseline_observer', source, table), sink)
+        report('before ({})'.format(ref[:10]), sink, elapsed)
+
+    with open(os.path.join(REPO_ROOT, OBSERVER_PATH)) as f:
+        source = f.read()
+    sink = CountingSink()
+    elapsed = run(load_observer('capacity_observer', source, table), sink)
+    report('after, batched', sink, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Compares the read units ListCells and the CapacityObserver consume with the old full-table Scan and
+with the CellsByItemTypeIndex Query. Creates a throwaway copy of the cell management table (with the
+same GSIs) in DynamoDB Local, fills it with cells and tenants and reports the ConsumedCapacity of both.
+
+Start DynamoDB Local first, e.g. docker run -p 8000:8000 amazon/dynamodb-local, then run from the repo root:
+    python3 scripts/benchmark-cell-listing.py [--endpoint-url URL] [--cells N] [--tenants N]
+"""
+
+import argparse
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+TABLE_NAME = 'CellListingBenchmark'
+
+
+def create_table(dynamodb):
+    """The cell management table as defined in cell-management-system-stack.ts"""
+    gsi = lambda name, pk, sk: {
+        'IndexName': name,
+        'KeySchema': [{'AttributeName': pk, 'KeyType': 'HASH'}, {'AttributeName': sk, 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'}
+    }
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'}
+                              for name in ('PK', 'cell_id', 'tenant_id', 'item_type')],
+        GlobalSecondaryIndexes=[
+            gsi('TenantsByCellIdIndex', 'cell_id', 'tenant_id'),
+            gsi('CellsByItemTypeIndex', 'item_type', 'PK'),
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def load(table, cells, tenants):
+    started = time.monotonic()
+    with table.batch_writer() as batch:
+        for c in range(cells):
+            batch.put_item(Item={'PK': 'cell{}'.format(c), 'item_type': 'cell', 'cell_name': 'cell{}'.format(c),
+                                 'current_status': 'available', 'cell_utilization': tenants // cells,
+                                 'cell_max_capacity': tenants})
+        for t in range(tenants):
+            cell_id = 'cell{}'.format(t % cells)
+            tenant_id = 'tenant{}'.format(t)
+            batch.put_item(Item={'PK': cell_id + '#' + tenant_id, 'cell_id': cell_id, 'tenant_id': tenant_id,
+                                 'tenant_name': tenant_id, 'tenant_email': tenant_id + '@example.com',
+                                 'tenant_tier': 'basic', 'current_status': 'available'})
+    print('loaded {} cells and {} tenants in {:.0f}s'.format(cells, tenants, time.monotonic() - started))
+
+
+def consume(operation, **kwargs):
+    """Runs a paginated Scan or Query and returns (items, read units, requests)"""
+    items, units, requests, start_key = 0, 0.0, 0, None
+    while True:
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = operation(ReturnConsumedCapacity='TOTAL', **kwargs)
+        items += len([item for item in response['Items'] if '#' not in item['PK']])
+        units += response['ConsumedCapacity']['CapacityUnits']
+        requests += 1
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            return items, units, requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint-url', default='http://localhost:8000')
+    parser.add_argument('--cells', type=int, default=20)
+    parser.add_argument('--tenants', type=int, default=100000)
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url, region_name='us-east-1',
+                              aws_access_key_id='local', aws_secret_access_key='local')
+    table = create_table(dynamodb)
+    try:
+        load(table, args.cells, args.tenants)
+        projection = 'PK, cell_name, cell_max_capacity, cell_utilization, current_status'
+        scan = consume(table.scan, ProjectionExpression=projection)
+        query = consume(table.query, IndexName='CellsByItemTypeIndex', KeyConditionExpression=Key('item_type').eq('cell'),
+                        ProjectionExpression=projection)
+        for name, (items, units, requests) in (('scan', scan), ('query', query)):
+            print('{:<6} {:>6} cells  {:>10.1f} read units  {:>5} requests'.format(name, items, units, requests))
+        assert scan[0] == query[0] == args.cells, 'both must return every cell'
+        print('query reads {:.2%} of the scan\'s units'.format(query[1] / scan[1]))
+    finally:
+        table.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 # Default values
 DEFAULT_DURATION=60
+DEFAULT_WRITE_ACK="commit"
 
 # Color definitions
 RED='\033[0;31m'
@@ -35,9 +36,13 @@ while [[ $# -gt 0 ]]; do
             DURATION="$2"
             shift 2
             ;;
+        --write-ack)
+            WRITE_ACK="$2"
+            shift 2
+            ;;
         *)
             echo -e "${RED}Unknown parameter: $1${NC}"
-            echo -e "${YELLOW}Usage: $0 --cell-ids <cell_id1,cell_id2,...> --tenant-ids <tenant_id1,tenant_id2,...> --duration <seconds>${NC}"
+            echo -e "${YELLOW}Usage: $0 --cell-ids <cell_id1,cell_id2,...> --tenant-ids <tenant_id1,tenant_id2,...> --duration <seconds> [--write-ack <commit|enqueue>]${NC}"
             exit 1
             ;;
     esac
@@ -61,6 +66,7 @@ fi
 
 # Set default values if not provided
 DURATION=${DURATION:-$DEFAULT_DURATION}
+WRITE_ACK=${WRITE_ACK:-$DEFAULT_WRITE_ACK}
 
 # Function to draw table header
 draw_table_header() {
@@ -135,6 +141,7 @@ make_request() {
         --url "https://${distribution_url}/product" \
         -H "content-type: application/json" \
         -H "Authorization: Bearer ${id_token}" \
+        -H "X-Write-Ack: ${WRITE_ACK}" \
         -d "{\"productId\":\"${product_id}\",\"productName\":\"p${product_id}\",\"productDescription\":\"p${product_id}desc\",\"productPrice\":\"10\"}")
     
     local body=$(echo -e "$response" | sed '$d')
@@ -147,6 +154,7 @@ echo -e "${YELLOW}Running with configuration:${NC}"
 echo -e "${GREEN}Cell IDs: ${CELL_IDS[*]}${NC}"
 echo -e "${GREEN}Tenant IDs: ${TENANT_IDS[*]}${NC}"
 echo -e "${GREEN}Duration: ${DURATION} seconds${NC}"
+echo -e "${GREEN}Write acknowledgement: ${WRITE_ACK}${NC}"
 
 # Get distribution URL
 DISTRIBUTION_URL=$(aws cloudformation describe-stacks --stack-name CellRouter \
@@ -225,3 +233,11 @@ while [ $(date +%s) -lt $END_TIME ]; do
     done
     
 done
+
+# Report write throughput so the direct and write-behind modes can be compared
+echo -e "\n${YELLOW}Write throughput (${WRITE_ACK} acknowledgement):${NC}"
+for i in "${!CELL_IDS[@]}"; do
+    cell_id="${CELL_IDS[$i]}"
+    tenant_id="${TENANT_IDS[$i]}"
+    echo -e "Cell ID: ${cell_id} Tenant ID: ${tenant_id}: $(awk "BEGIN {printf \"%.2f\", ${SUCCESS_COUNTS[$i]} / ${DURATION}}") products/sec"
+done
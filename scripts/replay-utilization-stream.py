@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Replays DynamoDB stream batches of the cell management table through the UtilizationAggregator
+against an in-memory stand-in for the utilization table, and checks the resulting per-cell counters
+against a recount of the final tenant states and tiers. Every recording is replayed three ways: in order, with
+every batch delivered twice, and with failures injected so batches are retried from the reported
+sequence numbers, as Lambda does with ReportBatchItemFailures.
+
+Without --recording a synthetic recording is generated (tenants created, made available, failed,
+deactivated, moved and deleted). A recording is a JSON list of the events the function received,
+e.g. taken from its logs. Requires boto3 (no AWS calls are made). Run from the repo root:
+    python3 scripts/replay-utilization-stream.py [--recording events.json] [--save events.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import sys
+import types
+
+from botocore.exceptions import ClientError
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+AGGREGATOR_PATH = 'lib/saas-management/cell-management-system/src/lambdas/UtilizationAggregator/utilizationAggregator.py'
+LAYERS = ['lib/saas-management/src/layers/emf-batch', 'lib/saas-management/src/layers/table-sweep']
+UTILIZATION_TABLE = 'CellUtilization'
+
+
+class StandInClient:
+    """The DynamoDB calls the aggregator makes on the utilization table, with the conditions it uses"""
+
+    def __init__(self, fail_every=0):
+        self.items = {}
+        self.fail_every = fail_every
+        self.transactions = 0
+
+    def batch_get_item(self, RequestItems):
+        request = RequestItems[UTILIZATION_TABLE]
+        found = [self.items[key['PK']['S']] for key in request['Keys'] if key['PK']['S'] in self.items]
+        return {'Responses': {UTILIZATION_TABLE: [json.loads(json.dumps(item)) for item in found]}}
+
+    def transact_write_items(self, TransactItems):
+        self.transactions += 1
+        if self.fail_every and self.transactions % self.fail_every == 0:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'injected'}}, 'TransactWriteItems')
+        updates = [item['Update'] for item in TransactItems]
+        for update in updates:
+            if not self.check(update):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'condition'}}, 'TransactWriteItems')
+        for update in updates:
+            self.apply(update)
+
+    def check(self, update):
+        condition = update.get('ConditionExpression')
+        item = self.items.get(update['Key']['PK']['S'], {})
+        if condition is None:
+            return True
+        if condition == 'attribute_not_exists(last_sequence_number)':
+            return 'last_sequence_number' not in item
+        if condition == 'last_sequence_number = :marker':
+            return item.get('last_sequence_number') == update['ExpressionAttributeValues'][':marker']
+        raise NotImplementedError(condition)
+
+    def apply(self, update):
+        key = update['Key']['PK']['S']
+        item = self.items.setdefault(key, {'PK': {'S': key}})
+        values = update['ExpressionAttributeValues']
+        names = update.get('ExpressionAttributeNames', {})
+        expression = update['UpdateExpression']
+        for clause, body in re.findall(r'(SET|ADD|REMOVE) ((?:(?!SET |ADD |REMOVE ).)+)', expression):
+            for part in body.split(','):
+                tokens = [names.get(token, token) for token in part.replace('=', ' ').split()]
+                if clause == 'SET':
+                    item[tokens[0]] = values[tokens[1]]
+                elif clause == 'ADD':
+                    current = int(item.get(tokens[0], {'N': '0'})['N'])
+                    item[tokens[0]] = {'N': str(current + int(values[tokens[1]]['N']))}
+                else:
+                    item.pop(tokens[0], None)
+
+
+def load_aggregator(client):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['CELL_UTILIZATION_TABLE'] = UTILIZATION_TABLE
+    for layer in LAYERS:
+        sys.path.insert(0, os.path.join(REPO_ROOT, layer))
+    with open(os.path.join(REPO_ROOT, AGGREGATOR_PATH)) as f:
+        source = f.read()
+    module = types.ModuleType('utilization_aggregator')
+    exec(compile(source, AGGREGATOR_PATH, 'exec'), module.__dict__)
+    module.dynamodb_client = client
+    return module
+
+
+def image(cell_id, tenant_id, status, routing_active=None):
+    tier = ('basic', 'advanced', 'premium')[int(tenant_id[len('tenant'):]) % 3]
+    attributes = {'PK': {'S': cell_id + '#' + tenant_id}, 'cell_id': {'S': cell_id},
+                  'tenant_id': {'S': tenant_id}, 'current_status': {'S': status}, 'tenant_tier': {'S': tier}}
+    if routing_active is not None:
+        attributes['routing_active'] = {'BOOL': routing_active}
+    return attributes
+
+
+def synthetic_recording(cells=3, tenants=60, batch_size=25, seed=7):
+    """Stream records for tenants going through their lifecycle, interleaved across tenants"""
+    rng = random.Random(seed)
+    lifecycles = []
+    for t in range(tenants):
+        cell_id = 'cell{}'.format(t % cells)
+        tenant_id = 'tenant{}'.format(t)
+        steps = [None, image(cell_id, tenant_id, 'creating')]
+        if t % 10 == 0:
+            steps.append(image(cell_id, tenant_id, 'failed'))
+        else:
+            steps.append(image(cell_id, tenant_id, 'available'))
+            if t % 4 == 0:
+                steps.append(image(cell_id, tenant_id, 'available', routing_active=False))
+            if t % 7 == 0:
+                steps.append(image(cell_id, tenant_id, 'moving'))
+                steps.append(None)
+                target = 'cell{}'.format((t + 1) % cells)
+                lifecycles.append([None, image(target, tenant_id, 'available')])
+            elif t % 9 == 0:
+                steps.append(None)
+        lifecycles.append(steps)
+
+    records = []
+    sequence = 10 ** 20
+    cursors = [0] * len(lifecycles)
+    while any(cursor < len(steps) - 1 for cursor, steps in zip(cursors, lifecycles)):
+        i = rng.choice([i for i, steps in enumerate(lifecycles) if cursors[i] < len(steps) - 1])
+        old, new = lifecycles[i][cursors[i]], lifecycles[i][cursors[i] + 1]
+        cursors[i] += 1
+        sequence += rng.randint(1, 1000)
+        stream_record = {'Keys': {'PK': (new or old)['PK']}, 'SequenceNumber': str(sequence)}
+        if old:
+            stream_record['OldImage'] = old
+        if new:
+            stream_record['NewImage'] = new
+        records.append({'eventName': 'MODIFY' if old and new else ('INSERT' if new else 'REMOVE'), 'dynamodb': stream_record})
+        # a cell item change, which the aggregator ignores
+        if sequence % 5 == 0:
+            sequence += 1
+            records.append({'eventName': 'MODIFY', 'dynamodb': {'Keys': {'PK': {'S': 'cell0'}}, 'SequenceNumber': str(sequence),
+                                                                'NewImage': {'PK': {'S': 'cell0'}}}})
+    return [{'Records': records[i:i + batch_size]} for i in range(0, len(records), batch_size)]
+
+
+def expected_counts(module, events):
+    final = {}
+    for event in events:
+        for record in event['Records']:
+            key = record['dynamodb']['Keys']['PK']['S']
+            if '#' in key:
+                final[key] = module.deserialize(record['dynamodb'].get('NewImage'))
+    counts = {}
+    for key, item in final.items():
+        for counter in module.tenant_counters(item):
+            cell_counts = counts.setdefault(key.split('#')[0], module.empty_counters())
+            cell_counts[counter] = cell_counts.get(counter, 0) + 1
+    return counts
+
+
+def replay(events, mode):
+    client = StandInClient(fail_every=7 if mode == 'with failures' else 0)
+    module = load_aggregator(client)
+    deliveries = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            records = event['Records']
+            while records:
+                deliveries += 1
+                result = module.handler({'Records': records}, None)
+                if mode == 'redelivered':
+                    module.handler({'Records': records}, None)
+                failed = [failure['itemIdentifier'] for failure in result['batchItemFailures']]
+                if not failed:
+                    break
+                # Lambda retries from the lowest failed sequence number
+                first = min(failed, key=lambda sequence: int(sequence))
+                records = records[[record['dynamodb']['SequenceNumber'] for record in records].index(first):]
+    counters = module.get_cell_counters(list({key.split('#')[0] for key in client.items if '#' in key} |
+                                              {key for key in client.items if '#' not in key}))
+    counters = {cell: counts for cell, counts in counters.items() if any(counts.values())}
+    return counters, deliveries, client.transactions, expected_counts(module, events)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', help='JSON list of recorded stream events')
+    parser.add_argument('--save', help='write the synthetic recording to this file')
+    args = parser.parse_args()
+    # the injected failures are expected, keep the aggregator's error log out of the report
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    if args.recording:
+        with open(args.recording) as f:
+            events = json.load(f)
+    else:
+        events = synthetic_recording()
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(events, f, indent=1)
+    print('{} batches, {} records'.format(len(events), sum(len(event['Records']) for event in events)))
+
+    ok = True
+    for mode in ('in order', 'redelivered', 'with failures'):
+        counters, deliveries, transactions, expected = replay(events, mode)
+        expected = {cell: counts for cell, counts in expected.items() if any(counts.values())}
+        matches = counters == expected
+        ok = ok and matches
+        print('{:<14} {:>4} deliveries {:>5} transactions  counters {}'.format(
+            mode, deliveries, transactions, 'match' if matches else 'DIFFER: {} != {}'.format(counters, expected)))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Replays an onboarding trace through the AssignTenantToCell placement engine with each strategy and
+compares them. Onboardings are spread over several concurrent function instances, each with its own cached
+capacity index, against one shared fleet, so stale caches and contention on full cells happen as they would
+in the Lambda. Offboardings free a place in the fleet without the caches knowing.
+
+Per strategy the report shows the tenants placed and refused, the fill rate (tenants over fleet capacity)
+when the first tenant was refused and at the end, the share of tenants in the fullest deployment wave, the
+share of tenants in a cell of their tier's size, and placement latency: the engine's own compute time plus
+DynamoDB calls at --call-ms each (a capacity load is a query and a batch get per 100 cells).
+
+Without --trace a synthetic trace is generated. A trace is a JSON list of {"t": seconds, "op": "onboard" or
+"offboard", "tenant": id, "tier": tier}, a fleet a JSON list of {"cell_id", "cell_size", "wave_number",
+"max_capacity"}. Run from the repo root:
+    python3 scripts/simulate-cell-placement.py [--trace trace.json] [--fleet fleet.json] [--save trace.json]
+"""
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PLACEMENT_PATH = 'lib/saas-management/cell-management-system/src/lambdas/AssignTenantToCell/cellPlacement.py'
+# tenants a cell of each size supports, as in the cell app plane's CellStack
+TENANTS_SUPPORTED = {'S': 20, 'M': 10, 'L': 5}
+TIER_MIX = (('basic', 0.6), ('advanced', 0.3), ('premium', 0.1))
+
+
+def load_placement():
+    spec = importlib.util.spec_from_file_location('cell_placement', os.path.join(REPO_ROOT, PLACEMENT_PATH))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def default_fleet(waves=3):
+    fleet = []
+    for wave in range(1, waves + 1):
+        for size, count in (('S', 2), ('M', 2), ('L', 2)):
+            for i in range(count):
+                fleet.append({'cell_id': 'w{}{}{}'.format(wave, size.lower(), i), 'cell_size': size,
+                              'wave_number': wave, 'max_capacity': TENANTS_SUPPORTED[size]})
+    return fleet
+
+
+def synthetic_trace(tenants=240, arrivals_per_second=2.0, churn=0.15, seed=11):
+    """Onboardings arriving at random, a share of the tenants offboarding again some time later"""
+    rng = random.Random(seed)
+    events = []
+    t = 0.0
+    for i in range(tenants):
+        t += rng.expovariate(arrivals_per_second)
+        tier = rng.choices([tier for tier, _ in TIER_MIX], [weight for _, weight in TIER_MIX])[0]
+        tenant = 'tenant{}'.format(i)
+        events.append({'t': round(t, 3), 'op': 'onboard', 'tenant': tenant, 'tier': tier})
+        if rng.random() < churn:
+            events.append({'t': round(t + rng.uniform(5, 120), 3), 'op': 'offboard', 'tenant': tenant, 'tier': tier})
+    return sorted(events, key=lambda event: event['t'])
+
+
+class Fleet:
+    """The cells as stored in the cell management table, shared by all function instances"""
+
+    def __init__(self, cells, placement):
+        self.cells = {cell['cell_id']: dict(cell, utilization=0) for cell in cells}
+        self.placement = placement
+        self.calls = 0
+
+    def load(self):
+        self.calls += 1 + math.ceil(len(self.cells) / 100)
+        return [dict(cell) for cell in self.cells.values()]
+
+    def reserve(self, cell):
+        # the consistent read of the cell and the reservation transaction
+        self.calls += 2
+        stored = self.cells[cell['cell_id']]
+        if stored['utilization'] >= stored['max_capacity']:
+            raise self.placement.CellContentionError(cell['cell_id'])
+        stored['utilization'] += 1
+        return stored['cell_id']
+
+    def release(self, cell_id):
+        self.cells[cell_id]['utilization'] -= 1
+
+    def fill_rate(self):
+        return sum(c['utilization'] for c in self.cells.values()) / sum(c['max_capacity'] for c in self.cells.values())
+
+    def max_wave_share(self):
+        waves = {}
+        for cell in self.cells.values():
+            waves[cell['wave_number']] = waves.get(cell['wave_number'], 0) + cell['utilization']
+        total = sum(waves.values())
+        return max(waves.values()) / total if total else 0.0
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def simulate(placement, fleet_cells, trace, strategy, instances, ttl_seconds, call_ms):
+    fleet = Fleet(fleet_cells, placement)
+    clock = {'now': 0.0}
+    indexes = [placement.CapacityIndex(fleet.load, ttl_seconds=ttl_seconds, clock=lambda: clock['now'])
+               for _ in range(instances)]
+    config = {'strategy': strategy, 'tier_cell_sizes': placement.DEFAULT_TIER_CELL_SIZES,
+              'wave_spread_tolerance': placement.DEFAULT_WAVE_SPREAD_TOLERANCE}
+    placed = {}
+    refused = 0
+    fill_at_first_refusal = None
+    tier_matches = 0
+    latencies = []
+    onboardings = 0
+    for event in trace:
+        clock['now'] = event['t']
+        if event['op'] == 'offboard':
+            if event['tenant'] in placed:
+                fleet.release(placed.pop(event['tenant']))
+            continue
+        index = indexes[onboardings % instances]
+        onboardings += 1
+        calls_before = fleet.calls
+        started = time.perf_counter()
+        try:
+            cell, _ = placement.place_tenant(index, fleet.reserve, event['tier'], config)
+        except placement.NoCapacityError:
+            cell = None
+        compute_ms = (time.perf_counter() - started) * 1000
+        latencies.append(compute_ms + (fleet.calls - calls_before) * call_ms)
+        if cell is None:
+            refused += 1
+            if fill_at_first_refusal is None:
+                fill_at_first_refusal = fleet.fill_rate()
+            continue
+        placed[event['tenant']] = cell['cell_id']
+        if cell['cell_size'] in placement.DEFAULT_TIER_CELL_SIZES.get(event['tier'], []):
+            tier_matches += 1
+
+    total_placed = onboardings - refused
+    return {
+        'placed': total_placed,
+        'refused': refused,
+        'fillAtFirstRefusal': fill_at_first_refusal if fill_at_first_refusal is not None else fleet.fill_rate(),
+        'finalFill': fleet.fill_rate(),
+        'maxWaveShare': fleet.max_wave_share(),
+        'tierMatch': tier_matches / total_placed if total_placed else 0.0,
+        'refreshes': sum(index.refreshes for index in indexes),
+        'p50Ms': percentile(latencies, 50),
+        'p99Ms': percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help='JSON onboarding trace')
+    parser.add_argument('--fleet', help='JSON list of cells')
+    parser.add_argument('--save', help='write the synthetic trace to this file')
+    parser.add_argument('--instances', type=int, default=4, help='concurrent function instances')
+    parser.add_argument('--ttl', type=float, default=30, help='capacity index cache TTL in seconds')
+    parser.add_argument('--call-ms', type=float, default=6, help='modelled latency of one DynamoDB call')
+    parser.add_argument('--strategy', action='append', help='strategies to compare (default: all)')
+    args = parser.parse_args()
+
+    placement = load_placement()
+    if args.trace:
+        with open(args.trace) as f:
+            trace = json.load(f)
+    else:
+        trace = synthetic_trace()
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(trace, f, indent=1)
+    if args.fleet:
+        with open(args.fleet) as f:
+            fleet = json.load(f)
+    else:
+        fleet = default_fleet()
+
+    print('{} cells with room for {} tenants, {} onboardings, {} offboardings, {} instances, {}s cache'.format(
+        len(fleet), sum(cell['max_capacity'] for cell in fleet), sum(e['op'] == 'onboard' for e in trace),
+        sum(e['op'] == 'offboard' for e in trace), args.instances, args.ttl))
+    print('{:<14} {:>7} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'strategy', 'placed', 'refused', 'fill@refuse', 'final fill', 'max wave', 'tier match', 'refreshes', 'p50 ms', 'p99 ms'))
+    for strategy in args.strategy or placement.STRATEGIES:
+        result = simulate(placement, fleet, trace, strategy, args.instances, args.ttl, args.call_ms)
+        print('{:<14} {placed:>7} {refused:>8} {fillAtFirstRefusal:>12.1%} {finalFill:>10.1%} {maxWaveShare:>10.1%} '
+              '{tierMatch:>10.1%} {refreshes:>10} {p50Ms:>8.2f} {p99Ms:>8.2f}'.format(strategy, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Replays create/delete churn against one cell's listener priorities, with the counter the control plane
+used before (every tenant gets the counter plus 10, nothing is reused) and with the listener priority
+allocator of lib/saas-management/src/layers/listener-priority. Reports after how many churn cycles each
+runs out of priorities below the cell's default rule, the highest priority handed out, the size of the
+stored map and whether a priority was ever held by two tenants at once.
+
+A cycle removes a random tenant, its priority released with a hold as when its stack is deleted, and
+creates one; --failed is the share of creations that fail before deploying and are released at once.
+Run from the repo root:
+    python3 scripts/simulate-listener-priority-churn.py [--tenants N] [--cycles N] [--cycles-per-hour N]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LAYER_PATH = 'lib/saas-management/src/layers/listener-priority/listener_priority.py'
+
+
+def load_allocator():
+    spec = importlib.util.spec_from_file_location('listener_priority', os.path.join(REPO_ROOT, LAYER_PATH))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CounterPriorities:
+    """The former allocation: ADD 10 to tenant_priority_counter"""
+
+    def __init__(self, max_priority):
+        self.counter = 0
+        self.max_priority = max_priority
+
+    def allocate(self, now):
+        if self.counter + 10 > self.max_priority:
+            return None
+        self.counter += 10
+        return self.counter
+
+    def release(self, priority, hold, now):
+        pass
+
+    def stored_bytes(self):
+        return len(str(self.counter))
+
+
+class MapPriorities:
+    """The allocator, its map round-tripped through the cell item attributes on every write"""
+
+    def __init__(self, allocator):
+        self.allocator = allocator
+        self.cell = {}
+
+    def write(self, priorities):
+        _, _, values = priorities.expression()
+        self.cell = {'listener_priority_bitmap': values[':lp_bitmap'], 'listener_priority_held': values[':lp_held'],
+                     'listener_priority_version': values[':lp_version']}
+
+    def allocate(self, now):
+        priorities = self.allocator.ListenerPriorities.from_cell(self.cell)
+        try:
+            priority, = priorities.allocate(now=now)
+        except self.allocator.PrioritySpaceExhaustedError:
+            return None
+        self.write(priorities)
+        return priority
+
+    def release(self, priority, hold, now):
+        priorities = self.allocator.ListenerPriorities.from_cell(self.cell)
+        priorities.release([priority], hold=hold, now=now)
+        self.write(priorities)
+
+    def stored_bytes(self):
+        return len(self.cell.get('listener_priority_bitmap', b'')) + 12 * len(self.cell.get('listener_priority_held', {}))
+
+
+def simulate(priorities, tenants, cycles, cycles_per_hour, failed, seed):
+    rng = random.Random(seed)
+    live = {}
+    # priorities of removed tenants whose listener rule is still being deleted, with the time it is gone
+    deleting = {}
+    highest = 0
+    conflicts = 0
+    now = 0
+
+    def create(name):
+        nonlocal highest, conflicts
+        priority = priorities.allocate(now)
+        if priority is None:
+            return False
+        if priority in live.values() or deleting.get(priority, 0) > now:
+            conflicts += 1
+        highest = max(highest, priority)
+        if rng.random() < failed:
+            priorities.release(priority, hold=False, now=now)
+            return create(name)
+        live[name] = priority
+        return True
+
+    for i in range(tenants):
+        if not create('tenant{}'.format(i)):
+            return {'exhaustedAt': 0, 'highest': highest, 'stored': priorities.stored_bytes(), 'conflicts': conflicts}
+    for cycle in range(1, cycles + 1):
+        now = int(cycle * 3600 / cycles_per_hour)
+        name = rng.choice(sorted(live))
+        priority = live.pop(name)
+        # a tenant stack takes a few minutes to delete
+        deleting[priority] = now + rng.randint(60, 600)
+        priorities.release(priority, hold=True, now=now)
+        if not create('tenant{}'.format(tenants + cycle)):
+            return {'exhaustedAt': cycle, 'highest': highest, 'stored': priorities.stored_bytes(), 'conflicts': conflicts}
+    return {'exhaustedAt': None, 'highest': highest, 'stored': priorities.stored_bytes(), 'conflicts': conflicts}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tenants', type=int, default=20, help='tenants the cell holds, 20 for a small cell')
+    parser.add_argument('--cycles', type=int, default=100000)
+    parser.add_argument('--cycles-per-hour', type=float, default=60)
+    parser.add_argument('--failed', type=float, default=0.05, help='share of creations that fail before deploying')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    allocator = load_allocator()
+    max_priority = allocator.MAX_SLOTS * allocator.PRIORITY_STEP
+    print('{} tenants, {} churn cycles at {}/hour, {:.0%} failed creations, priorities up to {}, {}s reuse delay'.format(
+        args.tenants, args.cycles, args.cycles_per_hour, args.failed, max_priority, allocator.REUSE_DELAY_SECONDS))
+    print('{:<10} {:>14} {:>10} {:>14} {:>10}'.format('allocation', 'exhausted at', 'highest', 'stored bytes', 'conflicts'))
+    for name, priorities in (('counter', CounterPriorities(max_priority)), ('map', MapPriorities(allocator))):
+        result = simulate(priorities, args.tenants, args.cycles, args.cycles_per_hour, args.failed, args.seed)
+        exhausted = 'never' if result['exhaustedAt'] is None else 'cycle {}'.format(result['exhaustedAt'])
+        print('{:<10} {:>14} {highest:>10} {stored:>14} {conflicts:>10}'.format(name, exhausted, **result))
+
+
+if __name__ == '__main__':
+    main()
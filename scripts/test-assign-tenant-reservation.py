@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Onboards tenants concurrently into cells of a throwaway copy of the cell management table in DynamoDB
+Local, through the AssignTenantToCell handler, and checks that no cell is overfilled: every 200 response
+has a tenant record, the cell's utilization equals its tenants and stays within cell_max_capacity, and
+listener priorities are unique within a cell. The DynamoDB calls per onboarding are counted. Runs the
+current handler and, with --baseline-ref, the handler at an earlier git revision for comparison.
+EventBridge and SSM are replaced by in-process stand-ins, DynamoDB is the real local one.
+
+Start DynamoDB Local first, e.g. docker run -p 8000:8000 amazon/dynamodb-local, then run from the repo root:
+    python3 scripts/test-assign-tenant-reservation.py [--endpoint-url URL] [--threads N] [--requests N] [--baseline-ref REF]
+
+moto's server can stand in for DynamoDB Local only when it serves one request at a time (werkzeug's
+run_simple with threaded=False). Its threaded server doesn't isolate transactions: a cancelled
+TransactWriteItems restores a copy of the tables taken at its start, dropping the writes of concurrent
+requests, which shows up here as lost records and overfilled cells that DynamoDB wouldn't produce.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HANDLER_DIR = 'lib/saas-management/cell-management-system/src/lambdas/AssignTenantToCell'
+# the listener priority allocator, a Lambda layer of the handlers
+LAYER_DIR = 'lib/saas-management/src/layers/listener-priority'
+HANDLER_PATH = HANDLER_DIR + '/assignTenantToCell.py'
+TABLE_NAME = 'AssignTenantReservationTest'
+DIRECTORY_TABLE_NAME = TABLE_NAME + 'Directory'
+CELLS = {'cellsmall': ('S', 5), 'cellmedium': ('M', 10)}
+
+
+class StandInEvents:
+    def __init__(self):
+        self.entries = 0
+        self.lock = threading.Lock()
+
+    def put_events(self, Entries):
+        with self.lock:
+            self.entries += len(Entries)
+        return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(i)} for i in range(len(Entries))]}
+
+
+class StandInSsm:
+    def __init__(self):
+        self.calls = 0
+
+    def get_parameter(self, Name):
+        self.calls += 1
+        return {'Parameter': {'Value': '1.0.0'}}
+
+
+class CallCounter:
+    """Counts the DynamoDB API calls made through the clients the handler uses"""
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+
+    def attach(self, client):
+        client.meta.events.register('before-call.dynamodb', self)
+
+
+def create_table(dynamodb):
+    """The cell management table with the GSIs as defined in cell-management-system-stack.ts"""
+    existing = dynamodb.meta.client.list_tables()['TableNames']
+    if TABLE_NAME in existing:
+        dynamodb.Table(TABLE_NAME).delete()
+        dynamodb.Table(TABLE_NAME).wait_until_not_exists()
+    gsi = lambda name, pk, sk: {
+        'IndexName': name,
+        'KeySchema': [{'AttributeName': pk, 'KeyType': 'HASH'}, {'AttributeName': sk, 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'}
+    }
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'}
+                              for name in ('PK', 'cell_id', 'tenant_id', 'item_type')],
+        GlobalSecondaryIndexes=[
+            gsi('TenantsByCellIdIndex', 'cell_id', 'tenant_id'),
+            gsi('CellsByItemTypeIndex', 'item_type', 'PK'),
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    for wave, (cell_id, (size, capacity)) in enumerate(CELLS.items(), start=1):
+        table.put_item(Item={'PK': cell_id, 'item_type': 'cell', 'cell_name': cell_id, 'cell_size': size,
+                             'wave_number': wave, 'current_status': 'available', 'cell_utilization': 0,
+                             'cell_max_capacity': capacity})
+    return table
+
+
+def create_directory_table(dynamodb):
+    """The tenant directory, tenant_id to the cell holding the tenant"""
+    if DIRECTORY_TABLE_NAME in dynamodb.meta.client.list_tables()['TableNames']:
+        dynamodb.Table(DIRECTORY_TABLE_NAME).delete()
+        dynamodb.Table(DIRECTORY_TABLE_NAME).wait_until_not_exists()
+    table = dynamodb.create_table(
+        TableName=DIRECTORY_TABLE_NAME,
+        KeySchema=[{'AttributeName': 'tenant_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'tenant_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def load_handler(name, source, counter):
+    sys.path.insert(0, os.path.join(REPO_ROOT, HANDLER_DIR))
+    sys.path.insert(0, os.path.join(REPO_ROOT, LAYER_DIR))
+    module = types.ModuleType(name)
+    exec(compile(source, name, 'exec'), module.__dict__)
+    module.eventbridge_client = StandInEvents()
+    module.ssm_client = StandInSsm()
+    counter.attach(module.dynamodb.meta.client)
+    if hasattr(module, 'dynamodb_client'):
+        counter.attach(module.dynamodb_client)
+    return module
+
+
+def request(cell_id, i):
+    body = {'TenantName': 'tenant{}'.format(i), 'TenantTier': 'basic', 'TenantEmail': 'tenant{}@example.com'.format(i)}
+    if cell_id:
+        body['CellId'] = cell_id
+    return {'body': json.dumps(body)}
+
+
+def run(name, source, table, threads, requests):
+    counter = CallCounter()
+    module = load_handler(name, source, counter)
+    # explicit cells, plus placed tenants when the handler supports placement
+    targets = list(CELLS) + ([None] if 'place_tenant' in source else [])
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        responses = list(pool.map(lambda i: module.handler(request(targets[i % len(targets)], i), None), range(requests)))
+
+    accepted = [json.loads(response['body']) for response in responses if response['statusCode'] == 200]
+    ok = True
+    print('== {} =='.format(name))
+    for cell_id, (_, capacity) in CELLS.items():
+        cell = table.get_item(Key={'PK': cell_id}, ConsistentRead=True)['Item']
+        tenants = [item for item in table.scan(ConsistentRead=True)['Items'] if item.get('cell_id') == cell_id]
+        priorities = [item['tenant_listener_priority'] for item in tenants]
+        accepted_here = sum(1 for response in accepted if response['CellId'] == cell_id)
+        checks = {
+            'within capacity': int(cell['cell_utilization']) <= capacity,
+            'utilization matches tenants': int(cell['cell_utilization']) == len(tenants),
+            'every 200 recorded': accepted_here == len(tenants),
+            'unique priorities': len(set(priorities)) == len(priorities),
+        }
+        ok = ok and all(checks.values())
+        print('  {:<10} capacity {:>3} utilization {:>3} tenants {:>3} accepted {:>3}  {}'.format(
+            cell_id, capacity, int(cell['cell_utilization']), len(tenants), accepted_here,
+            ', '.join('{} {}'.format(check, 'ok' if passed else 'FAILED') for check, passed in checks.items())))
+    print('  {} requests, {} accepted, {:.1f} DynamoDB calls per request, {} SSM calls'.format(
+        requests, len(accepted), counter.calls / requests, module.ssm_client.calls))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint-url', default='http://localhost:8000')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--baseline-ref', help='git revision of a handler to compare against, e.g. the first commit')
+    args = parser.parse_args()
+
+    # the handler's clients are created at import, pointed at DynamoDB Local through the environment
+    os.environ.update({'AWS_ENDPOINT_URL_DYNAMODB': args.endpoint_url, 'AWS_DEFAULT_REGION': 'us-east-1',
+                       'AWS_ACCESS_KEY_ID': 'local', 'AWS_SECRET_ACCESS_KEY': 'local',
+                       'CELL_MANAGEMENT_TABLE': TABLE_NAME, 'CELL_MANAGEMENT_TABLE_NAME': TABLE_NAME,
+                       'TENANT_DIRECTORY_TABLE_NAME': DIRECTORY_TABLE_NAME,
+                       'CELL_MANAGEMENT_BUS': 'local', 'IMAGE_VER_SSM_PARAM_NAME': 'local'})
+    dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+
+    ok = True
+    if args.baseline_ref:
+        source = subprocess.check_output(['git', 'show', '{}:{}'.format(args.baseline_ref, HANDLER_PATH)], cwd=REPO_ROOT, text=True)
+        # the baseline's overfill is the point of comparison, it doesn't fail the run
+        run('before ({})'.format(args.baseline_ref[:10]), source, create_table(dynamodb), args.threads, args.requests)
+    with open(os.path.join(REPO_ROOT, HANDLER_PATH)) as f:
+        source = f.read()
+    table = create_table(dynamodb)
+    directory = create_directory_table(dynamodb)
+    ok = run('current', source, table, args.threads, args.requests)
+    table.delete()
+    directory.delete()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
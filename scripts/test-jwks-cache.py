@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Checks the JWKS cache the cell and control plane authorizers share (the jwks_cache module of the
+auth-policy layer) against a local jwks.json, no Cognito pool needed.
+
+Serves RSA keys as jwks.json from a local HTTP server (requests for the user pool's jwks.json are routed
+to it) and runs the authorizer handler with tokens signed by them, counting the fetches:
+  - a token signed with a kid missing from the cached key set (a rotated signing key) triggers one refresh
+  - forced refreshes for unknown kids are rate limited to one per JWKS_REFRESH_MIN_INTERVAL_SECONDS
+  - concurrent cold starts and concurrent kid misses share a single fetch
+  - an expired key set is re-fetched, and a failed refresh keeps serving the cached keys
+
+Requires python-jose[cryptography] (as in the authorizers' requirements.txt). Run from the repo root:
+    python3 scripts/test-jwks-cache.py [--threads N]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+AUTH_POLICY_LAYER = os.path.join(REPO_ROOT, 'lib/application-plane/cell-app-plane/cdk/layers/auth-policy')
+AUTHORIZERS = {
+    'cell': {
+        'path': os.path.join(REPO_ROOT, 'lib/application-plane/cell-app-plane/cdk/lambdas/authorizer.py'),
+        'methodArn': 'arn:aws:execute-api:us-east-1:123456789012:abcdef1234/prod/GET/product',
+        'role': 'TenantUser',
+    },
+    'control-plane': {
+        'path': os.path.join(REPO_ROOT, 'lib/saas-management/cell-management-system/src/lambdas/Authorizer/controlPlaneAuthorizer.py'),
+        'methodArn': 'arn:aws:execute-api:us-east-1:123456789012:fedcba4321/prod/GET/ListCells',
+        'role': 'SystemAdmin',
+    },
+}
+REGION = 'us-east-1'
+USER_POOL_ID = 'us-east-1_jwkscache'
+APP_CLIENT_ID = 'jwkscacheclient'
+# short enough for the checks to wait them out
+REFRESH_MIN_INTERVAL_SECONDS = 1
+CACHE_TTL_SECONDS = 3
+FETCH_DELAY_SECONDS = 0.3
+
+
+class JwksServer:
+    """Serves the public keys of the current key set as jwks.json, slowly, and counts the fetches"""
+
+    def __init__(self):
+        self.keys = []
+        self.fetches = 0
+        self.failing = False
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.fetches += 1
+                    body = json.dumps({'keys': [key['public'] for key in server.keys]}).encode('utf-8')
+                    failing = server.failing
+                # a slow endpoint widens the window in which concurrent refreshes could pile up
+                time.sleep(FETCH_DELAY_SECONDS)
+                self.send_response(500 if failing else 200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class LocalJwksHandler(urllib.request.BaseHandler):
+    """Routes the authorizers' https requests for the Cognito jwks.json to the local server"""
+    handler_order = 100
+
+    def __init__(self, jwks_url):
+        self.jwks_url = jwks_url
+        self.opener = urllib.request.build_opener()
+
+    def https_open(self, req):
+        if req.full_url.endswith('/.well-known/jwks.json'):
+            return self.opener.open(self.jwks_url, timeout=req.timeout)
+        return None
+
+
+def generate_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()).decode('utf-8')
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk = {k: v.decode('utf-8') if isinstance(v, bytes) else v for k, v in public_jwk.items()}
+    public_jwk.update({'kid': kid, 'use': 'sig'})
+    return {'kid': kid, 'private': private_pem, 'public': public_jwk}
+
+
+def mint_token(key, role):
+    """Mints a distinct Cognito-shaped ID token, so the verified token cache never answers for the JWKS"""
+    now = int(time.time())
+    tenant_id = 'tenant-{}'.format(uuid.uuid4().hex[:8])
+    claims = {
+        'sub': str(uuid.uuid4()),
+        'aud': APP_CLIENT_ID,
+        'iss': 'https://cognito-idp.{}.amazonaws.com/{}'.format(REGION, USER_POOL_ID),
+        'token_use': 'id',
+        'iat': now,
+        'exp': now + 3600,
+        'cognito:username': 'user-{}'.format(tenant_id),
+        'custom:tenantId': tenant_id,
+        'custom:role': role,
+    }
+    return jwt.encode(claims, key['private'], algorithm='RS256', headers={'kid': key['kid']})
+
+
+def load_authorizer(name, jwks_url):
+    os.environ['AWS_REGION'] = REGION
+    os.environ['IDP_DETAILS'] = json.dumps({'name': 'Cognito', 'details': {'userPoolId': USER_POOL_ID, 'appClientId': APP_CLIENT_ID}})
+    os.environ['JWKS_REFRESH_MIN_INTERVAL_SECONDS'] = str(REFRESH_MIN_INTERVAL_SECONDS)
+    os.environ['JWKS_CACHE_TTL_SECONDS'] = str(CACHE_TTL_SECONDS)
+    urllib.request.install_opener(urllib.request.build_opener(LocalJwksHandler(jwks_url)))
+    if AUTH_POLICY_LAYER not in sys.path:
+        sys.path.insert(0, AUTH_POLICY_LAYER)
+    spec = importlib.util.spec_from_file_location('{}_authorizer'.format(name.replace('-', '_')), AUTHORIZERS[name]['path'])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Checker:
+    def __init__(self, name, server, threads):
+        self.name = name
+        self.server = server
+        self.threads = threads
+        self.module = load_authorizer(name, server.url)
+        self.failures = 0
+
+    def tokens(self, key, count):
+        # minted up front, signing takes long enough to let the refresh interval run out mid-check
+        return [mint_token(key, AUTHORIZERS[self.name]['role']) for _ in range(count)]
+
+    def authorize(self, token):
+        event = {'type': 'TOKEN', 'authorizationToken': 'Bearer ' + token, 'methodArn': AUTHORIZERS[self.name]['methodArn']}
+        try:
+            return self.module.handler(event, None)['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+        except Exception:
+            return False
+
+    def authorize_concurrently(self, tokens):
+        barrier = threading.Barrier(len(tokens))
+
+        def run(token):
+            barrier.wait()
+            return self.authorize(token)
+        with ThreadPoolExecutor(max_workers=len(tokens)) as executor:
+            return list(executor.map(run, tokens))
+
+    def authorize_all(self, tokens):
+        return [self.authorize(token) for token in tokens]
+
+    def check(self, description, condition, fetches, expected_fetches):
+        ok = condition and fetches == expected_fetches
+        self.failures += 0 if ok else 1
+        print('  {:<4} {:<66} fetches {} (expected {})'.format('ok' if ok else 'FAIL', description, fetches, expected_fetches))
+
+    def measure(self, fn):
+        before = self.server.fetches
+        result = fn()
+        return result, self.server.fetches - before
+
+    def run(self):
+        print('== {} authorizer =='.format(self.name))
+        key_a, key_b, key_c = generate_key('key-a'), generate_key('key-b'), generate_key('key-c')
+        self.server.keys = [key_a]
+
+        tokens = self.tokens(key_a, self.threads)
+        allowed, fetches = self.measure(lambda: self.authorize_concurrently(tokens))
+        self.check('{} concurrent cold calls share one fetch'.format(self.threads), all(allowed), fetches, 1)
+
+        tokens = self.tokens(key_a, 10)
+        allowed, fetches = self.measure(lambda: self.authorize_all(tokens))
+        self.check('warm calls with a cached kid do not fetch', all(allowed), fetches, 0)
+
+        # the pool rotates its signing key; wait out the refresh interval of the cold start
+        tokens = self.tokens(key_b, self.threads)
+        unknown_tokens = self.tokens(key_c, 10)
+        time.sleep(REFRESH_MIN_INTERVAL_SECONDS + 0.1)
+        self.server.keys = [key_a, key_b]
+        allowed, fetches = self.measure(lambda: self.authorize_concurrently(tokens))
+        self.check('{} concurrent calls with a new kid share one refresh'.format(self.threads), all(allowed), fetches, 1)
+
+        allowed, fetches = self.measure(lambda: self.authorize_all(unknown_tokens))
+        self.check('unknown kid within the refresh interval is denied without a fetch', not any(allowed), fetches, 0)
+
+        unknown_tokens = self.tokens(key_c, 10)
+        time.sleep(REFRESH_MIN_INTERVAL_SECONDS + 0.1)
+        allowed, fetches = self.measure(lambda: self.authorize_all(unknown_tokens))
+        self.check('unknown kid after the interval refreshes once, then is rate limited', not any(allowed), fetches, 1)
+
+        tokens = self.tokens(key_a, 5)
+        time.sleep(CACHE_TTL_SECONDS + 0.1)
+        allowed, fetches = self.measure(lambda: self.authorize_all(tokens))
+        self.check('an expired key set is re-fetched once', all(allowed), fetches, 1)
+
+        tokens = self.tokens(key_b, 5)
+        time.sleep(CACHE_TTL_SECONDS + 0.1)
+        self.server.failing = True
+        allowed, fetches = self.measure(lambda: self.authorize_all(tokens))
+        self.server.failing = False
+        self.check('a failed refresh keeps serving the cached keys', all(allowed), fetches, 1)
+        return self.failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--authorizer', choices=list(AUTHORIZERS), action='append')
+    args = parser.parse_args()
+
+    failures = 0
+    for name in args.authorizer or list(AUTHORIZERS):
+        server = JwksServer()
+        try:
+            failures += Checker(name, server, args.threads).run()
+        finally:
+            server.close()
+    print('{} checks failed'.format(failures) if failures else 'all checks passed')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
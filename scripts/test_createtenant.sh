@@ -1,22 +1,22 @@
 #!/bin/bash -e
 
 if [ -z "$1" ]; then
-  echo "Usage: $0 <cellId> <tenantName> <tenantEmail> <tenantTier>"
+  echo "Usage: $0 <cellId|auto> <tenantName> <tenantEmail> <tenantTier>"
   exit 1
 fi
 
 if [ -z "$2" ]; then
-  echo "Usage: $1 <cellId> <tenantName> <tenantEmail> <tenantTier>"
+  echo "Usage: $1 <cellId|auto> <tenantName> <tenantEmail> <tenantTier>"
   exit 1
 fi
 
 if [ -z "$3" ]; then
-  echo "Usage: $0 <cellId> <tenantName> <tenantEmail> <tenantTier>"
+  echo "Usage: $0 <cellId|auto> <tenantName> <tenantEmail> <tenantTier>"
   exit 1
 fi
 
 if [ -z "$4" ]; then
-  echo "Usage: $0 <cellId> <tenantName> <tenantEmail> <tenantTier>"
+  echo "Usage: $0 <cellId|auto> <tenantName> <tenantEmail> <tenantTier>"
   exit 1
 fi
 
@@ -57,7 +57,8 @@ if [ "$DATA" != "$USER" ]; then
     # create user
     CREATE_ADMIN=$(aws cognito-idp admin-create-user \
         --user-pool-id "$USER_POOL_ID" \
-        --username "$USER" )
+        --username "$USER" \
+        --user-attributes Name=custom:role,Value=SystemAdmin)
         
 
     # remove need for password reset
@@ -87,12 +88,20 @@ echo "CELL_MANAGEMENT_API_ENDPOINT: ${CELL_MANAGEMENT_API_ENDPOINT}"
 
 # echo "creating tenant..."
 
-TENANT_ID=$(curl --request POST \
+# with 'auto' the CellId is left out and the cell management system chooses the cell
+if [ "$CELL_ID" == "auto" ]; then
+  CELL_FIELD=""
+else
+  CELL_FIELD="\"CellId\":\"$CELL_ID\","
+fi
+
+RESPONSE=$(curl --request POST \
     --url "${CELL_MANAGEMENT_API_ENDPOINT}AssignTenantToCell" \
     --header "Authorization: Bearer ${ID_TOKEN}" \
     --header 'content-type: application/json' \
-    --data "{\"CellId\":\"$CELL_ID\",\"TenantName\":\"$TENANT_NAME\",\"TenantEmail\": \"$TENANT_EMAIL\",\"TenantTier\":\"$TENANT_TIER\"}" \
-    | jq -r '.TenantId')
+    --data "{${CELL_FIELD}\"TenantName\":\"$TENANT_NAME\",\"TenantEmail\": \"$TENANT_EMAIL\",\"TenantTier\":\"$TENANT_TIER\"}")
+TENANT_ID=$(echo $RESPONSE | jq -r '.TenantId')
+CELL_ID=$(echo $RESPONSE | jq -r '.CellId')
 
 echo "TENANT ID: ${TENANT_ID}"
 echo $TENANT_ID > tenant_id.txt